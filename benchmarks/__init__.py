@@ -0,0 +1 @@
+"""Офлайн-бенчмарки с локальным fake OpenAI сервером"""
@@ -0,0 +1,159 @@
+"""
+Бенчмарк рендеринга экспорта: текущий экспортер против версии из git
+
+Курс из фикстур масштабируется до --modules модулей (контент модуля и
+материалы урока - пропорционально), каждый метод экспорта вызывается
+--repeat раз. Для каждой версии выводятся p50 и среднее время рендеринга
+и пик памяти, выделенной за один рендеринг с кодированием в UTF-8
+(tracemalloc). Для текущего экспортера отдельно - пик памяти потокового
+варианта export_*_stream во временный файл, как при отправке документа.
+
+Версия для сравнения берётся из git (`git show <rev>:exporters.py`),
+поэтому прежний экспортер не нужно держать в дереве.
+
+Пример:
+    python -m benchmarks.export_render --modules 100 --against HEAD~1
+"""
+
+import argparse
+import importlib.util
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.run import EXPORT_METHODS, BenchmarkContext  # noqa: E402
+
+
+def scale_context(ctx: BenchmarkContext, modules: int) -> BenchmarkContext:
+    """Повторяет модули курса, лекции модуля и темы урока до нужного размера"""
+    factor = max(1, modules // len(ctx.course.modules))
+    course_modules = (ctx.course.modules * (modules // len(ctx.course.modules) + 1))[:modules]
+    ctx.course = ctx.course.copy(update={"modules": course_modules})
+
+    lectures = ctx.module_content.lectures * factor
+    ctx.module_content = ctx.module_content.copy(update={
+        "lectures": lectures,
+        "total_slides": sum(len(lecture.slides) for lecture in lectures),
+    })
+    topics = ctx.lesson_content.topics * factor
+    ctx.lesson_content = ctx.lesson_content.copy(update={"topics": topics, "total_topics": len(topics)})
+    return ctx
+
+
+def load_exporter(rev: str):
+    """CourseExporter из exporters.py указанной ревизии git"""
+    source = subprocess.run(
+        ["git", "show", f"{rev}:exporters.py"], cwd=ROOT, check=True, capture_output=True, text=True
+    ).stdout
+    with tempfile.NamedTemporaryFile("w", suffix=".py", delete=False, encoding="utf-8") as f:
+        f.write(source)
+    try:
+        spec = importlib.util.spec_from_file_location(f"exporters_{rev.replace('~', '_')}", f.name)
+        module = importlib.util.module_from_spec(spec)
+        # Шаблоны ревизии ищутся рядом с файлом - подставляем каталог текущего дерева
+        module.__dict__["__file__"] = os.path.join(ROOT, "exporters.py")
+        spec.loader.exec_module(module)
+    finally:
+        os.unlink(f.name)
+    return module.CourseExporter()
+
+
+def peak_memory(func: Callable) -> float:
+    """Пик памяти, выделенной за вызов func (КБ)"""
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024
+
+
+def stream_to_file(stream, model):
+    """Потоковый экспорт во временный файл, как в export_pool"""
+    from export_pool import EXPORT_SPOOL_SIZE
+
+    with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE) as document:
+        stream(model, document)
+
+
+def measure(method, model, repeat: int) -> Dict[str, Any]:
+    """Время рендеринга и пик памяти одного вызова"""
+    method(model)  # прогрев
+
+    latencies: List[float] = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        method(model)
+        latencies.append(time.perf_counter() - started)
+
+    latencies.sort()
+    return {
+        "p50": latencies[len(latencies) // 2],
+        "mean": sum(latencies) / len(latencies),
+        "peak_kb": peak_memory(lambda: method(model).encode("utf-8")),
+    }
+
+
+def _model_for(ctx: BenchmarkContext, method_name: str):
+    if "module_content" in method_name:
+        return ctx.module_content
+    if "lesson_content" in method_name:
+        return ctx.lesson_content
+    return ctx.course
+
+
+def _change(new: float, old: Optional[float]) -> str:
+    return f"{new / old - 1:+.0%}" if old else "-"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Рендеринг экспорта: текущее дерево против ревизии git")
+    parser.add_argument("--modules", type=int, default=100, help="Модулей в курсе")
+    parser.add_argument("--repeat", type=int, default=20, help="Вызовов на метод")
+    parser.add_argument("--against", help="Ревизия git для сравнения (например HEAD~1)")
+    parser.add_argument("--methods", default="html", help="Методы: html, all или имена через запятую")
+    args = parser.parse_args(argv)
+
+    if args.methods == "all":
+        methods = EXPORT_METHODS
+    elif args.methods == "html":
+        methods = [method for method in EXPORT_METHODS if method.endswith("_html")]
+    else:
+        methods = [method.strip() for method in args.methods.split(",") if method.strip()]
+
+    from exporters import CourseExporter
+
+    ctx = scale_context(BenchmarkContext(), args.modules)
+    current = CourseExporter()
+    baseline = load_exporter(args.against) if args.against else None
+
+    print(f"Модулей: {len(ctx.course.modules)}, слайдов: {ctx.module_content.total_slides}, "
+          f"тем: {ctx.lesson_content.total_topics}\n")
+    header = f"{'Метод':<36} {'p50,мс':>9} {'сред,мс':>9} {'пик,КБ':>9} {'поток,КБ':>9}"
+    if baseline:
+        header += f" {'было p50':>9} {'было пик':>9} {'p50':>6} {'пик':>6}"
+    print(header)
+    print("-" * len(header))
+
+    for name in methods:
+        model = _model_for(ctx, name)
+        row = measure(getattr(current, name), model, args.repeat)
+        stream_peak = peak_memory(lambda: stream_to_file(getattr(current, f"{name}_stream"), model))
+        line = (f"{name:<36} {row['p50'] * 1000:>9.2f} {row['mean'] * 1000:>9.2f} "
+                f"{row['peak_kb']:>9.0f} {stream_peak:>9.0f}")
+        if baseline:
+            old = measure(getattr(baseline, name), model, args.repeat)
+            line += (f" {old['p50'] * 1000:>9.2f} {old['peak_kb']:>9.0f}"
+                     f" {_change(row['p50'], old['p50']):>6} {_change(row['peak_kb'], old['peak_kb']):>6}")
+        print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,338 @@
+"""
+Локальный OpenAI-совместимый сервер для бенчмарков
+
+Отвечает на POST /v1/chat/completions записанными ответами из
+benchmarks/fixtures с настраиваемой задержкой, разбросом, долей
+обрезанных ответов (finish_reason="length") и долей ответов 429.
+Поддерживает потоковые ответы (stream=True) и Function Calling.
+
+Запуск отдельно:
+    python -m benchmarks.fake_openai --port 8765 --latency 1.5 --rate-429 0.05
+    OPENAI_API_BASE=http://127.0.0.1:8765/v1 python course_bot.py
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+# Символов на токен для usage (совпадает с оценкой лимитера)
+CHARS_PER_TOKEN = 3
+
+
+class FakeOpenAIConfig:
+    """Параметры поведения сервера"""
+
+    def __init__(self, latency: float = 0.5, jitter: float = 0.2, truncation_rate: float = 0.0,
+                 rate_429: float = 0.0, tokens_per_second: float = 0.0, retry_after: float = 1.0,
+                 seed: Optional[int] = None):
+        self.latency = latency  # задержка до первого байта ответа, секунды
+        self.jitter = jitter  # разброс задержки: ± доля от latency
+        self.truncation_rate = truncation_rate  # доля ответов, обрезанных по max_tokens
+        self.rate_429 = rate_429  # доля ответов 429
+        self.tokens_per_second = tokens_per_second  # скорость генерации потока (0 - без задержек)
+        self.retry_after = retry_after  # заголовок Retry-After для 429
+        self.seed = seed
+
+
+def prepare_offline_environment():
+    """
+    Окружение для прогона без OpenAI: без кэша LLM, прокси и лимитов аккаунта
+
+    Модули бота читают переменные при импорте, поэтому вызывается до их импорта.
+    Явно заданные значения не перезаписываются.
+    """
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    os.environ.setdefault("LLM_CACHE_ENABLED", "0")
+    os.environ.setdefault("OPENAI_DEFAULT_RPM", "1000000")
+    os.environ.setdefault("OPENAI_DEFAULT_TPM", "1000000000")
+    os.environ.pop("HTTP_PROXY", None)
+    os.environ.pop("HTTPS_PROXY", None)
+
+
+def load_fixtures(directory: str = FIXTURES_DIR) -> List[Dict[str, Any]]:
+    """
+    Загружает записанные ответы
+
+    Каждый файл - {"name": ..., "match": подстрока системного промпта,
+    "content": объект JSON или строка ответа модели}.
+    """
+    fixtures = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        with open(path, encoding="utf-8") as f:
+            fixture = json.load(f)
+        if not isinstance(fixture["content"], str):
+            fixture["content"] = json.dumps(fixture["content"], ensure_ascii=False)
+        fixtures.append(fixture)
+    return fixtures
+
+
+class FakeOpenAIServer:
+    """OpenAI-совместимый сервер на asyncio"""
+
+    def __init__(self, config: Optional[FakeOpenAIConfig] = None,
+                 fixtures: Optional[List[Dict[str, Any]]] = None):
+        self.config = config or FakeOpenAIConfig()
+        self.fixtures = fixtures if fixtures is not None else load_fixtures()
+        self.random = random.Random(self.config.seed)
+        self.stats = {"requests": 0, "rate_limited": 0, "truncated": 0, "completion_tokens": 0}
+        self._lock = threading.Lock()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Set[asyncio.Task] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self.port = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        """Запускает сервер в текущем event loop"""
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+        # Соединения keep-alive сами не закрываются
+        for task in self._connections:
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        if self._server:
+            await self._server.wait_closed()
+
+    def start_in_thread(self) -> "FakeOpenAIServer":
+        """Запускает сервер в отдельном потоке (для синхронных клиентов и чужого event loop)"""
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.start())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="fake-openai", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop_thread(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def reset_stats(self):
+        with self._lock:
+            for key in self.stats:
+                self.stats[key] = 0
+
+    def _count(self, key: str, amount: int = 1):
+        with self._lock:
+            self.stats[key] += amount
+
+    # ---------- HTTP ----------
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Обрабатывает запросы одного соединения (keep-alive)"""
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                path, body = request
+                if not path.rstrip("/").endswith("/chat/completions"):
+                    await self._send_json(writer, 404, {"error": {"message": "not found"}})
+                    continue
+                await self._handle_completion(writer, json.loads(body or b"{}"))
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, bytes]]:
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if not line.strip():
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get("content-length", 0)))
+        return request_line.decode("latin-1").split()[1], body
+
+    async def _send_json(self, writer: asyncio.StreamWriter, status: int, payload: Dict[str, Any],
+                         extra_headers: str = ""):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n{extra_headers}\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+
+    # ---------- Ответы ----------
+
+    async def _handle_completion(self, writer: asyncio.StreamWriter, request: Dict[str, Any]):
+        self._count("requests")
+        await asyncio.sleep(self._delay())
+
+        if self.random.random() < self.config.rate_429:
+            self._count("rate_limited")
+            await self._send_json(
+                writer, 429,
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                f"Retry-After: {self.config.retry_after}\r\n"
+            )
+            return
+
+        content = self._select_content(request)
+        finish_reason = "stop"
+        if self.random.random() < self.config.truncation_rate:
+            content = content[:int(len(content) * self.random.uniform(0.3, 0.9))]
+            finish_reason = "length"
+            self._count("truncated")
+
+        completion_tokens = len(content) // CHARS_PER_TOKEN + 1
+        self._count("completion_tokens", completion_tokens)
+        as_tool_call = bool(request.get("tools"))
+
+        if request.get("stream"):
+            await self._send_stream(writer, request, content, finish_reason, as_tool_call)
+            return
+
+        prompt_tokens = len(json.dumps(request.get("messages", []), ensure_ascii=False)) // CHARS_PER_TOKEN
+        message: Dict[str, Any] = {"role": "assistant", "content": None if as_tool_call else content}
+        if as_tool_call:
+            message["tool_calls"] = [self._tool_call(request, content)]
+        await self._send_json(writer, 200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "gpt-4"),
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+    async def _send_stream(self, writer: asyncio.StreamWriter, request: Dict[str, Any], content: str,
+                           finish_reason: str, as_tool_call: bool):
+        """Ответ в формате SSE, кусками по ~4 токена"""
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n"
+        )
+        chunk_chars = 4 * CHARS_PER_TOKEN
+        delay = chunk_chars / CHARS_PER_TOKEN / self.config.tokens_per_second if self.config.tokens_per_second else 0
+        base = {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": request.get("model", "gpt-4"),
+        }
+
+        for offset in range(0, len(content), chunk_chars):
+            piece = content[offset:offset + chunk_chars]
+            if as_tool_call:
+                tool_call = self._tool_call(request, piece)
+                tool_call["index"] = 0
+                if offset:
+                    tool_call = {"index": 0, "function": {"arguments": piece}}
+                delta = {"tool_calls": [tool_call]}
+            else:
+                delta = {"content": piece}
+            await self._write_event(writer, {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+            if delay:
+                await asyncio.sleep(delay)
+
+        await self._write_event(writer, {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]})
+        await self._write_chunk(writer, b"data: [DONE]\n\n")
+        await self._write_chunk(writer, b"")
+
+    async def _write_event(self, writer: asyncio.StreamWriter, payload: Dict[str, Any]):
+        await self._write_chunk(writer, f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+    @staticmethod
+    async def _write_chunk(writer: asyncio.StreamWriter, data: bytes):
+        writer.write(f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n")
+        await writer.drain()
+
+    @staticmethod
+    def _tool_call(request: Dict[str, Any], arguments: str) -> Dict[str, Any]:
+        name = request["tools"][0]["function"]["name"]
+        return {
+            "id": f"call_{uuid.uuid4().hex[:12]}",
+            "type": "function",
+            "function": {"name": name, "arguments": arguments},
+        }
+
+    def _select_content(self, request: Dict[str, Any]) -> str:
+        """Записанный ответ, подходящий к системному промпту запроса"""
+        system = " ".join(
+            message.get("content") or "" for message in request.get("messages", [])
+            if message.get("role") == "system"
+        )
+        for fixture in self.fixtures:
+            if fixture["match"] in system:
+                return fixture["content"]
+        return json.dumps({"result": "ok"})
+
+    def _delay(self) -> float:
+        jitter = self.config.latency * self.config.jitter
+        return max(0.0, self.config.latency + self.random.uniform(-jitter, jitter))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный OpenAI-совместимый сервер для бенчмарков")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--truncation-rate", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    config = FakeOpenAIConfig(
+        latency=args.latency, jitter=args.jitter, truncation_rate=args.truncation_rate,
+        rate_429=args.rate_429, tokens_per_second=args.tokens_per_second, seed=args.seed
+    )
+
+    async def serve():
+        server = FakeOpenAIServer(config)
+        await server.start(args.host, args.port)
+        logger.info(f"🧪 Fake OpenAI: http://{args.host}:{server.port}/v1 ({len(server.fixtures)} записей)")
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
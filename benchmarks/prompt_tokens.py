@@ -0,0 +1,115 @@
+"""
+Размер промптов по шаблонам: токены, кэшируемый префикс и компактная схема
+
+Для каждого шаблона строятся два запроса с разными входными данными из
+фикстур. Общий префикс этих запросов - то, что провайдер может взять из
+кэша (OpenAI кэширует префиксы от 1024 токенов). Для сравнения запросы
+строятся и с компактной схемой ответа (PROMPT_COMPACT_SCHEMA=1).
+
+Токены считаются utils.tokens (tiktoken, если доступен, иначе оценка
+по длине текста - колонка "токенизатор").
+
+Пример:
+    python -m benchmarks.prompt_tokens
+"""
+
+import os
+import sys
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_openai import prepare_offline_environment  # noqa: E402
+
+prepare_offline_environment()
+
+# Минимальный префикс, который кэширует OpenAI
+PROVIDER_CACHE_MIN_TOKENS = 1024
+
+RequestBuilder = Callable[[int], Dict[str, Any]]
+
+
+def _template_builders() -> Dict[str, RequestBuilder]:
+    """Шаблон -> функция, строящая запрос по номеру входных данных (0 или 1)"""
+    from benchmarks.run import BenchmarkContext
+    from content_generator import ContentGenerator
+    from handlers.callback_regeneration import _slide_messages, _slides_batch_messages
+
+    ctx = BenchmarkContext()
+    generator = ContentGenerator()
+    course = ctx.course
+    lecture = ctx.module_content.lectures[0]
+    outline = ctx.lesson.content_outline
+
+    builders: Dict[str, RequestBuilder] = {}
+    for strategy in ContentGenerator.MODULE_STRATEGIES:
+        builders[f"module_content:{strategy}"] = (
+            lambda i, strategy=strategy: generator._build_strategy_request(
+                strategy, course.modules[i], course.course_title, course.target_audience
+            )
+        )
+    builders["topic_material"] = lambda i: generator._build_topic_requests(
+        i + 1, outline[i], ctx.lesson, course.course_title, ctx.module.module_title, course.target_audience
+    )[0]
+    builders["slide_regeneration"] = lambda i: {
+        "model": "gpt-4",
+        "messages": _slide_messages(course, ctx.module_content, lecture, lecture.slides[i], None),
+    }
+    builders["slides_regeneration"] = lambda i: {
+        "model": "gpt-4",
+        "messages": _slides_batch_messages(course, ctx.module_content, lecture, lecture.slides[i * 2:i * 2 + 2]),
+    }
+    return builders
+
+
+def _prompt_text(request: Dict[str, Any]) -> str:
+    return "\n".join(str(message.get("content") or "") for message in request.get("messages", []))
+
+
+def _common_prefix_tokens(first: Dict[str, Any], second: Dict[str, Any]) -> int:
+    """Токены общего префикса двух запросов"""
+    from utils.tokens import count_tokens
+
+    a, b = _prompt_text(first), _prompt_text(second)
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return count_tokens(a[:length], first.get("model", "gpt-4"))
+
+
+def measure(compact: bool) -> List[Tuple[str, int, int]]:
+    """(шаблон, токены промпта, токены общего префикса) для режима схемы"""
+    import prompts
+    from utils.tokens import count_prompt_tokens
+
+    prompts.PROMPT_COMPACT_SCHEMA = compact
+    rows = []
+    for name, build in _template_builders().items():
+        first, second = build(0), build(1)
+        rows.append((name, count_prompt_tokens(first), _common_prefix_tokens(first, second)))
+    return rows
+
+
+def main() -> int:
+    from utils.tokens import tokenizer_name
+
+    full = measure(compact=False)
+    compact = measure(compact=True)
+
+    print(f"Токенизатор: {tokenizer_name()}\n")
+    header = (f"{'Шаблон':<32} {'токены':>7} {'префикс':>8} {'доля':>5} "
+              f"{'компакт':>8} {'префикс':>8} {'экономия':>9}")
+    print(header)
+    print("-" * len(header))
+    for (name, tokens, prefix), (_, compact_tokens, compact_prefix) in zip(full, compact):
+        mark = "" if prefix >= PROVIDER_CACHE_MIN_TOKENS else " *"
+        print(f"{name:<32} {tokens:>7} {prefix:>8} {prefix / tokens:>5.0%} "
+              f"{compact_tokens:>8} {compact_prefix:>8} {1 - compact_tokens / tokens:>9.0%}{mark}")
+    print(f"\n* префикс короче {PROVIDER_CACHE_MIN_TOKENS} токенов - провайдер его не кэширует")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
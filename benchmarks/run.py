@@ -0,0 +1,407 @@
+"""
+Офлайн-бенчмарк генерации и экспорта
+
+Поднимает локальный fake OpenAI сервер (benchmarks/fake_openai.py) и
+прогоняет сценарии генерации и экспорта с заданной параллельностью.
+Для каждого сценария выводит p50/p95/p99 латентности, пропускную
+способность, токены в секунду и пик памяти.
+
+Примеры:
+    python -m benchmarks.run
+    python -m benchmarks.run --scenarios module_content_async,lesson_topics_async \\
+        --requests 64 --concurrency 16 --latency 2 --rate-429 0.05 --truncation-rate 0.1
+    python -m benchmarks.run --json results.json
+    python -m benchmarks.run --baseline results.json --max-regression 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_openai import (  # noqa: E402
+    FakeOpenAIConfig, FakeOpenAIServer, load_fixtures, prepare_offline_environment
+)
+
+# Бенчмарк не должен ходить в кэш и упираться в лимиты настоящего аккаунта
+prepare_offline_environment()
+
+logger = logging.getLogger(__name__)
+
+GENERATION_SCENARIOS = [
+    "course_structure",
+    "course_structure_async",
+    "module_content",
+    "module_content_async",
+    "module_content_stream",
+    "lesson_topics",
+    "lesson_topics_async",
+]
+
+EXPORT_METHODS = [
+    "export_to_json",
+    "export_to_markdown",
+    "export_to_html",
+    "export_to_txt",
+    "export_module_content_to_json",
+    "export_module_content_to_html",
+    "export_module_content_to_markdown",
+    "export_module_content_to_txt",
+    "export_lesson_content_to_json",
+    "export_lesson_content_to_html",
+    "export_lesson_content_to_markdown",
+    "export_lesson_content_to_txt",
+]
+
+DEFAULT_SCENARIOS = GENERATION_SCENARIOS + [f"export:{method}" for method in EXPORT_METHODS]
+
+# Экспорт через пул процессов (export_pool.export_document): передача данных и рендеринг вне event loop
+ALL_SCENARIOS = DEFAULT_SCENARIOS + [f"export_pool:{method}" for method in EXPORT_METHODS]
+
+
+class ScenarioResult:
+    """Замеры одного сценария"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.fallbacks = 0
+        self.wall_time = 0.0
+        self.completion_tokens = 0
+        self.peak_memory_mb: Optional[float] = None
+
+    def summary(self) -> Dict[str, Any]:
+        from utils.latency import percentile
+
+        count = len(self.latencies)
+        return {
+            "requests": count,
+            "errors": self.errors,
+            "fallbacks": self.fallbacks,
+            "p50": percentile(self.latencies, 50),
+            "p95": percentile(self.latencies, 95),
+            "p99": percentile(self.latencies, 99),
+            "throughput_rps": count / self.wall_time if self.wall_time else None,
+            "tokens_per_second": self.completion_tokens / self.wall_time if self.wall_time else None,
+            "peak_memory_mb": self.peak_memory_mb,
+        }
+
+
+class BenchmarkContext:
+    """Входные данные сценариев, построенные из записанных ответов"""
+
+    def __init__(self):
+        from models import Course, LessonContent, ModuleContent, Lecture, TopicMaterial
+
+        fixtures = {fixture["name"]: json.loads(fixture["content"]) for fixture in load_fixtures()}
+        self.course = Course(**fixtures["course_structure"])
+        self.module = self.course.modules[0]
+        self.lesson = self.module.lessons[0]
+
+        lectures = [Lecture(**lecture) for lecture in fixtures["module_content"]["lectures"]]
+        self.module_content = ModuleContent(
+            module_number=self.module.module_number,
+            module_title=self.module.module_title,
+            lectures=lectures,
+            total_slides=sum(len(lecture.slides) for lecture in lectures),
+            estimated_duration_minutes=sum(lecture.duration_minutes for lecture in lectures),
+        )
+        topics = [
+            TopicMaterial(**{**fixtures["topic_material"], "topic_number": i, "topic_title": title})
+            for i, title in enumerate(self.lesson.content_outline, 1)
+        ]
+        self.lesson_content = LessonContent(
+            lesson_title=self.lesson.lesson_title,
+            lesson_goal=self.lesson.lesson_goal,
+            lesson_number=1,
+            module_number=self.module.module_number,
+            topics=topics,
+            total_topics=len(topics),
+            total_estimated_time_minutes=sum(topic.estimated_reading_time_minutes for topic in topics),
+        )
+
+
+def build_scenario(name: str, ctx: BenchmarkContext) -> Callable:
+    """
+    Функция одного запроса сценария
+
+    Возвращает корутинную функцию для асинхронных сценариев
+    и обычную - для синхронных (выполняются в пуле потоков).
+    """
+    from content_generator import ContentGenerator
+    from exporters import CourseExporter
+    from openai_client import OpenAIClient, get_async_openai_client
+
+    course_args = ("Асинхронный Python", "middle", 4)
+    module_args = (ctx.module, ctx.course.course_title, ctx.course.target_audience)
+    lesson_args = (ctx.lesson, ctx.module.module_number, ctx.course.course_title,
+                   ctx.module.module_title, ctx.course.target_audience)
+
+    if name == "course_structure":
+        client = OpenAIClient()
+        return lambda: client.generate_course_structure(*course_args)
+    if name == "course_structure_async":
+        return lambda: get_async_openai_client().generate_course_structure(*course_args, use_cache=False)
+
+    generator = ContentGenerator()
+    if name == "module_content":
+        return lambda: generator.generate_module_content(*module_args)
+    if name == "module_content_async":
+        return lambda: generator.generate_module_content_async(*module_args, use_cache=False)
+    if name == "module_content_stream":
+        async def on_progress(progress):
+            pass
+        return lambda: generator.generate_module_content_async(*module_args, use_cache=False,
+                                                               on_progress=on_progress)
+    if name == "lesson_topics":
+        return lambda: generator.generate_lesson_detailed_content(*lesson_args)
+    if name == "lesson_topics_async":
+        return lambda: generator.generate_lesson_detailed_content_async(*lesson_args, use_cache=False)
+
+    if name.startswith("export_pool:"):
+        from export_pool import ExportPool
+        # Фикстуры меньше порога inline-рендеринга - отправляем в пул всегда
+        pool = ExportPool(inline_max_weight=-1)
+        method_name = name.split(":", 1)[1]
+        model = (ctx.module_content if "module_content" in method_name
+                 else ctx.lesson_content if "lesson_content" in method_name else ctx.course)
+        async def render_document():
+            async with pool.document(method_name, model) as document:
+                return len(document.read())
+        return render_document
+
+    if name.startswith("export:"):
+        method = getattr(CourseExporter(), name.split(":", 1)[1])
+        if "module_content" in method.__name__:
+            return lambda: method(ctx.module_content)
+        if "lesson_content" in method.__name__:
+            return lambda: method(ctx.lesson_content)
+        return lambda: method(ctx.course)
+
+    raise ValueError(f"Неизвестный сценарий: {name}")
+
+
+def _is_async_scenario(name: str) -> bool:
+    return name.endswith("_async") or name.endswith("_stream") or name.startswith("export_pool:")
+
+
+async def run_scenario(name: str, func: Callable, requests: int, concurrency: int,
+                       server: FakeOpenAIServer, trace_memory: bool) -> ScenarioResult:
+    """
+    Выполняет requests вызовов func, не более concurrency одновременно
+
+    Синхронные сценарии выполняются в пуле из concurrency потоков,
+    асинхронные - в event loop бенчмарка.
+    """
+    result = ScenarioResult(name)
+    fallbacks_before = _fallback_count()
+    server.reset_stats()
+    if trace_memory:
+        tracemalloc.start()
+
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    executor = None if _is_async_scenario(name) else ThreadPoolExecutor(max_workers=concurrency)
+
+    async def one_call():
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                if executor is None:
+                    value = await func()
+                else:
+                    value = await loop.run_in_executor(executor, func)
+                if value is None:
+                    result.errors += 1
+            except Exception as e:
+                result.errors += 1
+                logger.warning(f"{name}: {e}")
+            result.latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one_call() for _ in range(requests)))
+    result.wall_time = time.perf_counter() - started
+    if executor is not None:
+        executor.shutdown()
+
+    if trace_memory:
+        result.peak_memory_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    result.completion_tokens = server.stats["completion_tokens"]
+    result.fallbacks = int(_fallback_count() - fallbacks_before)
+    return result
+
+
+def _fallback_count() -> float:
+    """Сколько раз использован тестовый контент вместо ответа модели"""
+    from utils.metrics import get_metrics
+
+    fallbacks = get_metrics().fallbacks
+    return sum(fallbacks.value(kind=kind) for kind in ("course_structure", "module_content", "topic_material"))
+
+
+def _max_rss_mb() -> Optional[float]:
+    """Пик резидентной памяти процесса (high-water mark)"""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux возвращает КиБ, macOS - байты
+    return max_rss / 2 ** 20 if sys.platform == "darwin" else max_rss / 2 ** 10
+
+
+def _fmt(value: Optional[float], digits: int = 3) -> str:
+    return "-" if value is None else f"{value:.{digits}f}"
+
+
+def print_report(results: Dict[str, Dict[str, Any]], baseline: Optional[Dict[str, Dict[str, Any]]] = None):
+    header = f"{'Сценарий':<42} {'N':>4} {'ошиб':>4} {'fallb':>5} {'p50,с':>8} {'p95,с':>8} {'p99,с':>8} {'RPS':>8} {'ток/с':>9} {'пам,МБ':>7}"
+    print(header)
+    print("-" * len(header))
+    for name, row in results.items():
+        line = (
+            f"{name:<42} {row['requests']:>4} {row['errors']:>4} {row['fallbacks']:>5} "
+            f"{_fmt(row['p50']):>8} {_fmt(row['p95']):>8} {_fmt(row['p99']):>8} "
+            f"{_fmt(row['throughput_rps'], 1):>8} {_fmt(row['tokens_per_second'], 0):>9} "
+            f"{_fmt(row['peak_memory_mb'], 1):>7}"
+        )
+        if baseline and name in baseline and baseline[name]["p95"]:
+            change = row["p95"] / baseline[name]["p95"] - 1 if row["p95"] is not None else None
+            line += f"  p95 {change:+.0%}" if change is not None else ""
+        print(line)
+
+
+def find_regressions(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+                     max_regression: float) -> List[str]:
+    """Сценарии, у которых p95 или пропускная способность хуже базовой больше чем на max_regression"""
+    regressions = []
+    for name, row in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if base["p95"] and row["p95"] and row["p95"] > base["p95"] * (1 + max_regression):
+            regressions.append(f"{name}: p95 {base['p95']:.3f} -> {row['p95']:.3f} с")
+        if base["throughput_rps"] and row["throughput_rps"] and \
+                row["throughput_rps"] < base["throughput_rps"] * (1 - max_regression):
+            regressions.append(f"{name}: RPS {base['throughput_rps']:.1f} -> {row['throughput_rps']:.1f}")
+    return regressions
+
+
+async def run_benchmarks(args) -> Dict[str, Any]:
+    config = FakeOpenAIConfig(
+        latency=args.latency, jitter=args.jitter, truncation_rate=args.truncation_rate,
+        rate_429=args.rate_429, tokens_per_second=args.tokens_per_second, seed=args.seed
+    )
+    # Сервер в отдельном потоке: синхронные клиенты и event loop бенчмарка не мешают ему отвечать
+    server = FakeOpenAIServer(config).start_in_thread()
+    os.environ["OPENAI_API_BASE"] = server.base_url
+
+    ctx = BenchmarkContext()
+    results = {}
+    try:
+        for name in args.scenarios:
+            func = build_scenario(name, ctx)
+            requests = args.export_requests if name.startswith("export") else args.requests
+            result = await run_scenario(name, func, requests, args.concurrency, server, args.trace_memory)
+            results[name] = result.summary()
+            logger.info(f"✅ {name}: {len(result.latencies)} запросов за {result.wall_time:.1f} с")
+    finally:
+        from openai_client import close_async_openai_client
+        await close_async_openai_client()
+        server.stop_thread()
+
+    return {
+        "config": {
+            "requests": args.requests, "export_requests": args.export_requests,
+            "concurrency": args.concurrency, "latency": args.latency, "jitter": args.jitter,
+            "truncation_rate": args.truncation_rate, "rate_429": args.rate_429,
+            "tokens_per_second": args.tokens_per_second, "seed": args.seed,
+        },
+        "max_rss_mb": _max_rss_mb(),
+        "results": results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк генерации и экспорта")
+    parser.add_argument("--scenarios", default=",".join(DEFAULT_SCENARIOS),
+                        help="Сценарии через запятую (export:* и export_pool:* - все методы экспорта)")
+    parser.add_argument("--requests", type=int, default=32, help="Запросов на сценарий генерации")
+    parser.add_argument("--export-requests", type=int, default=200, help="Вызовов на сценарий экспорта")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.2, help="Задержка fake OpenAI, секунды")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Разброс задержки, доля от latency")
+    parser.add_argument("--truncation-rate", type=float, default=0.0, help="Доля обрезанных ответов")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Доля ответов 429")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0,
+                        help="Скорость потоковой генерации (0 - без задержек)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Пик памяти каждого сценария через tracemalloc (замедляет прогон)")
+    parser.add_argument("--json", help="Сохранить результаты в файл")
+    parser.add_argument("--baseline", help="Сравнить с сохранёнными результатами")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Допустимое ухудшение p95/RPS относительно baseline (доля)")
+    args = parser.parse_args(argv)
+
+    scenarios = []
+    for name in args.scenarios.split(","):
+        name = name.strip()
+        if name in ("export:*", "export_pool:*"):
+            prefix = name[:-1]
+            scenarios.extend(f"{prefix}{method}" for method in EXPORT_METHODS)
+        elif name:
+            if name not in ALL_SCENARIOS:
+                parser.error(f"неизвестный сценарий {name}; доступны: {', '.join(ALL_SCENARIOS)}")
+            scenarios.append(name)
+    args.scenarios = scenarios
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    # Логи бота на каждый запрос заглушили бы отчёт
+    for name in ("content_generator", "openai_client", "httpx", "utils.rate_limiter", "utils.llm_cache"):
+        logging.getLogger(name).setLevel(logging.ERROR)
+
+    report = asyncio.run(run_benchmarks(args))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+    print()
+    print_report(report["results"], baseline)
+    print(f"\nПик RSS процесса: {_fmt(report['max_rss_mb'], 1)} МБ")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if baseline:
+        regressions = find_regressions(report["results"], baseline, args.max_regression)
+        if regressions:
+            print("\n❌ Регрессии:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,332 @@
+"""
+Нагрузочный тест бота: виртуальные пользователи проходят создание курса
+
+Синтетические Update и CallbackQuery подаются в настоящий Application
+с обработчиками бота (course_bot.register_handlers). Bot API заменён
+заглушкой внутри процесса, OpenAI - локальным fake сервером.
+
+Каждый пользователь проходит сценарий /create → уровень → тема →
+количество модулей → недели → часы (генерация структуры курса).
+Отчёт: обновлений в секунду, латентность обработчиков и шагов,
+задержка event loop, вызовы Bot API.
+
+Пример:
+    python -m benchmarks.telegram_load --users 2000 --ramp 30 --openai-latency 3
+"""
+
+import argparse
+import asyncio
+import collections
+import functools
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_openai import FakeOpenAIConfig, FakeOpenAIServer, prepare_offline_environment  # noqa: E402
+
+prepare_offline_environment()
+os.environ.setdefault("SESSION_BACKEND", "memory")
+os.environ.setdefault("METRICS_PORT", "0")
+
+from telegram import Update  # noqa: E402
+from telegram.ext import ApplicationBuilder  # noqa: E402
+from telegram.request import BaseRequest, RequestData  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "LoadTestBot", "username": "load_test_bot"}
+
+# Сценарий создания курса: (тип обновления, данные)
+CREATE_COURSE_FLOW: List[Tuple[str, str]] = [
+    ("command", "/create"),
+    ("callback", "level_middle"),
+    ("text", "Асинхронный Python"),
+    ("callback", "modules_4"),
+    ("text", "8"),
+    ("text", "5"),
+]
+
+
+class StubBotRequest(BaseRequest):
+    """Bot API внутри процесса: отвечает успехом с заданной задержкой"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Dict[str, int] = collections.Counter()
+        self._message_ids = itertools.count(1000)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         *args, **kwargs) -> Tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        parameters = request_data.parameters if request_data else {}
+        payload = {"ok": True, "result": self._result(api_method, parameters)}
+        return 200, json.dumps(payload).encode("utf-8")
+
+    def _result(self, api_method: str, parameters: Dict[str, Any]) -> Any:
+        if api_method == "getMe":
+            return BOT_USER
+        if api_method.startswith("send") or api_method.startswith("edit"):
+            chat_id = int(parameters.get("chat_id", 0))
+            return {
+                "message_id": int(parameters.get("message_id") or next(self._message_ids)),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": parameters.get("text") or parameters.get("caption") or "",
+            }
+        return True
+
+
+class LoopLagSampler:
+    """Замер задержки event loop: насколько позже просыпается sleep(interval)"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - started - self.interval))
+
+
+class LoadTest:
+    """Виртуальные пользователи поверх настоящего Application"""
+
+    def __init__(self, args):
+        self.args = args
+        self.bot_request = StubBotRequest(latency=args.bot_latency)
+        self.random = random.Random(args.seed)
+        self.update_ids = itertools.count(1)
+        self.handler_latencies: Dict[str, List[float]] = collections.defaultdict(list)
+        self.step_latencies: Dict[str, List[float]] = collections.defaultdict(list)
+        self.flow_durations: List[float] = []
+        self.errors: Dict[str, int] = collections.Counter()
+        self.updates_processed = 0
+        self.completed_flows = 0
+
+    def build_application(self):
+        from course_bot import register_handlers
+
+        app = (
+            ApplicationBuilder()
+            .token("123456:LOADTEST")
+            .request(self.bot_request)
+            .get_updates_request(StubBotRequest())
+            .job_queue(None)
+            .build()
+        )
+        register_handlers(app)
+        for handlers in app.handlers.values():
+            for handler in handlers:
+                handler.callback = self._timed(handler.callback)
+        app.add_error_handler(self._on_error)
+        return app
+
+    def _timed(self, callback: Callable) -> Callable:
+        name = f"{callback.__module__}.{callback.__name__}"
+
+        @functools.wraps(callback)
+        async def wrapper(update, context):
+            started = time.perf_counter()
+            try:
+                return await callback(update, context)
+            finally:
+                self.handler_latencies[name].append(time.perf_counter() - started)
+        return wrapper
+
+    async def _on_error(self, update, context):
+        self.errors[type(context.error).__name__] += 1
+        logger.debug(f"Ошибка обработчика: {context.error}")
+
+    def _user(self, user_id: int) -> Dict[str, Any]:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "language_code": "ru"}
+
+    def _message(self, user_id: int, text: str, from_bot: bool = False) -> Dict[str, Any]:
+        message = {
+            "message_id": next(self.update_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": BOT_USER if from_bot else self._user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return message
+
+    def build_update(self, bot, user_id: int, kind: str, data: str) -> Update:
+        update: Dict[str, Any] = {"update_id": next(self.update_ids)}
+        if kind == "callback":
+            update["callback_query"] = {
+                "id": str(update["update_id"]),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": self._message(user_id, "…", from_bot=True),
+            }
+        else:
+            update["message"] = self._message(user_id, data)
+        return Update.de_json(update, bot)
+
+    async def user_flow(self, app, user_id: int, semaphore: asyncio.Semaphore, start_delay: float):
+        await asyncio.sleep(start_delay)
+        flow_started = time.perf_counter()
+        for kind, data in CREATE_COURSE_FLOW:
+            update = self.build_update(app.bot, user_id, kind, data)
+            # Как concurrent_updates в боевом Application: не больше N обновлений одновременно
+            async with semaphore:
+                started = time.perf_counter()
+                await app.process_update(update)
+                self.step_latencies[f"{kind}:{data}"].append(time.perf_counter() - started)
+            self.updates_processed += 1
+            if self.args.think_time:
+                await asyncio.sleep(self.random.expovariate(1 / self.args.think_time))
+        self.flow_durations.append(time.perf_counter() - flow_started)
+        self.completed_flows += 1
+
+    async def run(self) -> Dict[str, Any]:
+        from openai_client import close_async_openai_client
+
+        server = FakeOpenAIServer(FakeOpenAIConfig(
+            latency=self.args.openai_latency, jitter=0.2, rate_429=self.args.rate_429, seed=self.args.seed
+        )).start_in_thread()
+        os.environ["OPENAI_API_BASE"] = server.base_url
+
+        from utils.loop_monitor import LoopMonitor
+
+        app = self.build_application()
+        await app.initialize()
+        sampler = LoopLagSampler()
+        sampler.start()
+        # Блокировки event loop с обработчиком и местом вызова - в лог
+        loop_monitor = LoopMonitor()
+        await loop_monitor.start()
+        semaphore = asyncio.Semaphore(self.args.concurrent_updates)
+
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*(
+                self.user_flow(app, 10_000_000 + i, semaphore, self.args.ramp * i / self.args.users)
+                for i in range(self.args.users)
+            ))
+        finally:
+            wall_time = time.perf_counter() - started
+            await sampler.stop()
+            await loop_monitor.stop()
+            await app.shutdown()
+            await close_async_openai_client()
+            server.stop_thread()
+
+        return self.report(wall_time, sampler.samples, server.stats)
+
+    def report(self, wall_time: float, lag_samples: List[float], openai_stats: Dict[str, int]) -> Dict[str, Any]:
+        from utils.latency import percentile
+        from utils.metrics import get_metrics
+
+        def stats(samples: List[float]) -> Dict[str, Any]:
+            return {
+                "count": len(samples),
+                "p50": percentile(samples, 50),
+                "p95": percentile(samples, 95),
+                "p99": percentile(samples, 99),
+                "max": max(samples) if samples else None,
+            }
+
+        return {
+            "users": self.args.users,
+            "completed_flows": self.completed_flows,
+            "updates": self.updates_processed,
+            "wall_time": wall_time,
+            "updates_per_second": self.updates_processed / wall_time if wall_time else None,
+            "errors": dict(self.errors),
+            "flow_seconds": stats(self.flow_durations),
+            "handlers": {name: stats(samples) for name, samples in sorted(self.handler_latencies.items())},
+            "steps": {name: stats(samples) for name, samples in self.step_latencies.items()},
+            "loop_lag": stats(lag_samples),
+            "loop_blocks": int(get_metrics().event_loop_blocks.total()),
+            "bot_api_calls": dict(self.bot_request.calls),
+            "openai_requests": openai_stats["requests"],
+        }
+
+
+def _fmt(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value * 1000:.1f}"
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"\nПользователей: {report['users']}, завершили сценарий: {report['completed_flows']}")
+    print(f"Обновлений: {report['updates']} за {report['wall_time']:.1f} с "
+          f"({report['updates_per_second']:.1f} в секунду)")
+    if report["errors"]:
+        print(f"Ошибки обработчиков: {report['errors']}")
+
+    def table(title: str, rows: Dict[str, Dict[str, Any]]):
+        print(f"\n{title:<58} {'N':>6} {'p50,мс':>9} {'p95,мс':>9} {'p99,мс':>9} {'max,мс':>9}")
+        for name, row in rows.items():
+            print(f"{name:<58} {row['count']:>6} {_fmt(row['p50']):>9} {_fmt(row['p95']):>9} "
+                  f"{_fmt(row['p99']):>9} {_fmt(row['max']):>9}")
+
+    table("Обработчик", report["handlers"])
+    table("Шаг сценария", report["steps"])
+    table("Прочее", {"сценарий целиком": report["flow_seconds"], "задержка event loop": report["loop_lag"]})
+    print(f"Блокировок event loop: {report['loop_blocks']}")
+    print(f"\nВызовы Bot API: {report['bot_api_calls']}")
+    print(f"Запросов к OpenAI: {report['openai_requests']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с заглушками Bot API и OpenAI")
+    parser.add_argument("--users", type=int, default=500, help="Виртуальных пользователей")
+    parser.add_argument("--ramp", type=float, default=10.0, help="За сколько секунд подключаются все пользователи")
+    parser.add_argument("--think-time", type=float, default=0.5, help="Средняя пауза пользователя между шагами, с")
+    parser.add_argument("--concurrent-updates", type=int,
+                        default=int(os.getenv("BOT_CONCURRENT_UPDATES", "256")),
+                        help="Обновлений одновременно (как BOT_CONCURRENT_UPDATES)")
+    parser.add_argument("--bot-latency", type=float, default=0.03, help="Задержка ответа Bot API, с")
+    parser.add_argument("--openai-latency", type=float, default=1.0, help="Задержка fake OpenAI, с")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Доля ответов 429 от OpenAI")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="Сохранить отчёт в файл")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    logger.setLevel(logging.INFO)
+
+    report = asyncio.run(LoadTest(args).run())
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,27 +1,136 @@
 """
 Генератор учебного контента для модулей курса
 """
+import asyncio
 import logging
-import json
-from typing import Optional, Dict, Any, List
+import os
+import time
+from typing import Optional, Dict, Any, List, Callable, Awaitable
 from models import Module, Lecture, Slide, ModuleContent, Lesson, LessonContent, TopicMaterial
-from openai_client import OpenAIClient
+from openai_client import OpenAIClient, get_async_openai_client
+from utils.latency import get_latency_recorder
+from utils.llm_cache import cache_lookup, cache_store
+from utils.metrics import get_metrics, llm_call_labels
+from utils.json_stream import JsonStreamScanner, PartialJson, parse_partial_json, ANY_INDEX
+from utils.token_budget import (
+    TokenBudget,
+    apply_token_budget,
+    plan_token_budget,
+    predict_module_content_tokens,
+    predict_topic_material_tokens
+)
+from utils.tokens import count_tokens
 from prompts import (
     MODULE_CONTENT_SYSTEM_PROMPT,
-    MODULE_CONTENT_PROMPT_TEMPLATE,
+    MODULE_CONTENT_INSTRUCTIONS,
+    MODULE_CONTENT_SCHEMA,
+    MODULE_CONTENT_SCHEMA_COMPACT,
+    MODULE_CONTENT_CONTEXT_TEMPLATE,
+    MODULE_LECTURE_CONTEXT_TEMPLATE,
     TOPIC_MATERIAL_SYSTEM_PROMPT,
-    TOPIC_MATERIAL_PROMPT_TEMPLATE,
+    TOPIC_MATERIAL_INSTRUCTIONS,
+    TOPIC_MATERIAL_SCHEMA,
+    TOPIC_MATERIAL_SCHEMA_COMPACT,
+    TOPIC_MATERIAL_CONTEXT_TEMPLATE,
+    build_prompt_messages,
+    response_schema,
+    format_content_outline,
     format_lessons_list
 )
 
 logger = logging.getLogger(__name__)
 
+# Сколько тем урока генерируется одновременно
+TOPIC_GENERATION_CONCURRENCY = int(os.getenv('TOPIC_GENERATION_CONCURRENCY', '4'))
+
+# Hedged-запросы для контента модуля: следующая стратегия стартует, не дожидаясь провала предыдущей
+MODULE_HEDGING = os.getenv('MODULE_HEDGING', '0') == '1'
+
+# Задержки запуска следующей стратегии (секунды через запятую) или "auto" - по p90 из замеров
+MODULE_HEDGE_DELAYS = os.getenv('MODULE_HEDGE_DELAYS', '25,25')
+DEFAULT_HEDGE_DELAY = 25.0
+HEDGE_AUTO_MIN_SAMPLES = 20
+
+# Повторов для лекций, не полученных при генерации по урокам (каждая повторяется отдельным запросом)
+MODULE_SPLIT_RETRIES = int(os.getenv('MODULE_SPLIT_RETRIES', '1'))
+
+# Сколько лекций модуля запрашивается одновременно при генерации по урокам
+MODULE_SPLIT_CONCURRENCY = int(os.getenv('MODULE_SPLIT_CONCURRENCY', '3'))
+
+# Колбэк прогресса потоковой генерации
+ProgressCallback = Callable[[Dict[str, Any]], Awaitable[None]]
+
+# Пути лекций и слайдов в JSON ответа (для потокового разбора)
+STREAM_LECTURE_PATH = ("lectures", ANY_INDEX)
+STREAM_SLIDE_PATH = ("lectures", ANY_INDEX, "slides", ANY_INDEX)
+
+# Функция для создания лекций (Function Calling)
+MODULE_LECTURES_TOOLS = [{
+    "type": "function",
+    "function": {
+        "name": "create_module_lectures",
+        "description": "Создает детальные лекции со слайдами для учебного модуля",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "lectures": {
+                    "type": "array",
+                    "description": "Массив лекций для модуля",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "lecture_title": {"type": "string"},
+                            "duration_minutes": {"type": "integer"},
+                            "learning_objectives": {
+                                "type": "array",
+                                "items": {"type": "string"}
+                            },
+                            "key_takeaways": {
+                                "type": "array",
+                                "items": {"type": "string"}
+                            },
+                            "slides": {
+                                "type": "array",
+                                "items": {
+                                    "type": "object",
+                                    "properties": {
+                                        "slide_number": {"type": "integer"},
+                                        "title": {"type": "string"},
+                                        "content": {"type": "string"},
+                                        "slide_type": {"type": "string"},
+                                        "code_example": {"type": ["string", "null"]},
+                                        "notes": {"type": "string"}
+                                    },
+                                    "required": ["slide_number", "title", "content", "slide_type", "notes"]
+                                }
+                            }
+                        },
+                        "required": ["lecture_title", "duration_minutes", "learning_objectives", "key_takeaways", "slides"]
+                    }
+                }
+            },
+            "required": ["lectures"]
+        }
+    }
+}]
+
 
 class ContentGenerator:
     """Класс для генерации учебного контента модулей"""
     
+    # Порядок стратегий генерации контента модуля
+    MODULE_STRATEGIES = ("function_calling", "json_mode", "text_mode")
+    
+    # Названия стратегий для логов
+    STRATEGY_LABELS = {
+        "function_calling": "Function Calling",
+        "json_mode": "JSON mode",
+        "text_mode": "Текстовый режим",
+    }
+    
     def __init__(self):
         self.openai_client = OpenAIClient()
+        self.async_client = get_async_openai_client()
     
     def generate_module_content(self, module: Module, course_title: str, 
                                target_audience: str) -> Optional[ModuleContent]:
@@ -55,65 +164,410 @@ class ContentGenerator:
         logger.warning("📌 Все методы генерации провалились, используем тестовый контент")
         return self._get_test_module_content(module)
     
+    async def generate_module_content_async(self, module: Module, course_title: str,
+                                            target_audience: str,
+                                            hedge: Optional[bool] = None,
+                                            use_cache: bool = True,
+                                            on_progress: Optional[ProgressCallback] = None,
+                                            split: Optional[bool] = None,
+                                            max_concurrency: Optional[int] = None) -> Optional[ModuleContent]:
+        """
+        Асинхронная версия generate_module_content
+        
+        Стратегии те же (Function Calling → JSON mode → текст → тестовый контент),
+        но запросы выполняются через AsyncOpenAIClient и не блокируют event loop.
+        
+        Args:
+            hedge: Запускать следующую стратегию параллельно, не дожидаясь
+                провала предыдущей (по умолчанию MODULE_HEDGING)
+            use_cache: Брать результат из кэша LLM. False - для "Сгенерировать заново":
+                запрос выполняется всегда, новый результат перезаписывает кэш
+            on_progress: async-колбэк прогресса (включает потоковый режим), получает
+                dict с lectures_done, lectures_total, current_slide, slides_done, invalid_slides
+            split: Генерировать по урокам - по лекции на запрос (по умолчанию - если прогноз
+                ответа не помещается в лимит модели - при настройках по умолчанию для модулей от 2 уроков).
+                Лекции запрашиваются без hedged-запросов
+            max_concurrency: Лимит одновременных запросов лекций при генерации по урокам
+                (по умолчанию MODULE_SPLIT_CONCURRENCY, 1 - последовательно)
+        """
+        logger.info(f"Генерируем контент для модуля (async): {module.module_title}")
+        
+        if use_cache:
+            cached = await self._get_cached_module_content(module, course_title, target_audience)
+            if cached:
+                return cached
+        
+        if split is None:
+            split = self._needs_split(module, course_title, target_audience)
+        if split and len(module.lessons) > 1:
+            return await self._generate_module_content_split(
+                module, course_title, target_audience, use_cache, on_progress, max_concurrency
+            )
+        
+        if on_progress:
+            on_progress = self._monotonic_progress(on_progress)
+        
+        result = await self._run_strategies(module, course_title, target_audience, hedge, on_progress)
+        if result:
+            return result
+        
+        # Fallback: Тестовый контент
+        logger.warning("📌 Все методы генерации провалились, используем тестовый контент")
+        return self._get_test_module_content(module)
+    
+    async def _run_strategies(self, module: Module, course_title: str, target_audience: str,
+                              hedge: Optional[bool], on_progress: Optional[ProgressCallback] = None,
+                              lesson_index: Optional[int] = None) -> Optional[ModuleContent]:
+        """Стратегии генерации по очереди или hedged-запросами; None - все провалились"""
+        if MODULE_HEDGING if hedge is None else hedge:
+            result = await self._generate_module_content_hedged(
+                module, course_title, target_audience, on_progress, lesson_index
+            )
+            logger.info(f"📊 Латентность стратегий: {self.get_strategy_latency_report()}")
+            return result
+        
+        for strategy in self.MODULE_STRATEGIES:
+            result = await self._try_strategy_async(
+                strategy, module, course_title, target_audience, on_progress, lesson_index
+            )
+            if result:
+                return result
+        return None
+    
+    async def _generate_module_content_split(self, module: Module, course_title: str,
+                                             target_audience: str, use_cache: bool,
+                                             on_progress: Optional[ProgressCallback] = None,
+                                             max_concurrency: Optional[int] = None) -> ModuleContent:
+        """
+        Генерирует контент модуля по урокам: по лекции на запрос, не больше
+        max_concurrency запросов одновременно
+        
+        Весь модуль одним ответом у больших модулей упирается в лимит
+        ответа модели. Запросы лекций содержат общий контекст модуля
+        (со списком всех тем), поэтому лекции согласованы между собой.
+        Лекция, которую не удалось получить, повторяется отдельным
+        запросом (MODULE_SPLIT_RETRIES раз), затем заменяется тестовой -
+        остальные лекции модуля при этом сохраняются.
+        
+        Hedged-запросы здесь не используются: запросов и так по одному на урок.
+        """
+        total = len(module.lessons)
+        semaphore = asyncio.Semaphore(max(1, max_concurrency or MODULE_SPLIT_CONCURRENCY))
+        logger.info(f"✂️ Модуль '{module.module_title}': генерируем лекции по урокам ({total})")
+        lectures: List[Optional[Lecture]] = [None] * total
+        progress = {
+            "lectures_done": 0,
+            "lectures_total": total,
+            "current_slide": 0,
+            "slides_done": 0,
+            "invalid_slides": 0,
+        }
+        
+        async def lecture_ready(lecture: Lecture):
+            progress["lectures_done"] += 1
+            progress["slides_done"] += len(lecture.slides)
+            if on_progress:
+                await self._report_progress(on_progress, dict(progress))
+        
+        async def generate_lecture(index: int) -> Optional[Lecture]:
+            async with semaphore:
+                lecture = await self._generate_lesson_lecture(
+                    module, index, course_title, target_audience, use_cache
+                )
+            if lecture:
+                await lecture_ready(lecture)
+            return lecture
+        
+        pending = list(range(total))
+        for attempt in range(MODULE_SPLIT_RETRIES + 1):
+            if attempt:
+                logger.warning(f"🔁 Лекций не получено: {len(pending)} из {total}, повторяем по одной")
+            results = await asyncio.gather(*(generate_lecture(index) for index in pending))
+            for index, lecture in zip(pending, results):
+                lectures[index] = lecture
+            pending = [index for index in pending if lectures[index] is None]
+            if not pending:
+                break
+        
+        for index in pending:
+            lesson = module.lessons[index]
+            logger.warning(f"📌 Лекция '{lesson.lesson_title}' не сгенерирована, используем тестовый контент")
+            lectures[index] = self._get_test_module_content(module.copy(update={"lessons": [lesson]})).lectures[0]
+            await lecture_ready(lectures[index])
+        
+        return self._assemble_module_content(module, lectures)
+    
+    async def _generate_lesson_lecture(self, module: Module, lesson_index: int, course_title: str,
+                                       target_audience: str, use_cache: bool) -> Optional[Lecture]:
+        """Лекция по одному уроку модуля (из кэша или всеми стратегиями); None - не удалось"""
+        result = None
+        if use_cache:
+            result = await self._get_cached_module_content(module, course_title, target_audience, lesson_index)
+        if not result:
+            result = await self._run_strategies(module, course_title, target_audience, hedge=False,
+                                                lesson_index=lesson_index)
+        if not result:
+            return None
+        if len(result.lectures) > 1:
+            logger.warning(f"⚠️ Вместо одной лекции получено {len(result.lectures)}, берём первую")
+        return result.lectures[0]
+    
+    @staticmethod
+    def _assemble_module_content(module: Module, lectures: List[Lecture]) -> ModuleContent:
+        """ModuleContent из лекций с пересчитанными итогами"""
+        return ModuleContent(
+            module_number=module.module_number,
+            module_title=module.module_title,
+            lectures=lectures,
+            total_slides=sum(len(lecture.slides) for lecture in lectures),
+            estimated_duration_minutes=sum(lecture.duration_minutes for lecture in lectures)
+        )
+    
+    async def _generate_module_content_hedged(self, module: Module, course_title: str,
+                                              target_audience: str,
+                                              on_progress: Optional[ProgressCallback] = None,
+                                              lesson_index: Optional[int] = None) -> Optional[ModuleContent]:
+        """
+        Hedged-запросы: стратегии стартуют с задержкой друг за другом и работают параллельно
+        
+        Следующая стратегия запускается через hedge-задержку после предыдущей
+        или сразу, если все запущенные стратегии уже провалились.
+        Побеждает первый валидный ModuleContent, остальные запросы отменяются.
+        """
+        strategies = list(self.MODULE_STRATEGIES)
+        delays = self.get_hedge_delays()
+        running: Dict[asyncio.Task, str] = {}
+        next_index = 0
+        next_launch_at = 0.0
+        loop = asyncio.get_running_loop()
+        
+        def launch_next():
+            nonlocal next_index, next_launch_at
+            strategy = strategies[next_index]
+            if next_index < len(delays):
+                next_launch_at = loop.time() + delays[next_index]
+            next_index += 1
+            task = asyncio.create_task(
+                self._try_strategy_async(strategy, module, course_title, target_audience, on_progress, lesson_index)
+            )
+            running[task] = strategy
+        
+        launch_next()
+        try:
+            while running:
+                timeout = None
+                if next_index < len(strategies):
+                    timeout = max(0.0, next_launch_at - loop.time())
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                
+                for task in done:
+                    strategy = running.pop(task)
+                    result = task.result()
+                    if result:
+                        logger.info(f"🏁 Победила стратегия {self.STRATEGY_LABELS[strategy]}")
+                        return result
+                
+                # Задержка истекла или все запущенные стратегии провалились
+                if next_index < len(strategies) and (loop.time() >= next_launch_at or not running):
+                    if running:
+                        logger.info(f"⏱️ Hedge: запускаем {self.STRATEGY_LABELS[strategies[next_index]]} параллельно")
+                    launch_next()
+            return None
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+                logger.info(f"🛑 Отменено проигравших стратегий: {len(running)}")
+    
+    @staticmethod
+    def _monotonic_progress(on_progress: ProgressCallback) -> ProgressCallback:
+        """
+        Пропускает только продвижение вперёд
+        
+        Следующая стратегия (или hedge-запрос) начинает с нуля - пользователь
+        не должен видеть, как прогресс откатывается назад.
+        """
+        best = (-1, -1)
+        
+        async def report(progress: Dict[str, int]):
+            nonlocal best
+            position = (progress["lectures_done"], progress["current_slide"])
+            if position > best:
+                best = position
+                await ContentGenerator._report_progress(on_progress, progress)
+        
+        return report
+    
+    @staticmethod
+    async def _report_progress(on_progress: ProgressCallback, progress: Dict[str, Any]):
+        """Вызывает колбэк прогресса; его ошибки не прерывают генерацию"""
+        try:
+            await on_progress(progress)
+        except Exception as e:
+            logger.warning(f"Ошибка обработчика прогресса: {e}")
+    
+    async def _get_cached_module_content(self, module: Module, course_title: str, target_audience: str,
+                                         lesson_index: Optional[int] = None) -> Optional[ModuleContent]:
+        """Ищет в кэше результат любой из стратегий генерации модуля (или лекции урока lesson_index)"""
+        for strategy in self.MODULE_STRATEGIES:
+            request = self._build_strategy_request(strategy, module, course_title, target_audience, lesson_index)
+            cached = await cache_lookup("module_content", request)
+            if cached:
+                try:
+                    module_content = ModuleContent.parse_raw(cached)
+                except Exception as e:
+                    logger.warning(f"⚠️ Повреждённая запись кэша модуля: {e}")
+                    continue
+                logger.info(f"💾 Контент модуля взят из кэша ({self.STRATEGY_LABELS[strategy]})")
+                return module_content
+        return None
+    
+    def get_hedge_delays(self) -> List[float]:
+        """
+        Задержки запуска следующей стратегии (секунды)
+        
+        При MODULE_HEDGE_DELAYS=auto задержка берётся как p90 успешных вызовов
+        предыдущей стратегии (если набралось достаточно замеров).
+        """
+        count = len(self.MODULE_STRATEGIES) - 1
+        if MODULE_HEDGE_DELAYS.strip().lower() == "auto":
+            recorder = get_latency_recorder()
+            delays = []
+            for strategy in self.MODULE_STRATEGIES[:count]:
+                if recorder.count(strategy) >= HEDGE_AUTO_MIN_SAMPLES:
+                    delays.append(recorder.percentiles(strategy, quantiles=(90,))["p90"])
+                else:
+                    delays.append(DEFAULT_HEDGE_DELAY)
+            return delays
+        
+        delays = [float(value) for value in MODULE_HEDGE_DELAYS.split(",") if value.strip()]
+        return (delays + [delays[-1] if delays else DEFAULT_HEDGE_DELAY] * count)[:count]
+    
+    def get_strategy_latency_report(self) -> Dict[str, Dict[str, Any]]:
+        """Перцентили латентности стратегий генерации модуля"""
+        report = get_latency_recorder().report()
+        return {strategy: report[strategy] for strategy in self.MODULE_STRATEGIES if strategy in report}
+    
     def _try_function_calling(self, module: Module, course_title: str, 
                              target_audience: str) -> Optional[ModuleContent]:
         """Попытка генерации через Function Calling"""
+        return self._try_strategy("function_calling", module, course_title, target_audience)
+    
+    def _try_json_mode(self, module: Module, course_title: str, 
+                       target_audience: str) -> Optional[ModuleContent]:
+        """Попытка генерации через JSON mode"""
+        return self._try_strategy("json_mode", module, course_title, target_audience)
+    
+    def _try_text_mode(self, module: Module, course_title: str, 
+                       target_audience: str) -> Optional[ModuleContent]:
+        """Попытка генерации в обычном текстовом режиме"""
+        return self._try_strategy("text_mode", module, course_title, target_audience)
+    
+    def _try_strategy(self, strategy: str, module: Module, course_title: str,
+                      target_audience: str) -> Optional[ModuleContent]:
+        """Выполняет одну стратегию генерации синхронно"""
+        label = self.STRATEGY_LABELS[strategy]
         try:
-            logger.info("🔧 Пробуем Function Calling...")
-            
-            # Определяем функцию для создания лекций
-            tools = [{
-                "type": "function",
-                "function": {
-                    "name": "create_module_lectures",
-                    "description": "Создает детальные лекции со слайдами для учебного модуля",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "lectures": {
-                                "type": "array",
-                                "description": "Массив лекций для модуля",
-                                "items": {
-                                    "type": "object",
-                                    "properties": {
-                                        "lecture_title": {"type": "string"},
-                                        "duration_minutes": {"type": "integer"},
-                                        "learning_objectives": {
-                                            "type": "array",
-                                            "items": {"type": "string"}
-                                        },
-                                        "key_takeaways": {
-                                            "type": "array",
-                                            "items": {"type": "string"}
-                                        },
-                                        "slides": {
-                                            "type": "array",
-                                            "items": {
-                                                "type": "object",
-                                                "properties": {
-                                                    "slide_number": {"type": "integer"},
-                                                    "title": {"type": "string"},
-                                                    "content": {"type": "string"},
-                                                    "slide_type": {"type": "string"},
-                                                    "code_example": {"type": ["string", "null"]},
-                                                    "notes": {"type": "string"}
-                                                },
-                                                "required": ["slide_number", "title", "content", "slide_type", "notes"]
-                                            }
-                                        }
-                                    },
-                                    "required": ["lecture_title", "duration_minutes", "learning_objectives", "key_takeaways", "slides"]
-                                }
-                            }
-                        },
-                        "required": ["lectures"]
-                    }
-                }
-            }]
-            
-            from prompts import MODULE_CONTENT_PROMPT_TEMPLATE, MODULE_CONTENT_SYSTEM_PROMPT, format_lessons_list
-            
-            prompt = MODULE_CONTENT_PROMPT_TEMPLATE.format(
+            logger.info(f"🔧 Пробуем {label}...")
+            request = self._build_strategy_request(strategy, module, course_title, target_audience)
+            response = self.openai_client.client.chat.completions.create(**request)
+            return self._parse_strategy_response(strategy, response, module)
+        except Exception as e:
+            logger.warning(f"❌ {label} не сработал: {e}")
+            return None
+    
+    async def _try_strategy_async(self, strategy: str, module: Module, course_title: str,
+                                  target_audience: str,
+                                  on_progress: Optional[ProgressCallback] = None,
+                                  lesson_index: Optional[int] = None) -> Optional[ModuleContent]:
+        """
+        Выполняет одну стратегию генерации асинхронно
+        
+        Если передан on_progress, ответ читается потоком и прогресс
+        сообщается по мере появления слайдов и лекций. lesson_index -
+        запросить только лекцию этого урока (генерация по урокам).
+        """
+        label = self.STRATEGY_LABELS[strategy]
+        started = time.perf_counter()
+        try:
+            logger.info(f"🔧 Пробуем {label}...")
+            request = self._build_strategy_request(strategy, module, course_title, target_audience, lesson_index)
+            budget = self._module_budget(request, module, lesson_index)
+            with llm_call_labels(strategy=strategy, template="module_content"):
+                if on_progress:
+                    scanner = await self._stream_strategy(request, module, on_progress)
+                    # В потоковом ответе нет usage - считаем токены текста
+                    budget.observe(count_tokens(scanner.text, request["model"]))
+                    with get_metrics().json_extract_seconds.time(kind="module_content_stream"):
+                        partial = scanner.result()
+                    result = self._parse_strategy_text(strategy, scanner.text, module, partial)
+                else:
+                    response = await self.async_client.chat_completion(**request)
+                    budget.observe_response(response)
+                    result = self._parse_strategy_response(strategy, response, module)
+        except Exception as e:
+            logger.warning(f"❌ {label} не сработал: {e}")
+            result = None
+        
+        if result:
+            await cache_store("module_content", request, result.json())
+        
+        # Отменённые (проигравшие) запросы сюда не доходят - CancelledError не перехватывается
+        get_latency_recorder().record(strategy, time.perf_counter() - started, ok=result is not None)
+        return result
+    
+    async def _stream_strategy(self, request: Dict[str, Any], module: Module,
+                               on_progress: ProgressCallback) -> JsonStreamScanner:
+        """
+        Читает ответ потоком, разбирая лекции и слайды по мере генерации
+        
+        Каждый завершённый слайд сразу проверяется моделью Slide,
+        после каждого слайда и лекции вызывается on_progress.
+        
+        Returns:
+            Сканер с полным текстом ответа (разобранный результат - scanner.result())
+        """
+        scanner = JsonStreamScanner(patterns=[STREAM_LECTURE_PATH, STREAM_SLIDE_PATH], root="{")
+        progress = {
+            "lectures_done": 0,
+            "lectures_total": len(module.lessons),
+            "current_slide": 0,
+            "slides_done": 0,
+            "invalid_slides": 0,
+        }
+        
+        async for chunk in self.async_client.stream_chat_completion(**request):
+            events = scanner.feed(chunk)
+            for path, value in events:
+                if len(path) == len(STREAM_SLIDE_PATH):
+                    progress["current_slide"] += 1
+                    try:
+                        with get_metrics().validation_seconds.time(model="Slide"):
+                            Slide(**value)
+                        progress["slides_done"] += 1
+                    except Exception as e:
+                        progress["invalid_slides"] += 1
+                        logger.warning(f"⚠️ Некорректный слайд {path}: {e}")
+                else:
+                    progress["lectures_done"] += 1
+                    progress["current_slide"] = 0
+            if events:
+                await on_progress(dict(progress))
+        
+        return scanner
+    
+    def _build_module_messages(self, strategy: str, module: Module, course_title: str,
+                               target_audience: str, lesson_index: Optional[int] = None) -> List[Dict[str, str]]:
+        """Формирует сообщения запроса генерации контента модуля (или лекции урока lesson_index) для стратегии"""
+        system = MODULE_CONTENT_SYSTEM_PROMPT
+        if strategy == "json_mode":
+            system += "\n\nВЫВОД ТОЛЬКО В JSON ФОРМАТЕ!"
+        
+        schema = response_schema(MODULE_CONTENT_SCHEMA, MODULE_CONTENT_SCHEMA_COMPACT,
+                                 in_tools=strategy == "function_calling")
+        if lesson_index is None:
+            context = MODULE_CONTENT_CONTEXT_TEMPLATE.format(
                 course_title=course_title,
                 target_audience=target_audience,
                 module_number=module.module_number,
@@ -122,21 +576,103 @@ class ContentGenerator:
                 lessons_list=format_lessons_list(module.lessons),
                 num_lessons=len(module.lessons)
             )
-            
-            response = self.openai_client.client.chat.completions.create(
-                model="gpt-4-turbo-preview",
-                messages=[
-                    {"role": "system", "content": MODULE_CONTENT_SYSTEM_PROMPT},
-                    {"role": "user", "content": prompt}
-                ],
-                tools=tools,
-                tool_choice={"type": "function", "function": {"name": "create_module_lectures"}},
-                temperature=0.3
+        else:
+            lesson = module.lessons[lesson_index]
+            context = MODULE_LECTURE_CONTEXT_TEMPLATE.format(
+                course_title=course_title,
+                target_audience=target_audience,
+                module_number=module.module_number,
+                module_title=module.module_title,
+                module_goal=module.module_goal,
+                lessons_list=format_lessons_list(module.lessons),
+                lesson_number=lesson_index + 1,
+                lesson_title=lesson.lesson_title,
+                content_outline=format_content_outline(lesson.content_outline)
             )
-            
+        return build_prompt_messages(system, MODULE_CONTENT_INSTRUCTIONS, context, schema)
+    
+    def _build_strategy_request(self, strategy: str, module: Module, course_title: str,
+                                target_audience: str, lesson_index: Optional[int] = None) -> Dict[str, Any]:
+        """Формирует параметры запроса chat.completions для стратегии (lesson_index - лекция одного урока)"""
+        if strategy not in self.MODULE_STRATEGIES:
+            raise ValueError(f"Неизвестная стратегия генерации: {strategy}")
+        messages = self._build_module_messages(strategy, module, course_title, target_audience, lesson_index)
+        
+        if strategy == "function_calling":
+            request = {
+                "model": "gpt-4-turbo-preview",
+                "messages": messages,
+                "tools": MODULE_LECTURES_TOOLS,
+                "tool_choice": {"type": "function", "function": {"name": "create_module_lectures"}},
+                "temperature": 0.3
+            }
+        elif strategy == "json_mode":
+            request = {
+                "model": "gpt-4-turbo-preview",
+                "messages": messages,
+                "response_format": {"type": "json_object"},
+                "temperature": 0.3
+            }
+        else:
+            request = {
+                "model": "gpt-4",
+                "messages": messages,
+                "temperature": 0.3
+            }
+        
+        # max_tokens по прогнозу размера ответа (входит в ключ кэша LLM)
+        apply_token_budget(request, "module_content", self._predict_module_tokens(module, lesson_index))
+        return request
+    
+    @staticmethod
+    def _predict_module_tokens(module: Module, lesson_index: Optional[int] = None) -> int:
+        """Прогноз токенов ответа: лекции по числу уроков и пунктам их планов"""
+        lessons = module.lessons if lesson_index is None else [module.lessons[lesson_index]]
+        return predict_module_content_tokens([len(lesson.content_outline) for lesson in lessons])
+    
+    def _module_budget(self, request: Dict[str, Any], module: Module,
+                       lesson_index: Optional[int] = None) -> TokenBudget:
+        """Бюджет токенов запроса генерации контента модуля"""
+        return plan_token_budget(request, "module_content", self._predict_module_tokens(module, lesson_index))
+    
+    def _needs_split(self, module: Module, course_title: str, target_audience: str) -> bool:
+        """
+        Генерировать ли модуль по урокам: прогноз ответа основной стратегии
+        не помещается в лимит модели
+
+        Лекция - это 8-12 слайдов (~2000-3000 токенов), а ответ gpt-4-turbo-preview
+        ограничен 4096 токенами, поэтому при настройках по умолчанию целиком
+        генерируются только модули из одного урока.
+        """
+        if len(module.lessons) < 2:
+            return False
+        request = self._build_strategy_request(self.MODULE_STRATEGIES[0], module, course_title, target_audience)
+        return not self._module_budget(request, module).fits
+    
+    def _parse_strategy_response(self, strategy: str, response, module: Module) -> Optional[ModuleContent]:
+        """Преобразует ответ OpenAI в ModuleContent"""
+        if strategy == "function_calling":
             # Извлекаем аргументы функции
-            tool_call = response.choices[0].message.tool_calls[0]
-            function_args = json.loads(tool_call.function.arguments)
+            text = response.choices[0].message.tool_calls[0].function.arguments
+        else:
+            text = response.choices[0].message.content
+        return self._parse_strategy_text(strategy, text, module)
+    
+    def _parse_strategy_text(self, strategy: str, text: str, module: Module,
+                             partial: Optional[PartialJson] = None) -> Optional[ModuleContent]:
+        """
+        Преобразует текст ответа в ModuleContent
+        
+        Для Function Calling text - аргументы функции, иначе - содержимое ответа.
+        partial - результат потокового разбора, если ответ читался потоком.
+        """
+        label = self.STRATEGY_LABELS[strategy]
+        
+        if strategy == "function_calling":
+            function_args = self._extract_json(text, partial)
+            if not function_args:
+                logger.warning(f"❌ {label} вернул неправильную структуру")
+                return None
             
             # Формируем полный JSON
             json_content = {
@@ -149,168 +685,108 @@ class ContentGenerator:
             for lecture in json_content["lectures"]:
                 lecture["module_number"] = module.module_number
                 lecture["module_title"] = module.module_title
+        else:
+            json_content = self._extract_json(text, partial)
             
-            # Рассчитываем статистику
-            total_slides = sum(len(lecture["slides"]) for lecture in json_content["lectures"])
-            total_duration = sum(lecture["duration_minutes"] for lecture in json_content["lectures"])
-            
-            json_content["total_slides"] = total_slides
-            json_content["estimated_duration_minutes"] = total_duration
-            
-            module_content = ModuleContent(**json_content)
-            logger.info(f"✅ Function Calling успешно: {len(module_content.lectures)} лекций, {total_slides} слайдов")
-            return module_content
-            
-        except Exception as e:
-            logger.warning(f"❌ Function Calling не сработал: {e}")
-            return None
-    
-    def _try_json_mode(self, module: Module, course_title: str, 
-                       target_audience: str) -> Optional[ModuleContent]:
-        """Попытка генерации через JSON mode"""
-        try:
-            logger.info("🔧 Пробуем JSON mode...")
-            
-            from prompts import MODULE_CONTENT_PROMPT_TEMPLATE, MODULE_CONTENT_SYSTEM_PROMPT, format_lessons_list
-            
-            prompt = MODULE_CONTENT_PROMPT_TEMPLATE.format(
-                course_title=course_title,
-                target_audience=target_audience,
-                module_number=module.module_number,
-                module_title=module.module_title,
-                module_goal=module.module_goal,
-                lessons_list=format_lessons_list(module.lessons),
-                num_lessons=len(module.lessons)
-            )
-            
-            response = self.openai_client.client.chat.completions.create(
-                model="gpt-4-turbo-preview",
-                messages=[
-                    {"role": "system", "content": MODULE_CONTENT_SYSTEM_PROMPT + "\n\nВЫВОД ТОЛЬКО В JSON ФОРМАТЕ!"},
-                    {"role": "user", "content": prompt}
-                ],
-                response_format={"type": "json_object"},
-                temperature=0.3,
-                max_tokens=8000
-            )
-            
-            content = response.choices[0].message.content.strip()
-            json_content = self._extract_json(content)
-            
-            if json_content and "lectures" in json_content:
-                total_slides = sum(len(lecture.get("slides", [])) for lecture in json_content["lectures"])
-                total_duration = sum(lecture.get("duration_minutes", 0) for lecture in json_content["lectures"])
-                
-                json_content["total_slides"] = total_slides
-                json_content["estimated_duration_minutes"] = total_duration
-                
-                module_content = ModuleContent(**json_content)
-                logger.info(f"✅ JSON mode успешно: {len(module_content.lectures)} лекций, {total_slides} слайдов")
-                return module_content
-            else:
-                logger.warning("❌ JSON mode вернул неправильную структуру")
+            if not json_content or "lectures" not in json_content:
+                logger.warning(f"❌ {label} вернул неправильную структуру")
                 return None
-                
-        except Exception as e:
-            logger.warning(f"❌ JSON mode не сработал: {e}")
+        
+        self._drop_invalid_trailing_lectures(json_content["lectures"])
+        if not json_content["lectures"]:
+            logger.warning(f"❌ {label}: нет ни одной валидной лекции")
             return None
+        
+        # Рассчитываем статистику
+        total_slides = sum(len(lecture.get("slides", [])) for lecture in json_content["lectures"])
+        total_duration = sum(lecture.get("duration_minutes", 0) for lecture in json_content["lectures"])
+        
+        json_content["total_slides"] = total_slides
+        json_content["estimated_duration_minutes"] = total_duration
+        
+        with get_metrics().validation_seconds.time(model="ModuleContent"):
+            module_content = ModuleContent(**json_content)
+        logger.info(f"✅ {label} успешно: {len(module_content.lectures)} лекций, {total_slides} слайдов")
+        return module_content
     
-    def _try_text_mode(self, module: Module, course_title: str, 
-                       target_audience: str) -> Optional[ModuleContent]:
-        """Попытка генерации в обычном текстовом режиме"""
-        try:
-            logger.info("🔧 Пробуем обычный текстовый режим...")
-            
-            from prompts import MODULE_CONTENT_PROMPT_TEMPLATE, MODULE_CONTENT_SYSTEM_PROMPT, format_lessons_list
-            
-            prompt = MODULE_CONTENT_PROMPT_TEMPLATE.format(
-                course_title=course_title,
-                target_audience=target_audience,
-                module_number=module.module_number,
-                module_title=module.module_title,
-                module_goal=module.module_goal,
-                lessons_list=format_lessons_list(module.lessons),
-                num_lessons=len(module.lessons)
-            )
-            
-            response = self.openai_client.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": MODULE_CONTENT_SYSTEM_PROMPT},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.3,
-                max_tokens=8000
-            )
-            
-            content = response.choices[0].message.content.strip()
-            json_content = self._extract_json(content)
-            
-            if json_content and "lectures" in json_content:
-                total_slides = sum(len(lecture.get("slides", [])) for lecture in json_content["lectures"])
-                total_duration = sum(lecture.get("duration_minutes", 0) for lecture in json_content["lectures"])
-                
-                json_content["total_slides"] = total_slides
-                json_content["estimated_duration_minutes"] = total_duration
-                
-                module_content = ModuleContent(**json_content)
-                logger.info(f"✅ Текстовый режим успешно: {len(module_content.lectures)} лекций, {total_slides} слайдов")
-                return module_content
-            else:
-                logger.warning("❌ Текстовый режим вернул неправильную структуру")
-                return None
-                
-        except Exception as e:
-            logger.warning(f"❌ Текстовый режим не сработал: {e}")
+    def _drop_invalid_trailing_lectures(self, lectures: List[Dict[str, Any]]):
+        """
+        Удаляет невалидные лекции с конца списка
+        
+        Обычно это последняя лекция обрезанного ответа: остальные лекции
+        при этом остаются пригодными.
+        """
+        while lectures:
+            try:
+                with get_metrics().validation_seconds.time(model="Lecture"):
+                    Lecture(**lectures[-1])
+                return
+            except Exception as e:
+                logger.warning(f"✂️ Отбрасываем невалидную лекцию {len(lectures)}: {e}")
+                lectures.pop()
+    
+    def _parse_json_content(self, content: str, partial: Optional[PartialJson] = None,
+                            kind: str = "module_content") -> Optional[PartialJson]:
+        """
+        Разбирает JSON-объект из ответа модели
+        
+        Пояснения и ```json вокруг объекта пропускаются. Если ответ обрезан
+        (max_tokens), возвращается валидный префикс с закрытыми структурами.
+        
+        Args:
+            partial: Уже разобранный результат (например, из потокового режима)
+            kind: Что разбираем (метка метрики json_extract_seconds)
+        """
+        if partial is None:
+            with get_metrics().json_extract_seconds.time(kind=kind):
+                partial = parse_partial_json(content)
+        
+        if partial is None:
+            logger.error("JSON блок не найден в ответе")
+            logger.debug(f"Проблемный ответ: {content[:500]}...")
             return None
+        
+        if partial.truncated:
+            logger.warning("✂️ Ответ обрезан, используем восстановленную часть JSON")
+        return partial
     
-    def _extract_json(self, content: str) -> Optional[Dict[str, Any]]:
-        """Извлекает JSON из ответа и преобразует в нужный формат"""
-        try:
-            # Удаляем markdown блоки если есть
-            content = content.replace('```json', '').replace('```', '')
-            content = content.strip()
-            
-            # Ищем JSON блок
-            start_idx = content.find('{')
-            end_idx = content.rfind('}') + 1
-            
-            if start_idx == -1 or end_idx <= start_idx:
-                logger.error("JSON блок не найден в ответе")
-                return None
-            
-            json_str = content[start_idx:end_idx]
-            
-            # Проверяем, что JSON не обрезан
-            if not json_str.endswith('}'):
-                logger.error("JSON обрезан или невалиден")
+    def _extract_json(self, content: str, partial: Optional[PartialJson] = None) -> Optional[Dict[str, Any]]:
+        """
+        Извлекает JSON из ответа и преобразует в нужный формат
+        
+        Из обрезанного ответа берутся только лекции, полученные целиком.
+        """
+        partial = self._parse_json_content(content, partial)
+        if partial is None:
+            return None
+        parsed = partial.value
+        
+        # КЛЮЧЕВОЕ ИЗМЕНЕНИЕ: Проверяем, какая структура пришла
+        if 'lectures' in parsed and isinstance(parsed['lectures'], list):
+            # ✅ Правильная структура - возвращаем как есть
+            logger.info("✅ Получена правильная структура с 'lectures'")
+            if partial.truncated:
+                lectures = parsed['lectures']
+                parsed['lectures'] = [
+                    lecture for index, lecture in enumerate(lectures)
+                    if partial.is_complete(("lectures", index))
+                ]
+                dropped = len(lectures) - len(parsed['lectures'])
+                if dropped:
+                    logger.warning(f"✂️ Отброшено незавершённых лекций: {dropped}")
+            if len(parsed['lectures']) == 0:
+                logger.error("В JSON нет лекций (пустой список)")
                 return None
+            return parsed
             
-            # Пытаемся распарсить
-            parsed = json.loads(json_str)
-            
-            # КЛЮЧЕВОЕ ИЗМЕНЕНИЕ: Проверяем, какая структура пришла
-            if 'lectures' in parsed and isinstance(parsed['lectures'], list):
-                # ✅ Правильная структура - возвращаем как есть
-                logger.info("✅ Получена правильная структура с 'lectures'")
-                if len(parsed['lectures']) == 0:
-                    logger.error("В JSON нет лекций (пустой список)")
-                    return None
-                return parsed
-                
-            elif 'lesson_title' in parsed:
-                # 🔄 OpenAI вернул структуру УРОКА - преобразуем в ЛЕКЦИЮ!
-                logger.warning("⚠️ OpenAI вернул структуру урока вместо лекций. Преобразуем...")
-                return self._convert_lesson_to_lectures(parsed)
-            
-            else:
-                logger.error(f"❌ Неизвестная структура JSON. Доступные ключи: {list(parsed.keys())}")
-                logger.debug(f"Полный JSON: {parsed}")
-                return None
-                
-        except json.JSONDecodeError as e:
-            logger.error(f"Ошибка парсинга JSON: {e}")
-            logger.debug(f"Проблемный JSON: {content[:500]}...")
+        elif 'lesson_title' in parsed:
+            # 🔄 OpenAI вернул структуру УРОКА - преобразуем в ЛЕКЦИЮ!
+            logger.warning("⚠️ OpenAI вернул структуру урока вместо лекций. Преобразуем...")
+            return self._convert_lesson_to_lectures(parsed)
+        
+        else:
+            logger.error(f"❌ Неизвестная структура JSON. Доступные ключи: {list(parsed.keys())}")
+            logger.debug(f"Полный JSON: {parsed}")
             return None
     
     def _extract_lesson_json(self, content: str) -> Optional[Dict[str, Any]]:
@@ -319,20 +795,10 @@ class ContentGenerator:
         Если OpenAI вернул lectures - преобразуем обратно в lesson
         """
         try:
-            # Удаляем markdown блоки если есть
-            content = content.replace('```json', '').replace('```', '')
-            content = content.strip()
-            
-            # Ищем JSON блок
-            start_idx = content.find('{')
-            end_idx = content.rfind('}') + 1
-            
-            if start_idx == -1 or end_idx <= start_idx:
-                logger.error("JSON блок не найден в ответе")
+            partial = self._parse_json_content(content, kind="lesson")
+            if partial is None:
                 return None
-            
-            json_str = content[start_idx:end_idx]
-            parsed = json.loads(json_str)
+            parsed = partial.value
             
             # Если пришла правильная структура lesson - возвращаем как есть
             if 'lesson_title' in parsed and 'lesson_goal' in parsed:
@@ -348,9 +814,6 @@ class ContentGenerator:
                 logger.error(f"❌ Неизвестная структура JSON для урока. Ключи: {list(parsed.keys())}")
                 return None
                 
-        except json.JSONDecodeError as e:
-            logger.error(f"Ошибка парсинга JSON: {e}")
-            return None
         except Exception as e:
             logger.error(f"Ошибка извлечения JSON урока: {e}")
             return None
@@ -436,27 +899,10 @@ class ContentGenerator:
         Специальный метод для извлечения учебных материалов по теме
         """
         try:
-            # Удаляем markdown блоки если есть
-            content = content.replace('```json', '').replace('```', '')
-            content = content.strip()
-            
-            # Ищем JSON блок
-            start_idx = content.find('{')
-            end_idx = content.rfind('}') + 1
-            
-            if start_idx == -1 or end_idx <= start_idx:
-                logger.error("JSON блок не найден в ответе")
+            partial = self._parse_json_content(content, kind="topic_material")
+            if partial is None:
                 return None
-            
-            json_str = content[start_idx:end_idx]
-            
-            # Проверяем, что JSON не обрезан
-            if not json_str.endswith('}'):
-                logger.error("JSON обрезан или невалиден")
-                return None
-            
-            # Пытаемся распарсить
-            parsed = json.loads(json_str)
+            parsed = partial.value
             
             # Проверяем, что это структура TopicMaterial
             required_fields = ['topic_title', 'topic_number', 'introduction', 'theory', 
@@ -483,10 +929,6 @@ class ContentGenerator:
             logger.info("✅ Извлечен JSON для TopicMaterial")
             return parsed
                 
-        except json.JSONDecodeError as e:
-            logger.error(f"Ошибка парсинга JSON для топика: {e}")
-            logger.debug(f"Проблемный JSON: {content[:500]}...")
-            return None
         except Exception as e:
             logger.error(f"Неожиданная ошибка при извлечении topic JSON: {e}")
             return None
@@ -591,6 +1033,7 @@ class ContentGenerator:
     
     def _get_test_module_content(self, module: Module) -> ModuleContent:
         """Возвращает тестовый контент для демонстрации"""
+        get_metrics().fallbacks.inc(kind="module_content")
         lectures = []
         
         for i, lesson in enumerate(module.lessons, 1):
@@ -694,6 +1137,82 @@ class ContentGenerator:
                 # Fallback: создаем базовый материал
                 topics.append(self._get_test_topic_material(topic_number, topic_title))
         
+        return self.build_lesson_content(lesson, module_number, topics)
+    
+    async def generate_lesson_detailed_content_async(self, lesson: Lesson, module_number: int,
+                                                     course_title: str, module_title: str,
+                                                     target_audience: str,
+                                                     max_concurrency: Optional[int] = None,
+                                                     use_cache: bool = True,
+                                                     on_progress: Optional[ProgressCallback] = None) -> Optional[LessonContent]:
+        """
+        Асинхронная версия generate_lesson_detailed_content
+        
+        Материалы по всем темам генерируются одновременно (fan-out),
+        не более max_concurrency запросов за раз. Порядок тем сохраняется,
+        для неудавшихся тем используется базовый материал (см. generate_topic_material_async).
+        
+        Args:
+            max_concurrency: Лимит одновременных запросов
+                (по умолчанию TOPIC_GENERATION_CONCURRENCY, 1 - последовательно)
+            use_cache: Брать материалы тем из кэша LLM (False - для "Сгенерировать заново")
+            on_progress: async-колбэк после каждой готовой темы, получает
+                dict с topics_done, topics_total, topic_title
+        """
+        logger.info(f"Генерируем детальный контент для урока (async): {lesson.lesson_title}")
+        logger.info(f"Темы для детализации: {len(lesson.content_outline)}")
+        
+        concurrency = max(1, max_concurrency or TOPIC_GENERATION_CONCURRENCY)
+        semaphore = asyncio.Semaphore(concurrency)
+        total_topics = len(lesson.content_outline)
+        topics_done = 0
+        
+        async def generate_topic(topic_number: int, topic_title: str):
+            nonlocal topics_done
+            async with semaphore:
+                logger.info(f"Генерируем материал для темы {topic_number}/{total_topics}: {topic_title}")
+                started = time.perf_counter()
+                topic_material = await self.generate_topic_material_async(
+                    topic_number=topic_number,
+                    topic_title=topic_title,
+                    lesson=lesson,
+                    module_number=module_number,
+                    course_title=course_title,
+                    module_title=module_title,
+                    target_audience=target_audience,
+                    use_cache=use_cache
+                )
+                latency = time.perf_counter() - started
+            
+            topics_done += 1
+            if on_progress:
+                await self._report_progress(on_progress, {
+                    "topics_done": topics_done,
+                    "topics_total": total_topics,
+                    "topic_title": topic_title,
+                })
+            return topic_material, latency
+        
+        started = time.perf_counter()
+        results = await asyncio.gather(*[
+            generate_topic(topic_number, topic_title)
+            for topic_number, topic_title in enumerate(lesson.content_outline, start=1)
+        ])
+        wall_time = time.perf_counter() - started
+        
+        topics = [topic_material for topic_material, _ in results]
+        sum_latency = sum(latency for _, latency in results)
+        
+        logger.info(
+            f"⏱️ Темы урока: {total_topics} шт., параллельно до {concurrency}: "
+            f"{wall_time:.1f} с вместо {sum_latency:.1f} с последовательно"
+        )
+        
+        return self.build_lesson_content(lesson, module_number, topics)
+    
+    def build_lesson_content(self, lesson: Lesson, module_number: int,
+                              topics: List[TopicMaterial]) -> Optional[LessonContent]:
+        """Собирает LessonContent из материалов по темам"""
         if not topics:
             logger.error("Не удалось сгенерировать ни одного материала по темам")
             return None
@@ -713,21 +1232,74 @@ class ContentGenerator:
         logger.info(f"✅ Детальный контент создан: {len(topics)} тем, ~{total_time} мин")
         return lesson_content
     
+    def _build_topic_requests(self, topic_number: int, topic_title: str,
+                              lesson: Lesson, course_title: str, module_title: str,
+                              target_audience: str) -> List[Dict[str, Any]]:
+        """
+        Формирует параметры запросов для темы
+        
+        Первый запрос - JSON mode, второй - обычный режим (если JSON mode не сработал)
+        """
+        context = TOPIC_MATERIAL_CONTEXT_TEMPLATE.format(
+            course_title=course_title,
+            target_audience=target_audience,
+            module_title=module_title,
+            lesson_title=lesson.lesson_title,
+            lesson_goal=lesson.lesson_goal,
+            topic_number=topic_number,
+            topic_title=topic_title
+        )
+        
+        messages = build_prompt_messages(
+            TOPIC_MATERIAL_SYSTEM_PROMPT, TOPIC_MATERIAL_INSTRUCTIONS, context,
+            response_schema(TOPIC_MATERIAL_SCHEMA, TOPIC_MATERIAL_SCHEMA_COMPACT)
+        )
+        
+        requests = [
+            {
+                "model": "gpt-4-turbo-preview",
+                "messages": messages,
+                "response_format": {"type": "json_object"},
+                "temperature": 0.7
+            },
+            {
+                "model": "gpt-4",
+                "messages": messages,
+                "temperature": 0.7
+            }
+        ]
+        for request in requests:
+            apply_token_budget(request, "topic_material", predict_topic_material_tokens())
+        return requests
+    
+    def _parse_topic_response(self, response, topic_title: str) -> Optional[TopicMaterial]:
+        """Преобразует ответ OpenAI в TopicMaterial"""
+        if not response:
+            return None
+        
+        content = response.choices[0].message.content.strip()
+        
+        # Извлекаем JSON специальным методом для TopicMaterial
+        json_content = self._extract_topic_json(content)
+        
+        if not json_content:
+            logger.warning(f"Не удалось извлечь JSON для темы: {topic_title}")
+            return None
+        
+        # Создаем объект TopicMaterial
+        with get_metrics().validation_seconds.time(model="TopicMaterial"):
+            topic_material = TopicMaterial(**json_content)
+        logger.info(f"✅ Материал создан: {len(topic_material.examples)} примеров, {len(topic_material.quiz_questions)} вопросов")
+        return topic_material
+    
     def _generate_topic_material(self, topic_number: int, topic_title: str,
                                 lesson: Lesson, module_number: int,
                                 course_title: str, module_title: str,
                                 target_audience: str) -> Optional[TopicMaterial]:
         """Генерирует детальный материал для одной темы"""
         try:
-            # Формируем промпт
-            prompt = TOPIC_MATERIAL_PROMPT_TEMPLATE.format(
-                course_title=course_title,
-                target_audience=target_audience,
-                module_title=module_title,
-                lesson_title=lesson.lesson_title,
-                lesson_goal=lesson.lesson_goal,
-                topic_number=topic_number,
-                topic_title=topic_title
+            json_request, text_request = self._build_topic_requests(
+                topic_number, topic_title, lesson, course_title, module_title, target_audience
             )
             
             # Пробуем разные методы
@@ -735,45 +1307,69 @@ class ContentGenerator:
             
             # Попытка 1: JSON mode
             try:
-                response = self.openai_client.client.chat.completions.create(
-                    model="gpt-4-turbo-preview",
-                    messages=[
-                        {"role": "system", "content": TOPIC_MATERIAL_SYSTEM_PROMPT},
-                        {"role": "user", "content": prompt}
-                    ],
-                    response_format={"type": "json_object"},
-                    temperature=0.7,
-                    max_tokens=4000  # Увеличиваем для детального контента
-                )
+                response = self.openai_client.client.chat.completions.create(**json_request)
                 logger.info("✅ Используем JSON mode для генерации темы")
             except Exception as e:
                 logger.warning(f"JSON mode не сработал: {e}")
                 # Попытка 2: Обычный режим
-                response = self.openai_client.client.chat.completions.create(
-                    model="gpt-4",
-                    messages=[
-                        {"role": "system", "content": TOPIC_MATERIAL_SYSTEM_PROMPT},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.7,
-                    max_tokens=4000
-                )
+                response = self.openai_client.client.chat.completions.create(**text_request)
             
-            if not response:
-                return None
+            return self._parse_topic_response(response, topic_title)
             
-            content = response.choices[0].message.content.strip()
+        except Exception as e:
+            logger.error(f"Ошибка генерации материала для темы '{topic_title}': {e}")
+            return None
+    
+    async def generate_topic_material_async(self, topic_number: int, topic_title: str,
+                                            lesson: Lesson, module_number: int,
+                                            course_title: str, module_title: str,
+                                            target_audience: str,
+                                            use_cache: bool = True) -> TopicMaterial:
+        """Материал по одной теме урока; если сгенерировать не удалось - базовый материал"""
+        topic_material = await self._generate_topic_material_async(
+            topic_number, topic_title, lesson, module_number, course_title, module_title,
+            target_audience, use_cache=use_cache
+        )
+        if not topic_material:
+            # Fallback: создаем базовый материал
+            topic_material = self._get_test_topic_material(topic_number, topic_title)
+        return topic_material
+    
+    async def _generate_topic_material_async(self, topic_number: int, topic_title: str,
+                                             lesson: Lesson, module_number: int,
+                                             course_title: str, module_title: str,
+                                             target_audience: str,
+                                             use_cache: bool = True) -> Optional[TopicMaterial]:
+        """Асинхронно генерирует детальный материал для одной темы"""
+        try:
+            json_request, text_request = self._build_topic_requests(
+                topic_number, topic_title, lesson, course_title, module_title, target_audience
+            )
             
-            # Извлекаем JSON специальным методом для TopicMaterial
-            json_content = self._extract_topic_json(content)
+            # Ключ кэша - JSON-запрос, независимо от того, какой режим в итоге сработал
+            if use_cache:
+                cached = await cache_lookup("topic_material", json_request)
+                if cached:
+                    logger.info(f"💾 Материал темы взят из кэша: {topic_title}")
+                    return TopicMaterial.parse_raw(cached)
             
-            if not json_content:
-                logger.warning(f"Не удалось извлечь JSON для темы: {topic_title}")
-                return None
+            response = None
             
-            # Создаем объект TopicMaterial
-            topic_material = TopicMaterial(**json_content)
-            logger.info(f"✅ Материал создан: {len(topic_material.examples)} примеров, {len(topic_material.quiz_questions)} вопросов")
+            # Попытка 1: JSON mode
+            try:
+                with llm_call_labels(strategy="json_mode", template="topic_material"):
+                    response = await self.async_client.chat_completion(**json_request)
+                logger.info("✅ Используем JSON mode для генерации темы")
+            except Exception as e:
+                logger.warning(f"JSON mode не сработал: {e}")
+                # Попытка 2: Обычный режим
+                with llm_call_labels(strategy="text_mode", template="topic_material"):
+                    response = await self.async_client.chat_completion(**text_request)
+            
+            plan_token_budget(json_request, "topic_material", predict_topic_material_tokens()).observe_response(response)
+            topic_material = self._parse_topic_response(response, topic_title)
+            if topic_material:
+                await cache_store("topic_material", json_request, topic_material.json())
             return topic_material
             
         except Exception as e:
@@ -782,6 +1378,7 @@ class ContentGenerator:
     
     def _get_test_topic_material(self, topic_number: int, topic_title: str) -> TopicMaterial:
         """Возвращает тестовый учебный материал по теме"""
+        get_metrics().fallbacks.inc(kind="topic_material")
         return TopicMaterial(
             topic_title=topic_title,
             topic_number=topic_number,
@@ -16,7 +16,13 @@ import ssl
 ssl._create_default_https_context = ssl._create_unverified_context
 # ----------------------------------------------------
 
+import asyncio
 import logging
+import secrets
+import signal
+import socket
+import sys
+import time
 import httpx
 from dotenv import load_dotenv
 from telegram import Update
@@ -25,6 +31,7 @@ from telegram.ext import (
     CommandHandler,
     CallbackQueryHandler,
     MessageHandler,
+    TypeHandler,
     filters,
 )
 
@@ -39,15 +46,55 @@ from handlers import (
     regenerate_content,
     regenerate_lesson,
     generate_topics,
+    generate_all,
     export_course,
     handle_callback,
-    handle_message
+    handle_message,
+    persist_session,
+    load_session,
+    show_jobs
 )
+from openai_client import close_async_openai_client
+from job_manager import get_job_manager
+from export_pool import get_export_pool
+from exporters import get_export_templates
+from utils import get_session_manager, get_rate_limiter, get_metrics
+from utils.metrics import start_metrics_server, InstrumentedHTTPXRequest
+from utils.tokens import tokenizer_name
+from utils.loop_monitor import get_loop_monitor
+from utils.webhook import serve_webhook, WEBHOOK_URL
+from sharding import ProcessSupervisor, serve_front, serve_shard
 
 # ---------- ЗАГРУЗКА КОНФИГУРАЦИИ ----------
 load_dotenv()
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 
+# Сколько апдейтов обрабатывается одновременно (генерация не блокирует других пользователей)
+CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "256"))
+
+# Размер пула соединений к Bot API (как по умолчанию в ApplicationBuilder)
+BOT_CONNECTION_POOL_SIZE = 256
+
+# Получение апдейтов: polling или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+
+# Количество процессов бота в режиме webhook: слушают один порт (SO_REUSEPORT),
+# сессии и задачи хранятся в общих SQLite-файлах
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+
+# Номер процесса-воркера (задаёт главный процесс при BOT_WORKERS > 1)
+BOT_WORKER_ID = os.getenv("BOT_WORKER_ID")
+
+# Количество процессов-шардов: фронт-процесс принимает апдейты и раздаёт их
+# шардам по user_id (см. sharding.py)
+BOT_SHARDS = int(os.getenv("BOT_SHARDS", "1"))
+
+# Номер шарда (задаёт фронт-процесс)
+BOT_SHARD_ID = os.getenv("BOT_SHARD_ID")
+
+# Команда запуска дочерних процессов бота
+BOT_COMMAND = [sys.executable, os.path.abspath(__file__)]
+
 # ---------- ЛОГИРОВАНИЕ ----------
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -56,12 +103,124 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def register_handlers(app):
+    """Регистрирует обработчики бота (используется также нагрузочным тестом)"""
+    # Сначала загружаем сессию (и проверяем её версию, если хранилище общее с другими процессами)
+    app.add_handler(TypeHandler(Update, load_session), group=-1)
+
+    # Регистрируем обработчики команд
+    app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("help", help_command))
+    app.add_handler(CommandHandler("create", create_course))
+    app.add_handler(CommandHandler("view", view_course))
+    app.add_handler(CommandHandler("edit", edit_course))
+    app.add_handler(CommandHandler("generate", generate_content))
+    app.add_handler(CommandHandler("regenerate", regenerate_content))
+    app.add_handler(CommandHandler("regenerate_lesson", regenerate_lesson))
+    app.add_handler(CommandHandler("generate_topics", generate_topics))
+    app.add_handler(CommandHandler("generate_all", generate_all))
+    app.add_handler(CommandHandler("jobs", show_jobs))
+    app.add_handler(CommandHandler("export", export_course))
+    
+    # Регистрируем обработчики callback и сообщений
+    app.add_handler(CallbackQueryHandler(handle_callback))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    
+    # Сохранение изменённых сессий после основного обработчика
+    app.add_handler(TypeHandler(Update, persist_session), group=1)
+
+
+def run_workers():
+    """
+    Запускает BOT_WORKERS процессов бота в режиме webhook и следит за ними
+
+    Процессы слушают один порт, ядро распределяет между ними соединения
+    Telegram. Упавший процесс перезапускается, SIGINT/SIGTERM передаются
+    всем процессам.
+    """
+    if os.getenv("SESSION_BACKEND", "sqlite") == "memory":
+        print("❌ BOT_WORKERS > 1 требует общего хранилища сессий (SESSION_BACKEND=sqlite)")
+        return
+    if not hasattr(socket, "SO_REUSEPORT"):
+        print("❌ BOT_WORKERS > 1 не поддерживается на этой платформе (нет SO_REUSEPORT)")
+        return
+
+    metrics_port = int(os.getenv("METRICS_PORT", "9108"))
+    supervisor = ProcessSupervisor(
+        BOT_WORKERS, BOT_COMMAND,
+        lambda worker_id: {
+            "BOT_WORKER_ID": str(worker_id),
+            "SESSION_SHARED": "1",
+            # У каждого процесса свой эндпоинт метрик
+            "METRICS_PORT": str(metrics_port + worker_id if metrics_port else 0),
+        },
+        name="процесс бота",
+    )
+    signal.signal(signal.SIGINT, lambda signum, frame: supervisor.terminate())
+    signal.signal(signal.SIGTERM, lambda signum, frame: supervisor.terminate())
+
+    supervisor.start()
+    while not supervisor.stopping:
+        time.sleep(1)
+        supervisor.check()
+    supervisor.wait()
+
+
+def run_front():
+    """
+    Запускает фронт-процесс и BOT_SHARDS процессов-шардов
+
+    Фронт только принимает апдейты и раздаёт их шардам по user_id,
+    обработчики бота работают в шардах.
+    """
+    metrics_port = int(os.getenv("METRICS_PORT", "9108"))
+    supervisor = ProcessSupervisor(
+        BOT_SHARDS, BOT_COMMAND,
+        lambda shard_id: {
+            "BOT_SHARD_ID": str(shard_id),
+            # Метрики фронта на METRICS_PORT, шардов - на следующих портах
+            "METRICS_PORT": str(metrics_port + 1 + shard_id if metrics_port else 0),
+        },
+        name="шард",
+    )
+    app = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .request(InstrumentedHTTPXRequest(connection_pool_size=BOT_CONNECTION_POOL_SIZE))
+        .job_queue(None)
+        .build()
+    )
+    print(f"✅ AI Course Builder: фронт-процесс, шардов: {BOT_SHARDS}. Нажмите Ctrl+C для остановки.")
+    asyncio.run(serve_front(
+        app, supervisor, BOT_SHARDS, mode=BOT_MODE,
+        secret_token=os.getenv("WEBHOOK_SECRET_TOKEN", ""),
+    ))
+
+
 def main():
     """Главная функция запуска бота"""
     if not TOKEN:
         print("❌ TELEGRAM_BOT_TOKEN не найден в .env")
         return
 
+    if BOT_SHARDS > 1 and BOT_WORKERS > 1:
+        print("❌ BOT_SHARDS и BOT_WORKERS нельзя использовать вместе")
+        return
+
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_URL:
+            print("❌ Для BOT_MODE=webhook нужен WEBHOOK_URL")
+            return
+        # Без заданного секрета генерируем свой (общий для всех процессов)
+        if not os.getenv("WEBHOOK_SECRET_TOKEN"):
+            os.environ["WEBHOOK_SECRET_TOKEN"] = secrets.token_urlsafe(32)
+        if BOT_WORKERS > 1 and BOT_WORKER_ID is None:
+            run_workers()
+            return
+    elif BOT_WORKERS > 1:
+        print("❌ BOT_WORKERS > 1 поддерживается только в режиме BOT_MODE=webhook")
+        return
+
     # Патчим httpx.AsyncClient для отключения SSL
     original_init = httpx.AsyncClient.__init__
     
@@ -70,31 +229,79 @@ def main():
         original_init(self, *args, **kwargs)
     
     httpx.AsyncClient.__init__ = patched_init
+
+    if BOT_SHARDS > 1 and BOT_SHARD_ID is None:
+        run_front()
+        return
+    
+    async def on_startup(application):
+        """Запускает воркеров фоновых задач, эндпоинт метрик и контроль event loop"""
+        # Ошибка в шаблоне экспорта видна при запуске, а не при первом экспорте
+        get_export_templates()
+        # Словарь токенизатора может скачиваться - не в event loop
+        await asyncio.to_thread(tokenizer_name)
+        await get_job_manager().start()
+        
+        metrics = get_metrics()
+        metrics.gauge("openai_queue_depth", "Запросы, ожидающие лимита OpenAI",
+                      lambda: get_rate_limiter().queue_depth)
+        metrics.gauge("job_queue_depth", "Задачи генерации в очереди",
+                      lambda: get_job_manager().queue_depth)
+        metrics.gauge("jobs_running", "Выполняющиеся задачи генерации",
+                      lambda: get_job_manager().running_count)
+        metrics.gauge("sessions_loaded", "Сессии в памяти",
+                      lambda: len(get_session_manager().get_all_sessions()))
+        application.bot_data["metrics_server"] = await start_metrics_server()
+        
+        loop_monitor = get_loop_monitor()
+        if loop_monitor:
+            await loop_monitor.start()
+    
+    async def on_shutdown(application):
+        """Останавливает задачи и пул экспорта, сохраняет сессии и закрывает общий HTTP клиент OpenAI"""
+        metrics_server = application.bot_data.get("metrics_server")
+        if metrics_server:
+            metrics_server.close()
+        loop_monitor = get_loop_monitor()
+        if loop_monitor:
+            await loop_monitor.stop()
+        await get_job_manager().stop()
+        await asyncio.to_thread(get_export_pool().shutdown)
+        await get_session_manager().drain()
+        get_session_manager().flush()
+        await close_async_openai_client()
     
     # Создаём приложение без JobQueue (для совместимости с Python 3.13)
-    app = ApplicationBuilder().token(TOKEN).job_queue(None).build()
+    app = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .request(InstrumentedHTTPXRequest(connection_pool_size=BOT_CONNECTION_POOL_SIZE))
+        .job_queue(None)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
-    # Регистрируем обработчики команд
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("help", help_command))
-    app.add_handler(CommandHandler("create", create_course))
-    app.add_handler(CommandHandler("view", view_course))
-    app.add_handler(CommandHandler("edit", edit_course))
-    app.add_handler(CommandHandler("generate", generate_content))
-    app.add_handler(CommandHandler("regenerate", regenerate_content))
-    app.add_handler(CommandHandler("regenerate_lesson", regenerate_lesson))
-    app.add_handler(CommandHandler("generate_topics", generate_topics))
-    app.add_handler(CommandHandler("export", export_course))
-    
-    # Регистрируем обработчики callback и сообщений
-    app.add_handler(CallbackQueryHandler(handle_callback))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    register_handlers(app)
 
     print("✅ AI Course Builder запущен! Нажмите Ctrl+C для остановки.")
     logger.info("AI Course Builder bot started successfully")
     
     # Запускаем бота
-    app.run_polling(stop_signals=None, allowed_updates=Update.ALL_TYPES)
+    if BOT_SHARD_ID is not None:
+        # Апдейты приходят от фронт-процесса
+        asyncio.run(serve_shard(app, int(BOT_SHARD_ID), CONCURRENT_UPDATES))
+    elif BOT_MODE == "webhook":
+        # Webhook в Telegram регистрирует только первый процесс
+        asyncio.run(serve_webhook(
+            app,
+            register=BOT_WORKER_ID in (None, "0"),
+            reuse_port=BOT_WORKERS > 1,
+            secret_token=os.environ["WEBHOOK_SECRET_TOKEN"],
+        ))
+    else:
+        app.run_polling(stop_signals=None, allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == "__main__":
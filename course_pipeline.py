@@ -0,0 +1,297 @@
+"""
+Пайплайн генерации контента для всего курса
+
+Строит граф задач (лекции модулей, материалы по темам, сборка уроков)
+и выполняет его с глобальным и пользовательским лимитами параллельности.
+"""
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+from models import UserSession
+from content_generator import ContentGenerator
+
+logger = logging.getLogger(__name__)
+
+# Сколько задач генерации выполняется одновременно во всём процессе
+PIPELINE_GLOBAL_CONCURRENCY = int(os.getenv('PIPELINE_GLOBAL_CONCURRENCY', '16'))
+
+# Сколько задач генерации одного пользователя выполняется одновременно
+PIPELINE_USER_CONCURRENCY = int(os.getenv('PIPELINE_USER_CONCURRENCY', '4'))
+
+_global_semaphore: Optional[asyncio.Semaphore] = None
+_user_semaphores: Dict[int, asyncio.Semaphore] = {}
+# Задачи пользователя, занявшие или ожидающие его семафор (семафор удаляется вместе с последней)
+_user_slot_holders: Dict[int, int] = {}
+_active_users: Set[int] = set()
+
+
+def _get_global_semaphore() -> asyncio.Semaphore:
+    """Глобальный лимит параллельных задач генерации"""
+    global _global_semaphore
+    if _global_semaphore is None:
+        _global_semaphore = asyncio.Semaphore(PIPELINE_GLOBAL_CONCURRENCY)
+    return _global_semaphore
+
+
+@asynccontextmanager
+async def _user_slot(user_id: int):
+    """Слот в лимите параллельных задач генерации пользователя"""
+    if user_id not in _user_semaphores:
+        _user_semaphores[user_id] = asyncio.Semaphore(PIPELINE_USER_CONCURRENCY)
+    semaphore = _user_semaphores[user_id]
+    _user_slot_holders[user_id] = _user_slot_holders.get(user_id, 0) + 1
+    try:
+        async with semaphore:
+            yield
+    finally:
+        _user_slot_holders[user_id] -= 1
+        if not _user_slot_holders[user_id]:
+            del _user_slot_holders[user_id]
+            del _user_semaphores[user_id]
+
+
+class PipelineTask:
+    """Задача графа генерации"""
+
+    def __init__(self, name: str, kind: str, run: Callable[[], Awaitable[Any]],
+                 depends_on: Iterable[str] = (), uses_slot: bool = True):
+        self.name = name
+        self.kind = kind  # module, topic, lesson
+        self.run = run
+        self.depends_on = list(depends_on)
+        self.uses_slot = uses_slot  # Занимает ли задача слот параллельности (запросы к OpenAI)
+
+        self.status = "pending"  # pending, running, done, failed
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.duration = 0.0
+
+
+class TaskGraph:
+    """
+    Граф задач с зависимостями
+
+    Задача запускается, когда завершены все её зависимости.
+    Задачи с uses_slot=True ограничены пользовательским и глобальным семафорами.
+    """
+
+    def __init__(self, user_id: int,
+                 on_task_done: Optional[Callable[[PipelineTask], Awaitable[None]]] = None):
+        self.user_id = user_id
+        self.on_task_done = on_task_done
+        self.tasks: Dict[str, PipelineTask] = {}
+
+    def add(self, task: PipelineTask) -> PipelineTask:
+        """Добавляет задачу в граф"""
+        if task.name in self.tasks:
+            raise ValueError(f"Задача уже существует: {task.name}")
+        self.tasks[task.name] = task
+        return task
+
+    def count(self, kind: str, status: Optional[str] = None) -> int:
+        """Количество задач данного типа (и статуса)"""
+        return sum(
+            1 for task in self.tasks.values()
+            if task.kind == kind and (status is None or task.status == status)
+        )
+
+    async def run(self):
+        """Выполняет все задачи графа"""
+        for task in self.tasks.values():
+            missing = [dep for dep in task.depends_on if dep not in self.tasks]
+            if missing:
+                raise ValueError(f"Задача {task.name} зависит от неизвестных задач: {missing}")
+
+        runners: Dict[str, asyncio.Task] = {}
+
+        async def run_task(task: PipelineTask):
+            if task.depends_on:
+                await asyncio.gather(*(runners[dep] for dep in task.depends_on))
+
+            if task.uses_slot:
+                # Сначала пользовательский лимит, чтобы не занимать глобальные слоты в ожидании
+                async with _user_slot(self.user_id):
+                    async with _get_global_semaphore():
+                        await self._execute(task)
+            else:
+                await self._execute(task)
+
+            if self.on_task_done:
+                try:
+                    await self.on_task_done(task)
+                except Exception as e:
+                    logger.warning(f"Ошибка обработчика прогресса: {e}")
+
+        for task in self.tasks.values():
+            runners[task.name] = asyncio.create_task(run_task(task))
+
+        await asyncio.gather(*runners.values())
+
+    async def _execute(self, task: PipelineTask):
+        """Выполняет задачу, сохраняя результат или ошибку"""
+        task.status = "running"
+        started = time.perf_counter()
+        try:
+            task.result = await task.run()
+            task.status = "done"
+        except Exception as e:
+            task.status = "failed"
+            task.error = str(e)
+            logger.error(f"❌ Задача {task.name} завершилась с ошибкой: {e}")
+        finally:
+            task.duration = time.perf_counter() - started
+
+
+class CoursePipeline:
+    """
+    Генерация всего контента курса
+
+    Для каждого модуля - лекции и слайды, для каждого урока - детальные
+    материалы по всем темам. Результаты сразу сохраняются в сессию:
+    session.module_contents[индекс модуля] и lesson.detailed_content.
+    """
+
+    def __init__(self, session: UserSession, content_generator: ContentGenerator,
+                 on_progress: Optional[Callable[["CoursePipeline"], Awaitable[None]]] = None):
+        self.session = session
+        self.course = session.current_course
+        self.content_generator = content_generator
+        self.on_progress = on_progress
+        self.graph = TaskGraph(session.user_id, on_task_done=self._on_task_done)
+        self.started_at = 0.0
+        self.finished_at = 0.0
+        self._build_graph()
+
+    def _build_graph(self):
+        """Строит граф задач для курса"""
+        course = self.course
+
+        for module_index, module in enumerate(course.modules):
+            self.graph.add(PipelineTask(
+                name=f"module:{module_index}",
+                kind="module",
+                run=self._module_runner(module_index)
+            ))
+
+            for lesson_index, lesson in enumerate(module.lessons):
+                if not lesson.content_outline:
+                    continue
+
+                topic_tasks = []
+                for topic_number, topic_title in enumerate(lesson.content_outline, start=1):
+                    task = self.graph.add(PipelineTask(
+                        name=f"topic:{module_index}:{lesson_index}:{topic_number}",
+                        kind="topic",
+                        run=self._topic_runner(module_index, lesson_index, topic_number, topic_title)
+                    ))
+                    topic_tasks.append(task.name)
+
+                # Сборка урока ждёт все темы и не обращается к OpenAI
+                self.graph.add(PipelineTask(
+                    name=f"lesson:{module_index}:{lesson_index}",
+                    kind="lesson",
+                    run=self._lesson_runner(module_index, lesson_index, topic_tasks),
+                    depends_on=topic_tasks,
+                    uses_slot=False
+                ))
+
+    def _module_runner(self, module_index: int):
+        """Задача генерации лекций модуля"""
+        async def run():
+            module = self.course.modules[module_index]
+            # Задача занимает один слот пользователя - лекции по урокам запрашиваются по одной
+            module_content = await self.content_generator.generate_module_content_async(
+                module=module,
+                course_title=self.course.course_title,
+                target_audience=self.course.target_audience,
+                max_concurrency=1
+            )
+            if module_content:
+                self.session.module_contents[module_index] = module_content
+                if self.session.current_module_content is None:
+                    self.session.current_module_content = module_content
+            return module_content
+        return run
+
+    def _topic_runner(self, module_index: int, lesson_index: int, topic_number: int, topic_title: str):
+        """Задача генерации материала по одной теме урока"""
+        async def run():
+            module = self.course.modules[module_index]
+            lesson = module.lessons[lesson_index]
+            return await self.content_generator.generate_topic_material_async(
+                topic_number=topic_number,
+                topic_title=topic_title,
+                lesson=lesson,
+                module_number=module.module_number,
+                course_title=self.course.course_title,
+                module_title=module.module_title,
+                target_audience=self.course.target_audience
+            )
+        return run
+
+    def _lesson_runner(self, module_index: int, lesson_index: int, topic_tasks: List[str]):
+        """Задача сборки детальных материалов урока из тем"""
+        async def run():
+            module = self.course.modules[module_index]
+            lesson = module.lessons[lesson_index]
+            topics = [
+                self.graph.tasks[name].result
+                for name in topic_tasks
+                if self.graph.tasks[name].result is not None
+            ]
+            lesson_content = self.content_generator.build_lesson_content(lesson, module.module_number, topics)
+            if lesson_content:
+                lesson.detailed_content = lesson_content
+            return lesson_content
+        return run
+
+    async def _on_task_done(self, task: PipelineTask):
+        if self.on_progress:
+            await self.on_progress(self)
+
+    @property
+    def elapsed(self) -> float:
+        """Время выполнения пайплайна (секунды)"""
+        end = self.finished_at or time.perf_counter()
+        return end - self.started_at if self.started_at else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """Прогресс по типам задач"""
+        return {
+            "modules_done": self.graph.count("module", "done"),
+            "modules_total": self.graph.count("module"),
+            "lessons_done": self.graph.count("lesson", "done"),
+            "lessons_total": self.graph.count("lesson"),
+            "topics_done": self.graph.count("topic", "done"),
+            "topics_total": self.graph.count("topic"),
+            "failed": sum(1 for task in self.graph.tasks.values() if task.status == "failed"),
+            "elapsed_seconds": self.elapsed,
+        }
+
+    async def run(self) -> Dict[str, Any]:
+        """
+        Выполняет генерацию всего курса
+
+        Raises:
+            RuntimeError: если у пользователя уже идёт генерация курса
+        """
+        user_id = self.session.user_id
+        if user_id in _active_users:
+            raise RuntimeError("Генерация курса уже выполняется")
+
+        _active_users.add(user_id)
+        self.started_at = time.perf_counter()
+        try:
+            logger.info(f"🚀 Генерация курса '{self.course.course_title}': {len(self.graph.tasks)} задач")
+            await self.graph.run()
+        finally:
+            self.finished_at = time.perf_counter()
+            _active_users.discard(user_id)
+
+        stats = self.stats()
+        logger.info(f"✅ Генерация курса завершена за {stats['elapsed_seconds']:.1f} с: {stats}")
+        return stats
@@ -0,0 +1,215 @@
+"""
+Экспорт в отдельных процессах
+
+Рендеринг HTML большого модуля занимает заметное время CPU; в event
+loop он останавливал бы обработку апдейтов всех пользователей. Крупные
+экспорты выполняются в ограниченном пуле процессов: в пул
+передаются имя метода и данные модели в виде dict, процесс пула пишет
+документ методом export_*_stream во временный файл, обратно
+возвращается только время рендеринга. Небольшие экспорты рендерятся
+сразу: для них передача в пул дороже самого рендеринга.
+"""
+import asyncio
+import concurrent.futures
+import contextlib
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, AsyncIterator, BinaryIO, Dict, Optional
+
+from models import Course, CourseArchive, LessonContent, ModuleContent
+from utils.metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# Процессов в пуле экспорта (0 - рендерить в потоке текущего процесса)
+EXPORT_POOL_WORKERS = int(os.getenv('EXPORT_POOL_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+# Сколько экспортов может ждать пул одновременно (остальные ждут в event loop)
+EXPORT_QUEUE_LIMIT = int(os.getenv('EXPORT_QUEUE_LIMIT', str(max(1, EXPORT_POOL_WORKERS) * 4)))
+
+# Время на экспорт вместе с ожиданием очереди (секунды)
+EXPORT_TIMEOUT = float(os.getenv('EXPORT_TIMEOUT', '30'))
+
+# До какого размера документ держится в памяти (байты), дальше - во временном файле
+EXPORT_SPOOL_SIZE = int(os.getenv('EXPORT_SPOOL_SIZE', str(1024 * 1024)))
+
+# Экспорты меньшего размера (в слайдах, см. export_weight) рендерятся сразу
+# в event loop: они занимают доли миллисекунды, передача в пул дольше
+EXPORT_INLINE_MAX_WEIGHT = int(os.getenv('EXPORT_INLINE_MAX_WEIGHT', '100'))
+
+# Модель входных данных по префиксу метода CourseExporter
+EXPORT_MODELS = (
+    ("export_module_content_", ModuleContent),
+    ("export_lesson_content_", LessonContent),
+    ("export_to_", Course),
+    ("export_archive_", CourseArchive),
+)
+
+
+class ExportTimeout(Exception):
+    """Экспорт не уложился в EXPORT_TIMEOUT"""
+
+
+def _model_for(method: str):
+    for prefix, model in EXPORT_MODELS:
+        if method.startswith(prefix):
+            return model
+    raise ValueError(f"Неизвестный метод экспорта: {method}")
+
+
+def export_weight(model) -> int:
+    """
+    Примерный размер экспорта в слайдах
+
+    Тема материалов урока рендерится примерно как 4 слайда, урок в
+    структуре курса - как 2 слайда.
+    """
+    if isinstance(model, ModuleContent):
+        return sum(len(lecture.slides) for lecture in model.lectures)
+    if isinstance(model, LessonContent):
+        return len(model.topics) * 4
+    if isinstance(model, Course):
+        return sum(len(module.lessons) for module in model.modules) * 2
+    if isinstance(model, CourseArchive):
+        # Все документы архива в четырёх форматах
+        lessons = [lesson.detailed_content for module in model.course.modules for lesson in module.lessons
+                   if lesson.detailed_content]
+        documents = [model.course, *model.module_contents.values(), *lessons]
+        return sum(export_weight(document) for document in documents) * 4
+    return 0
+
+
+# Экспортер процесса (создаётся при первом экспорте)
+_exporter = None
+
+
+def _render(method: str, data: Dict[str, Any], path: str) -> float:
+    """Выполняется в процессе пула: собирает модель и пишет документ в файл path"""
+    started = time.perf_counter()
+    model = _model_for(method).parse_obj(data)
+    # r+b: не создавать файл заново, если бот уже удалил его после таймаута
+    with open(path, "r+b") as f:
+        getattr(ExportPool._get_exporter(), f"{method}_stream")(model, f)
+    return time.perf_counter() - started
+
+
+def _remove(path: str):
+    with contextlib.suppress(OSError):
+        os.remove(path)
+
+
+class ExportPool:
+    """
+    Пул процессов для экспорта
+
+    Процессы запускаются методом spawn (без копирования памяти и потоков
+    бота). Пул пересоздаётся, если процесс пула упал.
+    """
+
+    def __init__(self, workers: int = EXPORT_POOL_WORKERS, queue_limit: int = EXPORT_QUEUE_LIMIT,
+                 timeout: float = EXPORT_TIMEOUT, inline_max_weight: int = EXPORT_INLINE_MAX_WEIGHT):
+        self.workers = workers
+        self.timeout = timeout
+        self.inline_max_weight = inline_max_weight
+        self._slots = asyncio.Semaphore(queue_limit)
+        self._executor: Optional[concurrent.futures.ProcessPoolExecutor] = None
+
+    @staticmethod
+    def _get_exporter():
+        global _exporter
+        if _exporter is None:
+            from exporters import CourseExporter
+            _exporter = CourseExporter()
+        return _exporter
+
+    def _get_executor(self) -> concurrent.futures.ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            logger.info(f"🖨️ Пул экспорта: {self.workers} процессов")
+        return self._executor
+
+    @contextlib.asynccontextmanager
+    async def document(self, method: str, model) -> AsyncIterator[BinaryIO]:
+        """
+        Документ экспорта модели методом CourseExporter, не блокируя event loop
+
+        Возвращает бинарный файл (UTF-8, позиция в начале); при выходе
+        из контекста файл закрывается и удаляется.
+
+        Raises:
+            ExportTimeout: Экспорт не выполнен за timeout секунд
+        """
+        metrics = get_metrics()
+        if export_weight(model) <= self.inline_max_weight:
+            with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE) as document:
+                with metrics.export_seconds.time(method=method, status="inline"):
+                    getattr(self._get_exporter(), f"{method}_stream")(model, document)
+                document.seek(0)
+                yield document
+            return
+
+        fd, path = tempfile.mkstemp(prefix="export-")
+        os.close(fd)
+        try:
+            with metrics.export_seconds.time(method=method, status="error") as labels:
+                try:
+                    render_seconds = await asyncio.wait_for(self._submit(method, model, path), self.timeout)
+                except asyncio.TimeoutError:
+                    labels["status"] = "timeout"
+                    logger.error(f"❌ Экспорт {method} не выполнен за {self.timeout:.0f} с")
+                    raise ExportTimeout(method)
+                labels["status"] = "ok"
+
+            metrics.export_render_seconds.observe(render_seconds, method=method)
+            with open(path, "rb") as document:
+                yield document
+        finally:
+            _remove(path)
+
+    async def _submit(self, method: str, model, path: str) -> float:
+        async with self._slots:
+            if self.workers <= 0:
+                return await asyncio.to_thread(_render, method, model.dict(), path)
+
+            data = model.dict()
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(self._get_executor(), _render, method, data, path)
+            except BrokenProcessPool:
+                logger.error("❌ Процесс пула экспорта упал, пул пересоздаётся")
+                self._discard_executor()
+                return await loop.run_in_executor(self._get_executor(), _render, method, data, path)
+
+    def _discard_executor(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def shutdown(self):
+        """Останавливает процессы пула (при остановке бота)"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+# Глобальный пул экспорта
+_export_pool: Optional[ExportPool] = None
+
+
+def get_export_pool() -> ExportPool:
+    """Получает глобальный пул экспорта"""
+    global _export_pool
+    if _export_pool is None:
+        _export_pool = ExportPool()
+    return _export_pool
+
+
+def export_document(method: str, model):
+    """Документ экспорта модели (async context manager, см. ExportPool.document)"""
+    return get_export_pool().document(method, model)
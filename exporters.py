@@ -1,666 +1,386 @@
 """
 Модуль для экспорта курсов и контента модулей в различные форматы
+
+HTML рендерится шаблонами Jinja2 из каталога templates/ (общий каркас,
+CSS-партиалы, автоэкранирование текста модели). Шаблоны компилируются
+один раз на процесс.
+
+У каждого метода export_* есть вариант export_*_stream(obj, sink): он
+пишет документ частями в UTF-8 в бинарный файл (временный файл, поток
+загрузки), не собирая строку целиком.
 """
+import io
 import json
-from typing import Optional
-from models import Course, ModuleContent, Lecture, Slide
+import os
+import re
+import time
+import zipfile
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, Optional
+from jinja2 import Environment, FileSystemLoader, Template, select_autoescape
+from models import Course, CourseArchive, ModuleContent, Lecture, Slide
 from datetime import datetime
+from utils.metrics import timed_render
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+# Шаблоны HTML-экспорта (partials/ подключаются из них)
+HTML_TEMPLATES = ("course.html", "module_content.html", "lesson_content.html")
+
+# Стили страниц: встраиваются в HTML или лежат в архиве отдельными файлами
+STYLESHEETS = ("css/course.css", "css/module_content.css", "css/lesson_content.css")
+
+# Уровень сжатия документов в ZIP-архиве (1-9)
+EXPORT_ZIP_COMPRESSLEVEL = int(os.getenv('EXPORT_ZIP_COMPRESSLEVEL', '6'))
+
+# Записи архива меньше этого размера (байты) хранятся без сжатия
+ZIP_STORE_MAX_SIZE = 1024
+
+# Форматы документов в архиве: суффикс метода экспорта и расширение файла
+ARCHIVE_FORMATS = (("json", "json"), ("html", "html"), ("markdown", "md"), ("txt", "txt"))
+
+# Скомпилированные шаблоны процесса
+_templates: Optional[Dict[str, Template]] = None
+
+
+def get_export_templates() -> Dict[str, Template]:
+    """
+    Компилирует шаблоны экспорта при первом вызове
+
+    Без auto_reload шаблоны не перечитываются с диска и не проверяются
+    на изменения при каждом рендеринге.
+    """
+    global _templates
+    if _templates is None:
+        env = Environment(
+            loader=FileSystemLoader(TEMPLATES_DIR),
+            autoescape=select_autoescape(["html"]),
+            auto_reload=False,
+            trim_blocks=True,
+            keep_trailing_newline=True,
+            lstrip_blocks=True,
+        )
+        _templates = {name: env.get_template(name) for name in HTML_TEMPLATES + STYLESHEETS}
+    return _templates
+
+
+def write_chunks(chunks: Iterable[str], sink: BinaryIO):
+    """
+    Пишет части документа в бинарный sink в UTF-8
+
+    Части копятся в буфере TextIOWrapper и кодируются пачками, целиком
+    документ в памяти не собирается.
+    """
+    writer = io.TextIOWrapper(sink, encoding="utf-8", newline="")
+    try:
+        for chunk in chunks:
+            writer.write(chunk)
+        writer.flush()
+    finally:
+        # sink остаётся открытым для вызывающего кода
+        writer.detach()
+
+
+def archive_name(title: str, limit: int = 60) -> str:
+    """Имя файла или каталога архива из названия (без разделителей путей)"""
+    name = re.sub(r'[\\/:*?"<>|\s]+', "_", title).strip("._")[:limit]
+    return name or "untitled"
+
+
+class ZipArchive:
+    """
+    ZIP-архив, который пишется в sink по одной записи
+
+    Документы сжимаются и пишутся в запись частями, не собираясь в
+    памяти целиком. Небольшие записи хранятся без сжатия. Общие файлы
+    (стили страниц) записываются один раз на архив.
+    """
+
+    def __init__(self, sink: BinaryIO, compresslevel: int = EXPORT_ZIP_COMPRESSLEVEL):
+        self._zip = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel)
+        self._assets: set = set()
+        self.entries = 0
+
+    def _info(self, name: str, compress: bool) -> zipfile.ZipInfo:
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        return info
+
+    def write_stream(self, name: str, chunks: Iterable[str]):
+        """Документ из частей (сжимается)"""
+        with self._zip.open(self._info(name, compress=True), "w") as entry:
+            write_chunks(chunks, entry)
+        self.entries += 1
+
+    def write_text(self, name: str, text: str):
+        """Небольшой текстовый файл; без сжатия, если он меньше ZIP_STORE_MAX_SIZE"""
+        data = text.encode("utf-8")
+        self._zip.writestr(self._info(name, compress=len(data) >= ZIP_STORE_MAX_SIZE), data)
+        self.entries += 1
+
+    def asset(self, name: str, render: Callable[[], str]) -> str:
+        """Общий файл: рендерится и записывается при первом обращении"""
+        if name not in self._assets:
+            self.write_text(name, render())
+            self._assets.add(name)
+        return name
+
+    def close(self):
+        self._zip.close()
+
+
+def json_chunks(data: Any) -> Iterator[str]:
+    """JSON-документ по частям (как json.dumps с ensure_ascii=False, indent=2)"""
+    return json.JSONEncoder(ensure_ascii=False, indent=2).iterencode(data)
 
 
 class CourseExporter:
     """Класс для экспорта курсов в различные форматы"""
     
+    def __init__(self):
+        self._templates = get_export_templates()
+    
+    @timed_render
     def export_to_json(self, course: Course) -> str:
         """Экспорт в JSON формат"""
         course_dict = course.dict()
         return json.dumps(course_dict, ensure_ascii=False, indent=2)
     
+    @timed_render
+    def export_to_json_stream(self, course: Course, sink: BinaryIO):
+        """Экспорт в JSON формат частями в sink"""
+        write_chunks(json_chunks(course.dict()), sink)
+    
+    @timed_render
     def export_to_markdown(self, course: Course) -> str:
         """Экспорт в Markdown формат"""
-        md = f"# {course.course_title}\n\n"
-        md += f"**Целевая аудитория:** {course.target_audience}\n\n"
+        return "".join(self._course_markdown(course))
+    
+    @timed_render
+    def export_to_markdown_stream(self, course: Course, sink: BinaryIO):
+        """Экспорт в Markdown формат частями в sink"""
+        write_chunks(self._course_markdown(course), sink)
+    
+    def _course_markdown(self, course: Course) -> Iterator[str]:
+        yield f"# {course.course_title}\n\n"
+        yield f"**Целевая аудитория:** {course.target_audience}\n\n"
         
         if course.duration_weeks:
-            md += f"**Длительность:** {course.duration_weeks} недель"
+            yield f"**Длительность:** {course.duration_weeks} недель"
             if course.duration_hours:
-                md += f" ({course.duration_hours} часов)\n\n"
+                yield f" ({course.duration_hours} часов)\n\n"
             else:
-                md += "\n\n"
+                yield "\n\n"
         
-        md += "---\n\n"
-        md += "## 📚 Структура курса\n\n"
+        yield "---\n\n"
+        yield "## 📚 Структура курса\n\n"
         
         for i, module in enumerate(course.modules, 1):
-            md += f"### Модуль {i}: {module.module_title}\n\n"
-            md += f"**Цель модуля:** {module.module_goal}\n\n"
-            md += f"**Уроки:**\n\n"
+            yield f"### Модуль {i}: {module.module_title}\n\n"
+            yield f"**Цель модуля:** {module.module_goal}\n\n"
+            yield f"**Уроки:**\n\n"
             
             for j, lesson in enumerate(module.lessons, 1):
-                md += f"#### {i}.{j} {lesson.lesson_title}\n\n"
-                md += f"- **Цель:** {lesson.lesson_goal}\n"
-                md += f"- **Формат:** {lesson.format}\n"
-                md += f"- **Время:** {lesson.estimated_time_minutes} минут\n"
-                md += f"- **Оценка:** {lesson.assessment}\n\n"
+                yield f"#### {i}.{j} {lesson.lesson_title}\n\n"
+                yield f"- **Цель:** {lesson.lesson_goal}\n"
+                yield f"- **Формат:** {lesson.format}\n"
+                yield f"- **Время:** {lesson.estimated_time_minutes} минут\n"
+                yield f"- **Оценка:** {lesson.assessment}\n\n"
                 
                 if lesson.content_outline:
-                    md += "**План содержания:**\n"
+                    yield "**План содержания:**\n"
                     for topic in lesson.content_outline:
-                        md += f"- {topic}\n"
-                    md += "\n"
+                        yield f"- {topic}\n"
+                    yield "\n"
             
-            md += "---\n\n"
+            yield "---\n\n"
         
-        md += f"\n*Документ сгенерирован: {datetime.now().strftime('%Y-%m-%d %H:%M')}*\n"
-        return md
+        yield f"\n*Документ сгенерирован: {datetime.now().strftime('%Y-%m-%d %H:%M')}*\n"
     
+    @timed_render
     def export_to_html(self, course: Course) -> str:
         """Экспорт в HTML формат с красивым оформлением"""
-        html = f"""<!DOCTYPE html>
-<html lang="ru">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{course.course_title}</title>
-    <style>
-        * {{
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }}
-        
-        body {{
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Oxygen, Ubuntu, Cantarell, sans-serif;
-            line-height: 1.6;
-            color: #333;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            padding: 20px;
-        }}
-        
-        .container {{
-            max-width: 1000px;
-            margin: 0 auto;
-            background: white;
-            border-radius: 20px;
-            box-shadow: 0 20px 60px rgba(0,0,0,0.3);
-            overflow: hidden;
-        }}
-        
-        .header {{
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            padding: 40px;
-            text-align: center;
-        }}
-        
-        .header h1 {{
-            font-size: 2.5em;
-            margin-bottom: 10px;
-            text-shadow: 2px 2px 4px rgba(0,0,0,0.2);
-        }}
-        
-        .header .meta {{
-            font-size: 1.1em;
-            opacity: 0.9;
-        }}
-        
-        .content {{
-            padding: 40px;
-        }}
-        
-        .module {{
-            margin-bottom: 40px;
-            border-left: 4px solid #667eea;
-            padding-left: 20px;
-        }}
-        
-        .module-header {{
-            background: #f8f9fa;
-            padding: 20px;
-            margin-left: -20px;
-            margin-bottom: 20px;
-            border-radius: 10px;
-        }}
-        
-        .module-title {{
-            color: #667eea;
-            font-size: 1.8em;
-            margin-bottom: 10px;
-        }}
-        
-        .module-goal {{
-            color: #666;
-            font-style: italic;
-            font-size: 1.1em;
-        }}
-        
-        .lesson {{
-            background: #f8f9fa;
-            padding: 20px;
-            margin-bottom: 15px;
-            border-radius: 10px;
-            border-left: 3px solid #764ba2;
-        }}
-        
-        .lesson-title {{
-            color: #764ba2;
-            font-size: 1.3em;
-            margin-bottom: 10px;
-            font-weight: 600;
-        }}
-        
-        .lesson-meta {{
-            display: flex;
-            gap: 20px;
-            margin: 10px 0;
-            flex-wrap: wrap;
-        }}
-        
-        .meta-item {{
-            background: white;
-            padding: 5px 15px;
-            border-radius: 20px;
-            font-size: 0.9em;
-            color: #666;
-        }}
-        
-        .meta-item strong {{
-            color: #333;
-        }}
-        
-        .content-outline {{
-            margin-top: 15px;
-        }}
-        
-        .content-outline h4 {{
-            color: #555;
-            margin-bottom: 10px;
-        }}
-        
-        .content-outline ul {{
-            list-style-position: inside;
-            color: #666;
-        }}
-        
-        .content-outline li {{
-            padding: 5px 0;
-        }}
-        
-        .footer {{
-            background: #f8f9fa;
-            padding: 20px;
-            text-align: center;
-            color: #666;
-            font-size: 0.9em;
-        }}
-        
-        .badge {{
-            display: inline-block;
-            background: #667eea;
-            color: white;
-            padding: 5px 15px;
-            border-radius: 20px;
-            font-size: 0.9em;
-            margin: 5px;
-        }}
-        
-        @media print {{
-            body {{
-                background: white;
-                padding: 0;
-            }}
-            
-            .container {{
-                box-shadow: none;
-            }}
-        }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="header">
-            <h1>🎓 {course.course_title}</h1>
-            <div class="meta">
-                <p>👥 {course.target_audience}</p>
-"""
-        
-        if course.duration_weeks:
-            html += f"                <p>⏱️ {course.duration_weeks} недель"
-            if course.duration_hours:
-                html += f" • {course.duration_hours} часов"
-            html += "</p>\n"
-        
-        html += f"""                <p>📚 {len(course.modules)} модулей</p>
-            </div>
-        </div>
-        
-        <div class="content">
-"""
-        
-        # Добавляем модули
-        for i, module in enumerate(course.modules, 1):
-            html += f"""            <div class="module">
-                <div class="module-header">
-                    <div class="module-title">Модуль {i}: {module.module_title}</div>
-                    <div class="module-goal">🎯 {module.module_goal}</div>
-                </div>
-                
-"""
-            
-            # Добавляем уроки
-            for j, lesson in enumerate(module.lessons, 1):
-                html += f"""                <div class="lesson">
-                    <div class="lesson-title">{i}.{j} {lesson.lesson_title}</div>
-                    <p><strong>Цель:</strong> {lesson.lesson_goal}</p>
-                    
-                    <div class="lesson-meta">
-                        <span class="meta-item"><strong>Формат:</strong> {lesson.format}</span>
-                        <span class="meta-item"><strong>Время:</strong> {lesson.estimated_time_minutes} мин</span>
-                        <span class="meta-item"><strong>Оценка:</strong> {lesson.assessment}</span>
-                    </div>
-"""
-                
-                if lesson.content_outline:
-                    html += """                    
-                    <div class="content-outline">
-                        <h4>📋 План содержания:</h4>
-                        <ul>
-"""
-                    for topic in lesson.content_outline:
-                        html += f"                            <li>{topic}</li>\n"
-                    
-                    html += """                        </ul>
-                    </div>
-"""
-                
-                html += "                </div>\n\n"
-            
-            html += "            </div>\n\n"
-        
-        html += f"""        </div>
-        
-        <div class="footer">
-            <p>📄 Документ создан: {datetime.now().strftime('%d.%m.%Y в %H:%M')}</p>
-            <p>🤖 Сгенерировано AI Course Builder</p>
-        </div>
-    </div>
-</body>
-</html>"""
-        
-        return html
+        return self._templates["course.html"].render(course=course, created_at=datetime.now())
+    
+    @timed_render
+    def export_to_html_stream(self, course: Course, sink: BinaryIO):
+        """Экспорт в HTML формат частями в sink"""
+        write_chunks(self._templates["course.html"].generate(course=course, created_at=datetime.now()), sink)
     
+    @timed_render
     def export_to_txt(self, course: Course) -> str:
         """Экспорт в простой TXT формат"""
-        txt = f"{'='*80}\n"
-        txt += f"{course.course_title.upper().center(80)}\n"
-        txt += f"{'='*80}\n\n"
+        return "".join(self._course_txt(course))
+    
+    @timed_render
+    def export_to_txt_stream(self, course: Course, sink: BinaryIO):
+        """Экспорт в простой TXT формат частями в sink"""
+        write_chunks(self._course_txt(course), sink)
+    
+    def _course_txt(self, course: Course) -> Iterator[str]:
+        yield f"{'='*80}\n"
+        yield f"{course.course_title.upper().center(80)}\n"
+        yield f"{'='*80}\n\n"
         
-        txt += f"Целевая аудитория: {course.target_audience}\n"
+        yield f"Целевая аудитория: {course.target_audience}\n"
         if course.duration_weeks:
-            txt += f"Длительность: {course.duration_weeks} недель"
+            yield f"Длительность: {course.duration_weeks} недель"
             if course.duration_hours:
-                txt += f" ({course.duration_hours} часов)"
-            txt += "\n"
+                yield f" ({course.duration_hours} часов)"
+            yield "\n"
         
-        txt += f"Количество модулей: {len(course.modules)}\n\n"
-        txt += f"{'-'*80}\n\n"
+        yield f"Количество модулей: {len(course.modules)}\n\n"
+        yield f"{'-'*80}\n\n"
         
         for i, module in enumerate(course.modules, 1):
-            txt += f"МОДУЛЬ {i}: {module.module_title.upper()}\n"
-            txt += f"{'-'*80}\n"
-            txt += f"Цель: {module.module_goal}\n\n"
+            yield f"МОДУЛЬ {i}: {module.module_title.upper()}\n"
+            yield f"{'-'*80}\n"
+            yield f"Цель: {module.module_goal}\n\n"
             
             for j, lesson in enumerate(module.lessons, 1):
-                txt += f"  {i}.{j} {lesson.lesson_title}\n"
-                txt += f"      Цель: {lesson.lesson_goal}\n"
-                txt += f"      Формат: {lesson.format} | Время: {lesson.estimated_time_minutes} мин | Оценка: {lesson.assessment}\n"
+                yield f"  {i}.{j} {lesson.lesson_title}\n"
+                yield f"      Цель: {lesson.lesson_goal}\n"
+                yield f"      Формат: {lesson.format} | Время: {lesson.estimated_time_minutes} мин | Оценка: {lesson.assessment}\n"
                 
                 if lesson.content_outline:
-                    txt += f"      План содержания:\n"
+                    yield f"      План содержания:\n"
                     for topic in lesson.content_outline:
-                        txt += f"        • {topic}\n"
-                txt += "\n"
+                        yield f"        • {topic}\n"
+                yield "\n"
             
-            txt += f"{'-'*80}\n\n"
-        
-        txt += f"\nДокумент создан: {datetime.now().strftime('%d.%m.%Y %H:%M')}\n"
-        txt += f"Сгенерировано: AI Course Builder\n"
-        txt += f"{'='*80}\n"
+            yield f"{'-'*80}\n\n"
         
-        return txt
+        yield f"\nДокумент создан: {datetime.now().strftime('%d.%m.%Y %H:%M')}\n"
+        yield f"Сгенерировано: AI Course Builder\n"
+        yield f"{'='*80}\n"
     
     # ========== ЭКСПОРТ КОНТЕНТА МОДУЛЕЙ ==========
     
+    @timed_render
     def export_module_content_to_json(self, content: ModuleContent) -> str:
         """Экспорт контента модуля в JSON"""
         content_dict = content.dict()
         return json.dumps(content_dict, ensure_ascii=False, indent=2)
     
+    @timed_render
+    def export_module_content_to_json_stream(self, content: ModuleContent, sink: BinaryIO):
+        """Экспорт контента модуля в JSON частями в sink"""
+        write_chunks(json_chunks(content.dict()), sink)
+    
+    @timed_render
     def export_module_content_to_html(self, content: ModuleContent) -> str:
         """Экспорт контента модуля в HTML (презентация)"""
-        html = f"""<!DOCTYPE html>
-<html lang="ru">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{content.module_title} - Лекции</title>
-    <style>
-        * {{
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }}
-        
-        body {{
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-            background: #1a1a2e;
-            color: #eee;
-        }}
-        
-        .presentation {{
-            max-width: 1200px;
-            margin: 0 auto;
-        }}
-        
-        .lecture {{
-            margin-bottom: 60px;
-        }}
-        
-        .lecture-header {{
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            padding: 40px;
-            border-radius: 20px;
-            margin-bottom: 30px;
-            text-align: center;
-        }}
-        
-        .lecture-title {{
-            font-size: 2.5em;
-            margin-bottom: 15px;
-        }}
-        
-        .lecture-meta {{
-            font-size: 1.1em;
-            opacity: 0.9;
-        }}
-        
-        .objectives {{
-            background: #16213e;
-            padding: 30px;
-            border-radius: 15px;
-            margin-bottom: 30px;
-            border-left: 5px solid #667eea;
-        }}
-        
-        .objectives h3 {{
-            color: #667eea;
-            margin-bottom: 15px;
-        }}
-        
-        .objectives ul {{
-            list-style-position: inside;
-            line-height: 1.8;
-        }}
-        
-        .slide {{
-            background: white;
-            color: #333;
-            padding: 50px;
-            margin-bottom: 30px;
-            border-radius: 20px;
-            box-shadow: 0 10px 40px rgba(0,0,0,0.3);
-            min-height: 500px;
-            position: relative;
-        }}
-        
-        .slide-number {{
-            position: absolute;
-            top: 20px;
-            right: 30px;
-            background: #667eea;
-            color: white;
-            padding: 10px 20px;
-            border-radius: 25px;
-            font-size: 0.9em;
-        }}
-        
-        .slide-title {{
-            font-size: 2.2em;
-            color: #764ba2;
-            margin-bottom: 30px;
-            padding-bottom: 20px;
-            border-bottom: 3px solid #667eea;
-        }}
-        
-        .slide.title-slide {{
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            text-align: center;
-        }}
-        
-        .slide.title-slide .slide-title {{
-            color: white;
-            border: none;
-            font-size: 3em;
-        }}
-        
-        .slide-content {{
-            font-size: 1.3em;
-            line-height: 1.8;
-            white-space: pre-line;
-        }}
-        
-        .code-example {{
-            background: #1a1a2e;
-            color: #eee;
-            padding: 25px;
-            border-radius: 10px;
-            margin: 20px 0;
-            font-family: 'Courier New', monospace;
-            overflow-x: auto;
-            white-space: pre;
-            border-left: 4px solid #667eea;
-        }}
-        
-        .notes {{
-            background: #fff3cd;
-            color: #856404;
-            padding: 20px;
-            border-radius: 10px;
-            margin-top: 30px;
-            border-left: 4px solid #ffc107;
-        }}
-        
-        .notes h4 {{
-            margin-bottom: 10px;
-            color: #856404;
-        }}
-        
-        .takeaways {{
-            background: #d4edda;
-            color: #155724;
-            padding: 30px;
-            border-radius: 15px;
-            margin-top: 30px;
-            border-left: 5px solid #28a745;
-        }}
-        
-        .takeaways h3 {{
-            color: #28a745;
-            margin-bottom: 15px;
-        }}
-        
-        @media print {{
-            .slide {{
-                page-break-after: always;
-            }}
-        }}
-    </style>
-</head>
-<body>
-    <div class="presentation">
-        <div class="lecture-header">
-            <div class="lecture-title">Модуль {content.module_number}</div>
-            <h1>{content.module_title}</h1>
-            <div class="lecture-meta">
-                {len(content.lectures)} лекций • {content.total_slides} слайдов • {content.estimated_duration_minutes} минут
-            </div>
-        </div>
-"""
-        
-        for lecture in content.lectures:
-            html += f"""
-        <div class="lecture">
-            <div class="objectives">
-                <h3>🎯 Цели обучения</h3>
-                <ul>
-"""
-            for obj in lecture.learning_objectives:
-                html += f"                    <li>{obj}</li>\n"
-            
-            html += """                </ul>
-            </div>
-"""
-            
-            # Добавляем слайды
-            for slide in lecture.slides:
-                slide_class = "title-slide" if slide.slide_type == "title" else ""
-                html += f"""
-            <div class="slide {slide_class}">
-                <div class="slide-number">Слайд {slide.slide_number}</div>
-                <h2 class="slide-title">{slide.title}</h2>
-                <div class="slide-content">{slide.content}</div>
-"""
-                
-                if slide.code_example:
-                    html += f"""
-                <div class="code-example">{slide.code_example}</div>
-"""
-                
-                if slide.notes:
-                    html += f"""
-                <div class="notes">
-                    <h4>📝 Заметки для преподавателя:</h4>
-                    <p>{slide.notes}</p>
-                </div>
-"""
-                
-                html += "            </div>\n"
-            
-            # Ключевые выводы лекции
-            html += """
-            <div class="takeaways">
-                <h3>✨ Ключевые выводы</h3>
-                <ul>
-"""
-            for takeaway in lecture.key_takeaways:
-                html += f"                    <li>{takeaway}</li>\n"
-            
-            html += """                </ul>
-            </div>
-        </div>
-"""
-        
-        html += f"""
-    </div>
-    <div style="text-align: center; padding: 40px; color: #888;">
-        <p>📄 Создано: {datetime.now().strftime('%d.%m.%Y %H:%M')}</p>
-        <p>🤖 AI Course Builder</p>
-    </div>
-</body>
-</html>"""
-        
-        return html
+        return self._templates["module_content.html"].render(content=content, created_at=datetime.now())
     
+    @timed_render
+    def export_module_content_to_html_stream(self, content: ModuleContent, sink: BinaryIO):
+        """Экспорт контента модуля в HTML частями в sink"""
+        write_chunks(
+            self._templates["module_content.html"].generate(content=content, created_at=datetime.now()), sink
+        )
+    
+    @timed_render
     def export_module_content_to_markdown(self, content: ModuleContent) -> str:
         """Экспорт контента модуля в Markdown"""
-        md = f"# Модуль {content.module_number}: {content.module_title}\n\n"
-        md += f"**Лекций:** {len(content.lectures)} • **Слайдов:** {content.total_slides} • **Время:** {content.estimated_duration_minutes} минут\n\n"
-        md += "---\n\n"
+        return "".join(self._module_content_markdown(content))
+    
+    @timed_render
+    def export_module_content_to_markdown_stream(self, content: ModuleContent, sink: BinaryIO):
+        """Экспорт контента модуля в Markdown частями в sink"""
+        write_chunks(self._module_content_markdown(content), sink)
+    
+    def _module_content_markdown(self, content: ModuleContent) -> Iterator[str]:
+        yield f"# Модуль {content.module_number}: {content.module_title}\n\n"
+        yield f"**Лекций:** {len(content.lectures)} • **Слайдов:** {content.total_slides} • **Время:** {content.estimated_duration_minutes} минут\n\n"
+        yield "---\n\n"
         
         for lecture in content.lectures:
-            md += f"## 📚 {lecture.lecture_title}\n\n"
-            md += f"**Длительность:** {lecture.duration_minutes} минут\n\n"
+            yield f"## 📚 {lecture.lecture_title}\n\n"
+            yield f"**Длительность:** {lecture.duration_minutes} минут\n\n"
             
-            md += "### 🎯 Цели обучения\n\n"
+            yield "### 🎯 Цели обучения\n\n"
             for obj in lecture.learning_objectives:
-                md += f"- {obj}\n"
-            md += "\n"
+                yield f"- {obj}\n"
+            yield "\n"
             
-            md += "### 📊 Слайды\n\n"
+            yield "### 📊 Слайды\n\n"
             
             for slide in lecture.slides:
-                md += f"#### Слайд {slide.slide_number}: {slide.title}\n\n"
-                md += f"**Тип:** {slide.slide_type}\n\n"
-                md += f"{slide.content}\n\n"
+                yield f"#### Слайд {slide.slide_number}: {slide.title}\n\n"
+                yield f"**Тип:** {slide.slide_type}\n\n"
+                yield f"{slide.content}\n\n"
                 
                 if slide.code_example:
-                    md += "```python\n"
-                    md += f"{slide.code_example}\n"
-                    md += "```\n\n"
+                    yield "```python\n"
+                    yield f"{slide.code_example}\n"
+                    yield "```\n\n"
                 
                 if slide.notes:
-                    md += f"> 📝 **Заметки:** {slide.notes}\n\n"
+                    yield f"> 📝 **Заметки:** {slide.notes}\n\n"
             
-            md += "### ✨ Ключевые выводы\n\n"
+            yield "### ✨ Ключевые выводы\n\n"
             for takeaway in lecture.key_takeaways:
-                md += f"- {takeaway}\n"
-            md += "\n---\n\n"
+                yield f"- {takeaway}\n"
+            yield "\n---\n\n"
         
-        md += f"\n*Документ создан: {datetime.now().strftime('%Y-%m-%d %H:%M')}*\n"
-        return md
+        yield f"\n*Документ создан: {datetime.now().strftime('%Y-%m-%d %H:%M')}*\n"
     
+    @timed_render
     def export_module_content_to_txt(self, content: ModuleContent) -> str:
         """Экспорт контента модуля в TXT"""
-        txt = f"{'='*80}\n"
-        txt += f"МОДУЛЬ {content.module_number}: {content.module_title.upper()}\n"
-        txt += f"{'='*80}\n\n"
-        txt += f"Лекций: {len(content.lectures)} | Слайдов: {content.total_slides} | Время: {content.estimated_duration_minutes} мин\n\n"
+        return "".join(self._module_content_txt(content))
+    
+    @timed_render
+    def export_module_content_to_txt_stream(self, content: ModuleContent, sink: BinaryIO):
+        """Экспорт контента модуля в TXT частями в sink"""
+        write_chunks(self._module_content_txt(content), sink)
+    
+    def _module_content_txt(self, content: ModuleContent) -> Iterator[str]:
+        yield f"{'='*80}\n"
+        yield f"МОДУЛЬ {content.module_number}: {content.module_title.upper()}\n"
+        yield f"{'='*80}\n\n"
+        yield f"Лекций: {len(content.lectures)} | Слайдов: {content.total_slides} | Время: {content.estimated_duration_minutes} мин\n\n"
         
         for lecture in content.lectures:
-            txt += f"{'-'*80}\n"
-            txt += f"ЛЕКЦИЯ: {lecture.lecture_title}\n"
-            txt += f"{'-'*80}\n"
-            txt += f"Длительность: {lecture.duration_minutes} минут\n\n"
+            yield f"{'-'*80}\n"
+            yield f"ЛЕКЦИЯ: {lecture.lecture_title}\n"
+            yield f"{'-'*80}\n"
+            yield f"Длительность: {lecture.duration_minutes} минут\n\n"
             
-            txt += "ЦЕЛИ ОБУЧЕНИЯ:\n"
+            yield "ЦЕЛИ ОБУЧЕНИЯ:\n"
             for obj in lecture.learning_objectives:
-                txt += f"  • {obj}\n"
-            txt += "\n"
+                yield f"  • {obj}\n"
+            yield "\n"
             
             for slide in lecture.slides:
-                txt += f"  [{slide.slide_number}] {slide.title}\n"
-                txt += f"  Тип: {slide.slide_type}\n"
-                txt += f"  {'-'*76}\n"
+                yield f"  [{slide.slide_number}] {slide.title}\n"
+                yield f"  Тип: {slide.slide_type}\n"
+                yield f"  {'-'*76}\n"
                 
                 for line in slide.content.split('\n'):
-                    txt += f"    {line}\n"
+                    yield f"    {line}\n"
                 
                 if slide.code_example:
-                    txt += f"\n    КОД:\n"
+                    yield f"\n    КОД:\n"
                     for line in slide.code_example.split('\n'):
-                        txt += f"    {line}\n"
+                        yield f"    {line}\n"
                 
                 if slide.notes:
-                    txt += f"\n    [Заметки: {slide.notes}]\n"
+                    yield f"\n    [Заметки: {slide.notes}]\n"
                 
-                txt += "\n"
+                yield "\n"
             
-            txt += "КЛЮЧЕВЫЕ ВЫВОДЫ:\n"
+            yield "КЛЮЧЕВЫЕ ВЫВОДЫ:\n"
             for takeaway in lecture.key_takeaways:
-                txt += f"  ✓ {takeaway}\n"
-            txt += "\n\n"
-        
-        txt += f"{'='*80}\n"
-        txt += f"Создано: {datetime.now().strftime('%d.%m.%Y %H:%M')} | AI Course Builder\n"
-        txt += f"{'='*80}\n"
+                yield f"  ✓ {takeaway}\n"
+            yield "\n\n"
         
-        return txt
+        yield f"{'='*80}\n"
+        yield f"Создано: {datetime.now().strftime('%d.%m.%Y %H:%M')} | AI Course Builder\n"
+        yield f"{'='*80}\n"
     
     # ==================== ЭКСПОРТ ДЕТАЛЬНЫХ МАТЕРИАЛОВ УРОКА ====================
     
+    @timed_render
     def export_lesson_content_to_json(self, lesson_content) -> str:
         """Экспорт детальных материалов урока в JSON"""
         from models import LessonContent
@@ -670,471 +390,264 @@ class CourseExporter:
             lesson_dict = lesson_content
         return json.dumps(lesson_dict, ensure_ascii=False, indent=2)
     
+    @timed_render
+    def export_lesson_content_to_json_stream(self, lesson_content, sink: BinaryIO):
+        """Экспорт детальных материалов урока в JSON частями в sink"""
+        from models import LessonContent
+        if isinstance(lesson_content, LessonContent):
+            lesson_content = lesson_content.dict()
+        write_chunks(json_chunks(lesson_content), sink)
+    
+    @timed_render
     def export_lesson_content_to_html(self, lesson_content) -> str:
         """Экспорт детальных материалов урока в HTML"""
-        from models import LessonContent
-        
-        html = f"""<!DOCTYPE html>
-<html lang="ru">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{lesson_content.lesson_title} - Детальные материалы</title>
-    <style>
-        * {{
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }}
-        
-        body {{
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Oxygen, Ubuntu, sans-serif;
-            line-height: 1.6;
-            color: #333;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            padding: 20px;
-        }}
-        
-        .container {{
-            max-width: 1200px;
-            margin: 0 auto;
-            background: white;
-            border-radius: 15px;
-            box-shadow: 0 20px 60px rgba(0,0,0,0.3);
-            overflow: hidden;
-        }}
-        
-        .header {{
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            padding: 40px;
-        }}
-        
-        .header h1 {{
-            font-size: 2.5em;
-            margin-bottom: 10px;
-        }}
-        
-        .header p {{
-            font-size: 1.1em;
-            opacity: 0.9;
-        }}
-        
-        .content {{
-            padding: 40px;
-        }}
-        
-        .topic {{
-            margin-bottom: 60px;
-            border-left: 4px solid #667eea;
-            padding-left: 20px;
-        }}
-        
-        .topic-header {{
-            background: #f8f9fa;
-            padding: 20px;
-            margin-left: -20px;
-            margin-bottom: 20px;
-            border-radius: 8px;
-        }}
-        
-        .topic-title {{
-            font-size: 2em;
-            color: #667eea;
-            margin-bottom: 10px;
-        }}
-        
-        .section {{
-            margin: 30px 0;
-        }}
-        
-        .section-title {{
-            font-size: 1.3em;
-            color: #764ba2;
-            margin-bottom: 15px;
-            border-bottom: 2px solid #eee;
-            padding-bottom: 10px;
-        }}
-        
-        .introduction, .theory {{
-            white-space: pre-wrap;
-            background: #f8f9fa;
-            padding: 20px;
-            border-radius: 8px;
-            margin: 15px 0;
-        }}
-        
-        .example-item, .exercise-item, .question-item {{
-            background: #fff;
-            border: 1px solid #ddd;
-            padding: 15px;
-            margin: 10px 0;
-            border-radius: 8px;
-        }}
-        
-        .code-block {{
-            background: #2d2d2d;
-            color: #f8f8f2;
-            padding: 20px;
-            border-radius: 8px;
-            font-family: 'Courier New', monospace;
-            overflow-x: auto;
-            white-space: pre;
-            margin: 15px 0;
-        }}
-        
-        .key-point {{
-            background: #e7f3ff;
-            padding: 10px 15px;
-            margin: 8px 0;
-            border-left: 4px solid #2196F3;
-            border-radius: 4px;
-        }}
-        
-        .mistake {{
-            background: #fff3cd;
-            padding: 10px 15px;
-            margin: 8px 0;
-            border-left: 4px solid #ff9800;
-            border-radius: 4px;
-        }}
-        
-        .best-practice {{
-            background: #d4edda;
-            padding: 10px 15px;
-            margin: 8px 0;
-            border-left: 4px solid #28a745;
-            border-radius: 4px;
-        }}
-        
-        .resource {{
-            background: #e8f5e9;
-            padding: 10px 15px;
-            margin: 8px 0;
-            border-radius: 4px;
-        }}
-        
-        .time-badge {{
-            display: inline-block;
-            background: #667eea;
-            color: white;
-            padding: 5px 15px;
-            border-radius: 20px;
-            font-size: 0.9em;
-            margin: 10px 0;
-        }}
-        
-        .footer {{
-            background: #f8f9fa;
-            padding: 20px;
-            text-align: center;
-            color: #666;
-            border-top: 1px solid #ddd;
-        }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="header">
-            <h1>📖 {lesson_content.lesson_title}</h1>
-            <p>{lesson_content.lesson_goal}</p>
-            <div style="margin-top: 20px;">
-                <span style="background: rgba(255,255,255,0.2); padding: 8px 16px; border-radius: 20px; margin-right: 10px;">
-                    Модуль {lesson_content.module_number}
-                </span>
-                <span style="background: rgba(255,255,255,0.2); padding: 8px 16px; border-radius: 20px;">
-                    {lesson_content.total_topics} тем
-                </span>
-                <span style="background: rgba(255,255,255,0.2); padding: 8px 16px; border-radius: 20px;">
-                    ~{lesson_content.total_estimated_time_minutes} минут
-                </span>
-            </div>
-        </div>
-        
-        <div class="content">
-"""
-        
-        for idx, topic in enumerate(lesson_content.topics, 1):
-            html += f"""
-            <div class="topic">
-                <div class="topic-header">
-                    <div class="topic-title">Тема {idx}: {topic.topic_title}</div>
-                    <p>{topic.topic_description if hasattr(topic, 'topic_description') else ''}</p>
-                    <span class="time-badge">⏱️ ~{topic.estimated_reading_time_minutes} минут</span>
-                </div>
-                
-                <div class="section">
-                    <div class="section-title">📝 Введение</div>
-                    <div class="introduction">{topic.introduction}</div>
-                </div>
-                
-                <div class="section">
-                    <div class="section-title">📚 Теория</div>
-                    <div class="theory">{topic.theory}</div>
-                </div>
-"""
-            
-            if topic.examples:
-                html += """
-                <div class="section">
-                    <div class="section-title">💡 Примеры</div>
-"""
-                for i, example in enumerate(topic.examples, 1):
-                    html += f'<div class="example-item"><strong>Пример {i}:</strong> {example}</div>\n'
-                html += "</div>\n"
-            
-            if topic.code_snippets:
-                html += """
-                <div class="section">
-                    <div class="section-title">💻 Примеры кода</div>
-"""
-                for i, code in enumerate(topic.code_snippets, 1):
-                    html += f'<div class="code-block">{code}</div>\n'
-                html += "</div>\n"
-            
-            if topic.key_points:
-                html += """
-                <div class="section">
-                    <div class="section-title">🎯 Ключевые моменты</div>
-"""
-                for point in topic.key_points:
-                    html += f'<div class="key-point">✓ {point}</div>\n'
-                html += "</div>\n"
-            
-            if topic.common_mistakes:
-                html += """
-                <div class="section">
-                    <div class="section-title">⚠️ Частые ошибки</div>
-"""
-                for mistake in topic.common_mistakes:
-                    html += f'<div class="mistake">⚠️ {mistake}</div>\n'
-                html += "</div>\n"
-            
-            if topic.best_practices:
-                html += """
-                <div class="section">
-                    <div class="section-title">✨ Лучшие практики</div>
-"""
-                for practice in topic.best_practices:
-                    html += f'<div class="best-practice">✓ {practice}</div>\n'
-                html += "</div>\n"
-            
-            if topic.practice_exercises:
-                html += """
-                <div class="section">
-                    <div class="section-title">🏋️ Упражнения для практики</div>
-"""
-                for i, exercise in enumerate(topic.practice_exercises, 1):
-                    html += f'<div class="exercise-item"><strong>Задание {i}:</strong> {exercise}</div>\n'
-                html += "</div>\n"
-            
-            if topic.quiz_questions:
-                html += """
-                <div class="section">
-                    <div class="section-title">❓ Вопросы для самопроверки</div>
-"""
-                for i, question in enumerate(topic.quiz_questions, 1):
-                    html += f'<div class="question-item">{i}. {question}</div>\n'
-                html += "</div>\n"
-            
-            if hasattr(topic, 'additional_resources') and topic.additional_resources:
-                html += """
-                <div class="section">
-                    <div class="section-title">📚 Дополнительные ресурсы</div>
-"""
-                for resource in topic.additional_resources:
-                    html += f'<div class="resource">🔗 {resource}</div>\n'
-                html += "</div>\n"
-            
-            html += "</div>\n"
-        
-        html += f"""
-        </div>
-        
-        <div class="footer">
-            <p>Создано: {datetime.now().strftime('%d.%m.%Y %H:%M')} | AI Course Builder</p>
-            <p>Урок: {lesson_content.lesson_title} | Модуль {lesson_content.module_number}</p>
-        </div>
-    </div>
-</body>
-</html>
-"""
-        return html
+        return self._templates["lesson_content.html"].render(
+            lesson_content=lesson_content, created_at=datetime.now()
+        )
     
+    @timed_render
+    def export_lesson_content_to_html_stream(self, lesson_content, sink: BinaryIO):
+        """Экспорт детальных материалов урока в HTML частями в sink"""
+        write_chunks(
+            self._templates["lesson_content.html"].generate(lesson_content=lesson_content, created_at=datetime.now()),
+            sink,
+        )
+    
+    @timed_render
     def export_lesson_content_to_markdown(self, lesson_content) -> str:
         """Экспорт детальных материалов урока в Markdown"""
-        from models import LessonContent
-        
-        md = f"# {lesson_content.lesson_title}\n\n"
-        md += f"**Цель урока:** {lesson_content.lesson_goal}\n\n"
-        md += f"**Модуль:** {lesson_content.module_number} | **Урок:** {lesson_content.lesson_number}\n"
-        md += f"**Тем:** {lesson_content.total_topics} | **Время изучения:** ~{lesson_content.total_estimated_time_minutes} минут\n\n"
-        md += "---\n\n"
+        return "".join(self._lesson_content_markdown(lesson_content))
+    
+    @timed_render
+    def export_lesson_content_to_markdown_stream(self, lesson_content, sink: BinaryIO):
+        """Экспорт детальных материалов урока в Markdown частями в sink"""
+        write_chunks(self._lesson_content_markdown(lesson_content), sink)
+    
+    def _lesson_content_markdown(self, lesson_content) -> Iterator[str]:
+        yield f"# {lesson_content.lesson_title}\n\n"
+        yield f"**Цель урока:** {lesson_content.lesson_goal}\n\n"
+        yield f"**Модуль:** {lesson_content.module_number} | **Урок:** {lesson_content.lesson_number}\n"
+        yield f"**Тем:** {lesson_content.total_topics} | **Время изучения:** ~{lesson_content.total_estimated_time_minutes} минут\n\n"
+        yield "---\n\n"
         
         for idx, topic in enumerate(lesson_content.topics, 1):
-            md += f"## Тема {idx}: {topic.topic_title}\n\n"
+            yield f"## Тема {idx}: {topic.topic_title}\n\n"
             
             if hasattr(topic, 'topic_description'):
-                md += f"*{topic.topic_description}*\n\n"
+                yield f"*{topic.topic_description}*\n\n"
             
-            md += f"⏱️ Время изучения: ~{topic.estimated_reading_time_minutes} минут\n\n"
+            yield f"⏱️ Время изучения: ~{topic.estimated_reading_time_minutes} минут\n\n"
             
-            md += f"### 📝 Введение\n\n"
-            md += f"{topic.introduction}\n\n"
+            yield f"### 📝 Введение\n\n"
+            yield f"{topic.introduction}\n\n"
             
-            md += f"### 📚 Теория\n\n"
-            md += f"{topic.theory}\n\n"
+            yield f"### 📚 Теория\n\n"
+            yield f"{topic.theory}\n\n"
             
             if topic.examples:
-                md += f"### 💡 Примеры\n\n"
+                yield f"### 💡 Примеры\n\n"
                 for i, example in enumerate(topic.examples, 1):
-                    md += f"{i}. {example}\n\n"
+                    yield f"{i}. {example}\n\n"
             
             if topic.code_snippets:
-                md += f"### 💻 Примеры кода\n\n"
+                yield f"### 💻 Примеры кода\n\n"
                 for code in topic.code_snippets:
-                    md += f"```python\n{code}\n```\n\n"
+                    yield f"```python\n{code}\n```\n\n"
             
             if topic.key_points:
-                md += f"### 🎯 Ключевые моменты\n\n"
+                yield f"### 🎯 Ключевые моменты\n\n"
                 for point in topic.key_points:
-                    md += f"- ✓ {point}\n"
-                md += "\n"
+                    yield f"- ✓ {point}\n"
+                yield "\n"
             
             if topic.common_mistakes:
-                md += f"### ⚠️ Частые ошибки\n\n"
+                yield f"### ⚠️ Частые ошибки\n\n"
                 for mistake in topic.common_mistakes:
-                    md += f"- ⚠️ {mistake}\n"
-                md += "\n"
+                    yield f"- ⚠️ {mistake}\n"
+                yield "\n"
             
             if topic.best_practices:
-                md += f"### ✨ Лучшие практики\n\n"
+                yield f"### ✨ Лучшие практики\n\n"
                 for practice in topic.best_practices:
-                    md += f"- ✓ {practice}\n"
-                md += "\n"
+                    yield f"- ✓ {practice}\n"
+                yield "\n"
             
             if topic.practice_exercises:
-                md += f"### 🏋️ Упражнения для практики\n\n"
+                yield f"### 🏋️ Упражнения для практики\n\n"
                 for i, exercise in enumerate(topic.practice_exercises, 1):
-                    md += f"{i}. {exercise}\n"
-                md += "\n"
+                    yield f"{i}. {exercise}\n"
+                yield "\n"
             
             if topic.quiz_questions:
-                md += f"### ❓ Вопросы для самопроверки\n\n"
+                yield f"### ❓ Вопросы для самопроверки\n\n"
                 for i, question in enumerate(topic.quiz_questions, 1):
-                    md += f"{i}. {question}\n"
-                md += "\n"
+                    yield f"{i}. {question}\n"
+                yield "\n"
             
             if hasattr(topic, 'additional_resources') and topic.additional_resources:
-                md += f"### 📚 Дополнительные ресурсы\n\n"
+                yield f"### 📚 Дополнительные ресурсы\n\n"
                 for resource in topic.additional_resources:
-                    md += f"- 🔗 {resource}\n"
-                md += "\n"
+                    yield f"- 🔗 {resource}\n"
+                yield "\n"
             
-            md += "---\n\n"
+            yield "---\n\n"
         
-        md += f"\n*Документ сгенерирован: {datetime.now().strftime('%Y-%m-%d %H:%M')} | AI Course Builder*\n"
-        return md
+        yield f"\n*Документ сгенерирован: {datetime.now().strftime('%Y-%m-%d %H:%M')} | AI Course Builder*\n"
     
+    @timed_render
     def export_lesson_content_to_txt(self, lesson_content) -> str:
         """Экспорт детальных материалов урока в TXT"""
-        from models import LessonContent
-        
-        txt = f"{'='*80}\n"
-        txt += f"ДЕТАЛЬНЫЕ УЧЕБНЫЕ МАТЕРИАЛЫ\n"
-        txt += f"{'='*80}\n\n"
+        return "".join(self._lesson_content_txt(lesson_content))
+    
+    @timed_render
+    def export_lesson_content_to_txt_stream(self, lesson_content, sink: BinaryIO):
+        """Экспорт детальных материалов урока в TXT частями в sink"""
+        write_chunks(self._lesson_content_txt(lesson_content), sink)
+    
+    def _lesson_content_txt(self, lesson_content) -> Iterator[str]:
+        yield f"{'='*80}\n"
+        yield f"ДЕТАЛЬНЫЕ УЧЕБНЫЕ МАТЕРИАЛЫ\n"
+        yield f"{'='*80}\n\n"
         
-        txt += f"УРОК: {lesson_content.lesson_title}\n"
-        txt += f"ЦЕЛЬ: {lesson_content.lesson_goal}\n"
-        txt += f"МОДУЛЬ: {lesson_content.module_number} | УРОК: {lesson_content.lesson_number}\n"
-        txt += f"ТЕМ: {lesson_content.total_topics} | ВРЕМЯ: ~{lesson_content.total_estimated_time_minutes} минут\n\n"
-        txt += f"{'-'*80}\n\n"
+        yield f"УРОК: {lesson_content.lesson_title}\n"
+        yield f"ЦЕЛЬ: {lesson_content.lesson_goal}\n"
+        yield f"МОДУЛЬ: {lesson_content.module_number} | УРОК: {lesson_content.lesson_number}\n"
+        yield f"ТЕМ: {lesson_content.total_topics} | ВРЕМЯ: ~{lesson_content.total_estimated_time_minutes} минут\n\n"
+        yield f"{'-'*80}\n\n"
         
         for idx, topic in enumerate(lesson_content.topics, 1):
-            txt += f"\n{'='*80}\n"
-            txt += f"ТЕМА {idx}: {topic.topic_title.upper()}\n"
-            txt += f"{'='*80}\n\n"
+            yield f"\n{'='*80}\n"
+            yield f"ТЕМА {idx}: {topic.topic_title.upper()}\n"
+            yield f"{'='*80}\n\n"
             
             if hasattr(topic, 'topic_description'):
-                txt += f"{topic.topic_description}\n\n"
+                yield f"{topic.topic_description}\n\n"
             
-            txt += f"Время изучения: ~{topic.estimated_reading_time_minutes} минут\n\n"
+            yield f"Время изучения: ~{topic.estimated_reading_time_minutes} минут\n\n"
             
-            txt += f"{'-'*80}\n"
-            txt += f"ВВЕДЕНИЕ\n"
-            txt += f"{'-'*80}\n\n"
-            txt += f"{topic.introduction}\n\n"
+            yield f"{'-'*80}\n"
+            yield f"ВВЕДЕНИЕ\n"
+            yield f"{'-'*80}\n\n"
+            yield f"{topic.introduction}\n\n"
             
-            txt += f"{'-'*80}\n"
-            txt += f"ТЕОРИЯ\n"
-            txt += f"{'-'*80}\n\n"
-            txt += f"{topic.theory}\n\n"
+            yield f"{'-'*80}\n"
+            yield f"ТЕОРИЯ\n"
+            yield f"{'-'*80}\n\n"
+            yield f"{topic.theory}\n\n"
             
             if topic.examples:
-                txt += f"{'-'*80}\n"
-                txt += f"ПРИМЕРЫ\n"
-                txt += f"{'-'*80}\n\n"
+                yield f"{'-'*80}\n"
+                yield f"ПРИМЕРЫ\n"
+                yield f"{'-'*80}\n\n"
                 for i, example in enumerate(topic.examples, 1):
-                    txt += f"{i}. {example}\n\n"
+                    yield f"{i}. {example}\n\n"
             
             if topic.code_snippets:
-                txt += f"{'-'*80}\n"
-                txt += f"ПРИМЕРЫ КОДА\n"
-                txt += f"{'-'*80}\n\n"
+                yield f"{'-'*80}\n"
+                yield f"ПРИМЕРЫ КОДА\n"
+                yield f"{'-'*80}\n\n"
                 for i, code in enumerate(topic.code_snippets, 1):
-                    txt += f"Пример {i}:\n{code}\n\n"
+                    yield f"Пример {i}:\n{code}\n\n"
             
             if topic.key_points:
-                txt += f"{'-'*80}\n"
-                txt += f"КЛЮЧЕВЫЕ МОМЕНТЫ\n"
-                txt += f"{'-'*80}\n\n"
+                yield f"{'-'*80}\n"
+                yield f"КЛЮЧЕВЫЕ МОМЕНТЫ\n"
+                yield f"{'-'*80}\n\n"
                 for point in topic.key_points:
-                    txt += f"  ✓ {point}\n"
-                txt += "\n"
+                    yield f"  ✓ {point}\n"
+                yield "\n"
             
             if topic.common_mistakes:
-                txt += f"{'-'*80}\n"
-                txt += f"ЧАСТЫЕ ОШИБКИ\n"
-                txt += f"{'-'*80}\n\n"
+                yield f"{'-'*80}\n"
+                yield f"ЧАСТЫЕ ОШИБКИ\n"
+                yield f"{'-'*80}\n\n"
                 for mistake in topic.common_mistakes:
-                    txt += f"  ⚠ {mistake}\n"
-                txt += "\n"
+                    yield f"  ⚠ {mistake}\n"
+                yield "\n"
             
             if topic.best_practices:
-                txt += f"{'-'*80}\n"
-                txt += f"ЛУЧШИЕ ПРАКТИКИ\n"
-                txt += f"{'-'*80}\n\n"
+                yield f"{'-'*80}\n"
+                yield f"ЛУЧШИЕ ПРАКТИКИ\n"
+                yield f"{'-'*80}\n\n"
                 for practice in topic.best_practices:
-                    txt += f"  ✓ {practice}\n"
-                txt += "\n"
+                    yield f"  ✓ {practice}\n"
+                yield "\n"
             
             if topic.practice_exercises:
-                txt += f"{'-'*80}\n"
-                txt += f"УПРАЖНЕНИЯ ДЛЯ ПРАКТИКИ\n"
-                txt += f"{'-'*80}\n\n"
+                yield f"{'-'*80}\n"
+                yield f"УПРАЖНЕНИЯ ДЛЯ ПРАКТИКИ\n"
+                yield f"{'-'*80}\n\n"
                 for i, exercise in enumerate(topic.practice_exercises, 1):
-                    txt += f"{i}. {exercise}\n"
-                txt += "\n"
+                    yield f"{i}. {exercise}\n"
+                yield "\n"
             
             if topic.quiz_questions:
-                txt += f"{'-'*80}\n"
-                txt += f"ВОПРОСЫ ДЛЯ САМОПРОВЕРКИ\n"
-                txt += f"{'-'*80}\n\n"
+                yield f"{'-'*80}\n"
+                yield f"ВОПРОСЫ ДЛЯ САМОПРОВЕРКИ\n"
+                yield f"{'-'*80}\n\n"
                 for i, question in enumerate(topic.quiz_questions, 1):
-                    txt += f"{i}. {question}\n"
-                txt += "\n"
+                    yield f"{i}. {question}\n"
+                yield "\n"
             
             if hasattr(topic, 'additional_resources') and topic.additional_resources:
-                txt += f"{'-'*80}\n"
-                txt += f"ДОПОЛНИТЕЛЬНЫЕ РЕСУРСЫ\n"
-                txt += f"{'-'*80}\n\n"
+                yield f"{'-'*80}\n"
+                yield f"ДОПОЛНИТЕЛЬНЫЕ РЕСУРСЫ\n"
+                yield f"{'-'*80}\n\n"
                 for resource in topic.additional_resources:
-                    txt += f"  • {resource}\n"
-                txt += "\n"
-        
-        txt += f"\n{'='*80}\n"
-        txt += f"Создано: {datetime.now().strftime('%d.%m.%Y %H:%M')} | AI Course Builder\n"
-        txt += f"{'='*80}\n"
+                    yield f"  • {resource}\n"
+                yield "\n"
         
-        return txt
-
+        yield f"\n{'='*80}\n"
+        yield f"Создано: {datetime.now().strftime('%d.%m.%Y %H:%M')} | AI Course Builder\n"
+        yield f"{'='*80}\n"
+    
+    # ==================== АРХИВ ВСЕГО КУРСА ====================
+    
+    @timed_render
+    def export_archive_to_zip_stream(self, archive: CourseArchive, sink: BinaryIO):
+        """
+        Экспорт курса, контента модулей и материалов уроков во всех форматах одним ZIP
+        
+        Структура архива:
+            <курс>/course.{json,html,md,txt}
+            <курс>/assets/*.css - общие стили HTML-страниц
+            <курс>/modules/NN_<модуль>/lectures.*
+            <курс>/modules/NN_<модуль>/lessons/NN_<урок>.*
+        """
+        course = archive.course
+        root = archive_name(course.course_title)
+        created_at = datetime.now()
+        zip_archive = ZipArchive(sink)
+        
+        def stylesheet(kind: str, depth: int) -> str:
+            path = f"assets/{kind}.css"
+            zip_archive.asset(f"{root}/{path}", self._templates[f"css/{kind}.css"].render)
+            return "../" * depth + path
+        
+        def write_all(path: str, depth: int, kind: str, model, **context):
+            for method_suffix, extension in ARCHIVE_FORMATS:
+                name = f"{root}/{path}.{extension}"
+                if method_suffix == "html":
+                    chunks = self._templates[f"{kind}.html"].generate(
+                        stylesheet=stylesheet(kind, depth), created_at=created_at, **context
+                    )
+                elif method_suffix == "json":
+                    chunks = json_chunks(model.dict())
+                else:
+                    chunks = getattr(self, f"_{kind}_{method_suffix}")(model)
+                zip_archive.write_stream(name, chunks)
+        
+        try:
+            write_all("course", 0, "course", course, course=course)
+            for module_index, module in enumerate(course.modules):
+                module_dir = f"modules/{module_index + 1:02d}_{archive_name(module.module_title)}"
+                module_content = archive.module_contents.get(module_index)
+                if module_content:
+                    write_all(f"{module_dir}/lectures", 2, "module_content", module_content, content=module_content)
+                for lesson_index, lesson in enumerate(module.lessons):
+                    if lesson.detailed_content:
+                        write_all(f"{module_dir}/lessons/{lesson_index + 1:02d}_{archive_name(lesson.lesson_title)}",
+                                  3, "lesson_content", lesson.detailed_content,
+                                  lesson_content=lesson.detailed_content)
+        finally:
+            zip_archive.close()
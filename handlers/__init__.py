@@ -10,10 +10,13 @@ from .commands import (
     regenerate_content,
     regenerate_lesson,
     generate_topics,
+    generate_all,
     export_course
 )
 from .callbacks import handle_callback
 from .messages import handle_message
+from .persistence import persist_session, load_session
+from .jobs import show_jobs
 
 __all__ = [
     'start',
@@ -25,8 +28,12 @@ __all__ = [
     'regenerate_content',
     'regenerate_lesson',
     'generate_topics',
+    'generate_all',
     'export_course',
     'handle_callback',
-    'handle_message'
+    'handle_message',
+    'persist_session',
+    'load_session',
+    'show_jobs'
 ]
 
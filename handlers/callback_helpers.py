@@ -1,7 +1,7 @@
 """Вспомогательные функции для обработки callback"""
 
 import logging
-from typing import Optional
+from typing import List, Optional
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
@@ -9,13 +9,22 @@ from models import UserSession, Lesson, Course
 from openai_client import OpenAIClient
 from content_generator import ContentGenerator
 from exporters import CourseExporter
-from utils import format_module_content_info, format_lesson_content_info, format_module_info, format_lesson_info
+from utils import (
+    format_module_content_info,
+    format_lesson_content_info,
+    format_module_info,
+    format_lesson_info,
+    format_module_generation_progress,
+    format_topics_generation_progress,
+    ProgressMessage
+)
 from prompts import (
     LESSON_REGENERATION_SYSTEM_PROMPT,
     LESSON_REGENERATION_PROMPT_TEMPLATE,
     format_content_outline,
     format_custom_requirements
 )
+from .jobs import GenerationFailed
 
 logger = logging.getLogger(__name__)
 
@@ -71,8 +80,13 @@ async def handle_module_edit(query, user_id: int, module_index: int, session: Us
     await query.edit_message_text(text, parse_mode="HTML", reply_markup=reply_markup)
 
 
-async def generate_module_content(query, user_id: int, module_index: int, session: UserSession):
-    """Генерирует учебный контент для модуля"""
+async def generate_module_content(query, user_id: int, module_index: int, session: UserSession,
+                                  use_cache: bool = True, reply_markup: Optional[InlineKeyboardMarkup] = None):
+    """
+    Генерирует учебный контент для модуля
+    
+    use_cache=False - перегенерация мимо кэша, reply_markup - кнопки на время генерации
+    """
     course = session.current_course
     module = course.modules[module_index]
     
@@ -81,18 +95,30 @@ async def generate_module_content(query, user_id: int, module_index: int, sessio
         f"Модуль: {module.module_title}\n"
         f"Уроков: {len(module.lessons)}\n\n"
         f"⏳ Это может занять 30-60 секунд...",
-        parse_mode="HTML"
+        parse_mode="HTML",
+        reply_markup=reply_markup
     )
     
+    progress_message = ProgressMessage(query.message)
+    
+    async def on_progress(progress):
+        await progress_message.update(
+            format_module_generation_progress(module.module_title, progress),
+            reply_markup=reply_markup
+        )
+    
     content_generator = get_content_generator()
-    module_content = content_generator.generate_module_content(
+    module_content = await content_generator.generate_module_content_async(
         module=module,
         course_title=course.course_title,
-        target_audience=course.target_audience
+        target_audience=course.target_audience,
+        use_cache=use_cache,
+        on_progress=on_progress
     )
     
     if module_content:
         session.current_module_content = module_content
+        session.module_contents[module_index] = module_content
         
         text = format_module_content_info(module_content)
         
@@ -101,7 +127,7 @@ async def generate_module_content(query, user_id: int, module_index: int, sessio
             [InlineKeyboardButton("🌐 Экспорт HTML (презентация)", callback_data=f"export_mcontent_html_{module_index}")],
             [InlineKeyboardButton("📝 Экспорт Markdown", callback_data=f"export_mcontent_md_{module_index}")],
             [InlineKeyboardButton("📃 Экспорт TXT", callback_data=f"export_mcontent_txt_{module_index}")],
-            [InlineKeyboardButton("🔄 Сгенерировать заново", callback_data=f"gen_content_{module_index}")],
+            [InlineKeyboardButton("🔄 Сгенерировать заново", callback_data=f"regen_content_{module_index}")],
             [InlineKeyboardButton("🔙 К модулям", callback_data="back_to_edit")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -114,6 +140,7 @@ async def generate_module_content(query, user_id: int, module_index: int, sessio
                 InlineKeyboardButton("🔙 Назад", callback_data="back_to_edit")
             ]])
         )
+        raise GenerationFailed("контент модуля не сгенерирован")
 
 
 async def show_lecture_regenerate_menu(query, user_id: int, lecture_index: int, session: UserSession):
@@ -130,6 +157,7 @@ async def show_lecture_regenerate_menu(query, user_id: int, lecture_index: int,
     keyboard = [
         [InlineKeyboardButton("🔄 Перегенерировать всю лекцию", callback_data=f"regen_lecture_full_{lecture_index}")],
         [InlineKeyboardButton("✍️ Перегенерировать с требованиями", callback_data=f"regen_lecture_custom_{lecture_index}")],
+        [InlineKeyboardButton("🩹 Точечная правка по требованиям", callback_data=f"patch_lecture_custom_{lecture_index}")],
         [InlineKeyboardButton("📊 Перегенерировать слайд", callback_data=f"select_slide_{lecture_index}")],
         [InlineKeyboardButton("🔙 Назад", callback_data="back_to_lectures")]
     ]
@@ -154,12 +182,60 @@ async def show_slides_list(query, user_id: int, lecture_index: int, session: Use
             callback_data=f"regen_slide_{lecture_index}_{i}"
         )])
     
+    keyboard.append([InlineKeyboardButton("☑️ Выбрать несколько слайдов", callback_data=f"select_slides_{lecture_index}")])
     keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=f"regen_lecture_{lecture_index}")])
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     await query.edit_message_text(text, parse_mode="HTML", reply_markup=reply_markup)
 
 
+def selected_slides(session: UserSession, lecture_index: int) -> List[int]:
+    """Индексы слайдов лекции, отмеченных для пакетной перегенерации"""
+    selection = session.temp_data.get('selected_slides') or {}
+    if selection.get('lecture') != lecture_index:
+        return []
+    return selection.get('slides', [])
+
+
+def toggle_selected_slide(session: UserSession, lecture_index: int, slide_index: int):
+    """Отмечает слайд для пакетной перегенерации или снимает отметку"""
+    slides = selected_slides(session, lecture_index)
+    if slide_index in slides:
+        slides = [i for i in slides if i != slide_index]
+    else:
+        slides = sorted(slides + [slide_index])
+    session.temp_data['selected_slides'] = {'lecture': lecture_index, 'slides': slides}
+
+
+async def show_slides_selection(query, user_id: int, lecture_index: int, session: UserSession):
+    """Показывает слайды лекции с отметками для пакетной перегенерации"""
+    module_content = session.current_module_content
+    lecture = module_content.lectures[lecture_index]
+    selected = selected_slides(session, lecture_index)
+    
+    text = f"☑️ <b>Выбор слайдов:</b> {lecture.lecture_title}\n\n"
+    text += "Отметьте слайды для перегенерации - они перегенерируются одним запросом.\n\n"
+    text += f"Выбрано: {len(selected)}"
+    
+    keyboard = []
+    for i, slide in enumerate(lecture.slides):
+        mark = "✅" if i in selected else "⬜"
+        keyboard.append([InlineKeyboardButton(
+            f"{mark} {slide.slide_number}. {slide.title[:35]}",
+            callback_data=f"toggle_slide_{lecture_index}_{i}"
+        )])
+    
+    if selected:
+        keyboard.append([InlineKeyboardButton(
+            f"🔄 Перегенерировать выбранные ({len(selected)})",
+            callback_data=f"regen_slides_{lecture_index}"
+        )])
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=f"select_slide_{lecture_index}")])
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await query.edit_message_text(text, parse_mode="HTML", reply_markup=reply_markup)
+
+
 async def show_lessons_for_regen(query, user_id: int, module_index: int, session: UserSession):
     """Показывает список уроков модуля для перегенерации"""
     course = session.current_course
@@ -274,8 +350,13 @@ async def show_lessons_for_topic_gen(query, user_id: int, module_index: int, ses
     await query.edit_message_text(text, parse_mode="HTML", reply_markup=reply_markup)
 
 
-async def generate_lesson_topics(query, user_id: int, module_index: int, lesson_index: int, session: UserSession):
-    """Генерирует детальные учебные материалы для всех тем урока"""
+async def generate_lesson_topics(query, user_id: int, module_index: int, lesson_index: int, session: UserSession,
+                                 use_cache: bool = True, reply_markup: Optional[InlineKeyboardMarkup] = None):
+    """
+    Генерирует детальные учебные материалы для всех тем урока
+    
+    use_cache=False - перегенерация мимо кэша, reply_markup - кнопки на время генерации
+    """
     course = session.current_course
     module = course.modules[module_index]
     lesson = module.lessons[lesson_index]
@@ -292,16 +373,27 @@ async def generate_lesson_topics(query, user_id: int, module_index: int, lesson_
         f"Урок: {lesson.lesson_title}\n"
         f"Тем для раскрытия: {len(lesson.content_outline)}\n\n"
         f"⏳ Это может занять несколько минут...",
-        parse_mode="HTML"
+        parse_mode="HTML",
+        reply_markup=reply_markup
     )
     
+    progress_message = ProgressMessage(query.message)
+    
+    async def on_progress(progress):
+        await progress_message.update(
+            format_topics_generation_progress(lesson.lesson_title, progress),
+            reply_markup=reply_markup
+        )
+    
     content_generator = get_content_generator()
-    lesson_content = content_generator.generate_lesson_detailed_content(
+    lesson_content = await content_generator.generate_lesson_detailed_content_async(
         lesson=lesson,
         module_number=module.module_number,
         course_title=course.course_title,
         module_title=module.module_title,
-        target_audience=course.target_audience
+        target_audience=course.target_audience,
+        use_cache=use_cache,
+        on_progress=on_progress
     )
     
     if lesson_content:
@@ -311,7 +403,7 @@ async def generate_lesson_topics(query, user_id: int, module_index: int, lesson_
         
         keyboard = [
             [InlineKeyboardButton("📥 Экспортировать материалы", callback_data=f"export_topics_menu_{module_index}_{lesson_index}")],
-            [InlineKeyboardButton("🔄 Сгенерировать заново", callback_data=f"gen_topics_lesson_{module_index}_{lesson_index}")],
+            [InlineKeyboardButton("🔄 Сгенерировать заново", callback_data=f"regen_topics_lesson_{module_index}_{lesson_index}")],
             [InlineKeyboardButton("📋 Выбрать другой урок", callback_data=f"gen_topics_module_{module_index}")],
             [InlineKeyboardButton("🔙 К курсу", callback_data="back_to_course")]
         ]
@@ -325,4 +417,5 @@ async def generate_lesson_topics(query, user_id: int, module_index: int, lesson_
                 InlineKeyboardButton("🔙 Назад", callback_data=f"gen_topics_module_{module_index}")
             ]])
         )
+        raise GenerationFailed("материалы урока не сгенерированы")
 
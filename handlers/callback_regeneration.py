@@ -1,34 +1,79 @@
 """Обработчики перегенерации контента"""
 
+import asyncio
 import logging
-from typing import Optional
+from typing import Any, Dict, List, Optional
+from pydantic import ValidationError
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
 from models import UserSession, Lesson, Slide, Lecture
-from openai_client import OpenAIClient
+from openai_client import get_async_openai_client
 from content_generator import ContentGenerator
+from lecture_patch import LECTURE_PATCH_TOOLS, apply_lecture_patch, format_slides_for_patch
+from utils.metrics import get_metrics, llm_call_labels
+from utils.token_budget import apply_token_budget, predict_lecture_tokens
 from prompts import (
     LESSON_REGENERATION_SYSTEM_PROMPT,
     LESSON_REGENERATION_PROMPT_TEMPLATE,
+    SLIDE_SCHEMA,
+    SLIDE_SCHEMA_COMPACT,
+    SLIDE_REGENERATION_INSTRUCTIONS,
+    SLIDE_REGENERATION_CONTEXT_TEMPLATE,
+    SLIDES_BATCH_INSTRUCTIONS,
+    SLIDES_BATCH_CONTEXT_TEMPLATE,
+    LECTURE_SCHEMA,
+    LECTURE_SCHEMA_COMPACT,
+    LECTURE_REGENERATION_INSTRUCTIONS,
+    LECTURE_REGENERATION_CONTEXT_TEMPLATE,
+    LECTURE_PATCH_INSTRUCTIONS,
+    LECTURE_PATCH_CONTEXT_TEMPLATE,
+    build_prompt_messages,
+    response_schema,
     format_content_outline,
     format_custom_requirements
 )
+from .jobs import GenerationFailed
 
 logger = logging.getLogger(__name__)
 
+# Лимит токенов ответа на один слайд в пакетной перегенерации
+SLIDE_BATCH_TOKENS_PER_SLIDE = 700
+
+# Функция для пакетной перегенерации слайдов (Function Calling)
+SLIDES_REGENERATION_TOOLS = [{
+    "type": "function",
+    "function": {
+        "name": "regenerate_slides",
+        "description": "Возвращает новые версии выбранных слайдов лекции",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "slides": {
+                    "type": "array",
+                    "description": "Новые версии слайдов, по одной на каждый запрошенный слайд",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "slide_number": {"type": "integer", "description": "Номер перегенерируемого слайда"},
+                            "title": {"type": "string"},
+                            "content": {"type": "string"},
+                            "slide_type": {"type": "string"},
+                            "code_example": {"type": ["string", "null"]},
+                            "notes": {"type": "string"}
+                        },
+                        "required": ["slide_number", "title", "content", "slide_type", "notes"]
+                    }
+                }
+            },
+            "required": ["slides"]
+        }
+    }
+}]
+
 # Глобальные переменные для сервисов (ленивая инициализация)
-_openai_client = None
 _content_generator = None
 
 
-def get_openai_client():
-    """Получает или создаёт экземпляр OpenAIClient"""
-    global _openai_client
-    if _openai_client is None:
-        _openai_client = OpenAIClient()
-    return _openai_client
-
-
 def get_content_generator():
     """Получает или создаёт экземпляр ContentGenerator"""
     global _content_generator
@@ -38,8 +83,9 @@ def get_content_generator():
 
 
 async def regenerate_lesson_item(query, user_id: int, module_index: int, lesson_index: int, 
-                                 session: UserSession, custom_requirements: Optional[str]):
-    """Перегенерирует отдельный урок"""
+                                 session: UserSession, custom_requirements: Optional[str],
+                                 reply_markup: Optional[InlineKeyboardMarkup] = None):
+    """Перегенерирует отдельный урок (reply_markup - кнопки на время генерации)"""
     course = session.current_course
     module = course.modules[module_index]
     lesson = module.lessons[lesson_index]
@@ -48,7 +94,8 @@ async def regenerate_lesson_item(query, user_id: int, module_index: int, lesson_
         f"🤖 <b>Перегенерация урока...</b>\n\n"
         f"Урок: {lesson.lesson_title}\n\n"
         f"⏳ Подождите 20-30 секунд...",
-        parse_mode="HTML"
+        parse_mode="HTML",
+        reply_markup=reply_markup
     )
     
     prompt = LESSON_REGENERATION_PROMPT_TEMPLATE.format(
@@ -65,18 +112,19 @@ async def regenerate_lesson_item(query, user_id: int, module_index: int, lesson_
     )
 
     try:
-        openai_client = get_openai_client()
+        openai_client = get_async_openai_client()
         content_generator = get_content_generator()
         
-        response = openai_client.client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": LESSON_REGENERATION_SYSTEM_PROMPT},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=1000
-        )
+        with llm_call_labels(template="lesson_regeneration"):
+            response = await openai_client.chat_completion(
+                model="gpt-4",
+                messages=[
+                    {"role": "system", "content": LESSON_REGENERATION_SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.7,
+                max_tokens=1000
+            )
         
         content = response.choices[0].message.content.strip()
         json_content = content_generator._extract_lesson_json(content)
@@ -104,10 +152,14 @@ async def regenerate_lesson_item(query, user_id: int, module_index: int, lesson_
             await query.edit_message_text(text, parse_mode="HTML", reply_markup=reply_markup)
         else:
             await query.edit_message_text("❌ Ошибка перегенерации урока")
+            raise GenerationFailed("модель не вернула урок")
             
+    except GenerationFailed:
+        raise
     except Exception as e:
         logger.error(f"Ошибка перегенерации урока: {e}")
         await query.edit_message_text(f"❌ Ошибка: {e}")
+        raise GenerationFailed(str(e)) from e
 
 
 async def show_slide_regenerate_menu(query, user_id: int, lecture_index: int, slide_index: int, session: UserSession):
@@ -133,8 +185,9 @@ async def show_slide_regenerate_menu(query, user_id: int, lecture_index: int, sl
     await query.edit_message_text(text, parse_mode="HTML", reply_markup=reply_markup)
 
 
-async def regenerate_lecture(query, user_id: int, lecture_index: int, session: UserSession, custom_requirements: Optional[str]):
-    """Перегенерирует лекцию"""
+async def regenerate_lecture(query, user_id: int, lecture_index: int, session: UserSession, custom_requirements: Optional[str],
+                             reply_markup: Optional[InlineKeyboardMarkup] = None):
+    """Перегенерирует лекцию (reply_markup - кнопки на время генерации)"""
     module_content = session.current_module_content
     lecture = module_content.lectures[lecture_index]
     course = session.current_course
@@ -143,65 +196,38 @@ async def regenerate_lecture(query, user_id: int, lecture_index: int, session: U
         f"🤖 <b>Перегенерация лекции...</b>\n\n"
         f"Лекция: {lecture.lecture_title}\n\n"
         f"⏳ Это может занять 30-60 секунд...",
-        parse_mode="HTML"
+        parse_mode="HTML",
+        reply_markup=reply_markup
     )
     
-    prompt = f"""Перегенерируй ДЕТАЛЬНУЮ лекцию для IT-курса в формате слайдов.
-
-КУРС: {course.course_title}
-АУДИТОРИЯ: {course.target_audience}
-МОДУЛЬ: {module_content.module_title}
-ЛЕКЦИЯ: {lecture.lecture_title}
-ТЕКУЩЕЕ КОЛИЧЕСТВО СЛАЙДОВ: {len(lecture.slides)}
-
-"""
-    
-    if custom_requirements:
-        prompt += f"ДОПОЛНИТЕЛЬНЫЕ ТРЕБОВАНИЯ:\n{custom_requirements}\n\n"
-    
-    prompt += f"""ЗАДАЧА: Создай улучшенную версию лекции с 8-12 слайдами.
-
-ТИПЫ СЛАЙДОВ:
-- title: Заглавный
-- content: Теория (3-5 пунктов)
-- code: Примеры кода
-- diagram: Схемы (описание)
-- quiz: Вопросы
-- summary: Итоги
-
-ФОРМАТ ОТВЕТА: строго JSON
-{{
-  "lecture_title": "{lecture.lecture_title}",
-  "module_number": {module_content.module_number},
-  "module_title": "{module_content.module_title}",
-  "duration_minutes": 45,
-  "learning_objectives": ["цель 1", "цель 2"],
-  "key_takeaways": ["вывод 1", "вывод 2"],
-  "slides": [
-    {{
-      "slide_number": 1,
-      "title": "...",
-      "content": "...",
-      "slide_type": "title",
-      "code_example": null,
-      "notes": "заметки"
-    }}
-  ]
-}}"""
+    context = LECTURE_REGENERATION_CONTEXT_TEMPLATE.format(
+        course_title=course.course_title,
+        target_audience=course.target_audience,
+        module_title=module_content.module_title,
+        lecture_title=lecture.lecture_title,
+        num_slides=len(lecture.slides),
+        module_number=module_content.module_number,
+        custom_requirements=format_custom_requirements(custom_requirements)
+    )
+    messages = build_prompt_messages(
+        "Ты — эксперт по созданию образовательного контента. Создаёшь детальные лекции со слайдами. Отвечаешь строго в JSON.",
+        LECTURE_REGENERATION_INSTRUCTIONS, context,
+        response_schema(LECTURE_SCHEMA, LECTURE_SCHEMA_COMPACT)
+    )
 
     try:
-        openai_client = get_openai_client()
+        openai_client = get_async_openai_client()
         content_generator = get_content_generator()
         
-        response = openai_client.client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "Ты — эксперт по созданию образовательного контента. Создаёшь детальные лекции со слайдами. Отвечаешь строго в JSON."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=4000
-        )
+        request = {
+            "model": "gpt-4",
+            "messages": messages,
+            "temperature": 0.7
+        }
+        budget = apply_token_budget(request, "lecture_regeneration", predict_lecture_tokens(len(lecture.slides)))
+        with llm_call_labels(template="lecture_regeneration"):
+            response = await openai_client.chat_completion(**request)
+        budget.observe_response(response)
         
         content = response.choices[0].message.content.strip()
         json_content = content_generator._extract_json(content)
@@ -224,107 +250,355 @@ async def regenerate_lecture(query, user_id: int, lecture_index: int, session: U
             await query.edit_message_text(text, parse_mode="HTML", reply_markup=reply_markup)
         else:
             await query.edit_message_text("❌ Ошибка перегенерации. Попробуйте позже.")
+            raise GenerationFailed("модель не вернула лекцию")
             
+    except GenerationFailed:
+        raise
     except Exception as e:
         logger.error(f"Ошибка перегенерации лекции: {e}")
         await query.edit_message_text(f"❌ Ошибка: {e}")
+        raise GenerationFailed(str(e)) from e
 
 
-async def regenerate_slide(query, user_id: int, lecture_index: int, slide_index: int, 
-                           session: UserSession, custom_requirements: Optional[str]):
-    """Перегенерирует отдельный слайд"""
+async def patch_lecture(query, user_id: int, lecture_index: int, session: UserSession, custom_requirements: str,
+                        reply_markup: Optional[InlineKeyboardMarkup] = None):
+    """
+    Точечно правит лекцию по требованиям (reply_markup - кнопки на время генерации)
+
+    Модель возвращает только операции над слайдами (см. lecture_patch),
+    неизменённые слайды остаются как есть.
+    """
     module_content = session.current_module_content
     lecture = module_content.lectures[lecture_index]
-    slide = lecture.slides[slide_index]
     course = session.current_course
     
     await query.edit_message_text(
-        f"🤖 <b>Перегенерация слайда...</b>\n\n"
-        f"Слайд #{slide.slide_number}: {slide.title}\n\n"
-        f"⏳ Подождите немного...",
-        parse_mode="HTML"
+        f"🤖 <b>Правка лекции...</b>\n\n"
+        f"Лекция: {lecture.lecture_title}\n\n"
+        f"⏳ Подождите 10-20 секунд...",
+        parse_mode="HTML",
+        reply_markup=reply_markup
     )
     
-    prompt = f"""Перегенерируй ОДИН слайд для IT-лекции.
-
-КОНТЕКСТ:
-Курс: {course.course_title}
-Аудитория: {course.target_audience}
-Модуль: {module_content.module_title}
-Лекция: {lecture.lecture_title}
-Слайд #{slide.slide_number}: {slide.title}
-Текущий тип: {slide.slide_type}
-
-ТЕКУЩИЙ КОНТЕНТ СЛАЙДА:
-{slide.content}
-"""
-    
-    if custom_requirements:
-        prompt += f"\nДОПОЛНИТЕЛЬНЫЕ ТРЕБОВАНИЯ:\n{custom_requirements}\n"
-    
-    prompt += f"""
-ЗАДАЧА: Создай улучшенную версию этого слайда.
-
-ТИПЫ СЛАЙДОВ:
-- title: Заглавный
-- content: Теория (3-5 пунктов)
-- code: Примеры кода (обязательно добавь code_example)
-- diagram: Схемы (описание визуализации)
-- quiz: Вопросы для проверки
-- summary: Итоги
-
-ФОРМАТ ОТВЕТА: строго JSON
-{{
-  "slide_number": {slide.slide_number},
-  "title": "заголовок слайда",
-  "content": "содержание слайда (3-5 пунктов через \\n)",
-  "slide_type": "{slide.slide_type}",
-  "code_example": "код если нужен или null",
-  "notes": "заметки для преподавателя"
-}}
-
-ВАЖНО: Верни ТОЛЬКО JSON, без комментариев!"""
+    original_slides = list(lecture.slides)
+    context = LECTURE_PATCH_CONTEXT_TEMPLATE.format(
+        course_title=course.course_title,
+        target_audience=course.target_audience,
+        module_title=module_content.module_title,
+        lecture_title=lecture.lecture_title,
+        slides=format_slides_for_patch(lecture),
+        custom_requirements=custom_requirements
+    )
+    messages = build_prompt_messages(
+        "Ты — эксперт по созданию образовательного контента. Правишь лекции точечно, не меняя лишнего.",
+        LECTURE_PATCH_INSTRUCTIONS, context
+    )
 
     try:
-        openai_client = get_openai_client()
-        content_generator = get_content_generator()
+        with llm_call_labels(template="lecture_patch"):
+            response = await get_async_openai_client().chat_completion(
+                model="gpt-4",
+                messages=messages,
+                tools=LECTURE_PATCH_TOOLS,
+                tool_choice={"type": "function", "function": {"name": "patch_lecture"}},
+                temperature=0.3,
+                max_tokens=2000
+            )
+        
+        tool_calls = response.choices[0].message.tool_calls
+        partial = None
+        if tool_calls:
+            partial = get_content_generator()._parse_json_content(
+                tool_calls[0].function.arguments, kind="lecture_patch"
+            )
+        operations = partial.value.get("operations") if partial else None
+        if not isinstance(operations, list):
+            await query.edit_message_text("❌ Ошибка правки лекции. Попробуйте позже.")
+            raise GenerationFailed("модель не вернула операции правки")
+        if partial.truncated:
+            # Из обрезанного ответа - только операции, полученные целиком
+            operations = [op for index, op in enumerate(operations) if partial.is_complete(("operations", index))]
+        
+        # Пока шла генерация, лекцию могли перегенерировать - идентификаторы устарели
+        if module_content.lectures[lecture_index] is not lecture or lecture.slides != original_slides:
+            await query.edit_message_text(
+                "⚠️ Лекция изменилась во время правки, повторите запрос",
+                reply_markup=InlineKeyboardMarkup([[
+                    InlineKeyboardButton("🔙 К лекциям", callback_data="back_to_lectures")
+                ]])
+            )
+            return
+        
+        result = apply_lecture_patch(lecture, operations)
+        module_content.total_slides = sum(len(item.slides) for item in module_content.lectures)
+        logger.info(f"🩹 Патч лекции {lecture_index}: применено {len(result.applied)}, "
+                    f"пропущено {len(result.skipped)}")
         
-        response = openai_client.client.chat.completions.create(
+        if result.applied:
+            text = f"✅ <b>Лекция изменена!</b>\n\n"
+        else:
+            text = f"⚠️ <b>Изменения не применены</b>\n\n"
+        text += f"📖 {lecture.lecture_title}\n"
+        text += f"📊 Слайдов: {len(original_slides)} → {len(lecture.slides)}\n"
+        text += f"🩹 Операций: {len(result.applied)}"
+        if result.skipped:
+            text += f" (пропущено: {len(result.skipped)})"
+        text += "\n"
+        
+        keyboard = [
+            [InlineKeyboardButton("👁️ Просмотреть слайды", callback_data=f"view_slides_{lecture_index}")],
+            [InlineKeyboardButton("🩹 Ещё правка", callback_data=f"patch_lecture_custom_{lecture_index}")],
+            [InlineKeyboardButton("🔙 К лекциям", callback_data="back_to_lectures")]
+        ]
+        await query.edit_message_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
+            
+    except GenerationFailed:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка правки лекции: {e}")
+        await query.edit_message_text(f"❌ Ошибка: {e}")
+        raise GenerationFailed(str(e)) from e
+
+
+def _slide_messages(course, module_content, lecture: Lecture, slide: Slide,
+                    custom_requirements: Optional[str]) -> List[Dict[str, str]]:
+    """Сообщения запроса перегенерации одного слайда"""
+    context = SLIDE_REGENERATION_CONTEXT_TEMPLATE.format(
+        course_title=course.course_title,
+        target_audience=course.target_audience,
+        module_title=module_content.module_title,
+        lecture_title=lecture.lecture_title,
+        slide_number=slide.slide_number,
+        slide_title=slide.title,
+        slide_type=slide.slide_type,
+        slide_content=slide.content,
+        custom_requirements=format_custom_requirements(custom_requirements)
+    )
+    return build_prompt_messages(
+        "Ты — эксперт по созданию образовательных слайдов. Отвечаешь строго в JSON.",
+        SLIDE_REGENERATION_INSTRUCTIONS, context,
+        response_schema(SLIDE_SCHEMA, SLIDE_SCHEMA_COMPACT)
+    )
+
+
+def _validate_slide(data: Any, slide_number: int) -> Optional[Slide]:
+    """Slide из ответа модели или None, если данные не проходят валидацию"""
+    if not isinstance(data, dict):
+        return None
+    try:
+        with get_metrics().validation_seconds.time(model="Slide"):
+            return Slide(**{**data, "slide_number": slide_number})
+    except ValidationError as e:
+        logger.warning(f"⚠️ Слайд #{slide_number} не прошёл валидацию: {e}")
+        return None
+
+
+async def _request_slide(session: UserSession, lecture: Lecture, slide: Slide,
+                         custom_requirements: Optional[str]) -> Optional[Slide]:
+    """Перегенерирует слайд отдельным запросом; None, если ответ не удалось разобрать"""
+    messages = _slide_messages(session.current_course, session.current_module_content,
+                               lecture, slide, custom_requirements)
+    
+    with llm_call_labels(template="slide_regeneration"):
+        response = await get_async_openai_client().chat_completion(
             model="gpt-4",
-            messages=[
-                {"role": "system", "content": "Ты — эксперт по созданию образовательных слайдов. Отвечаешь строго в JSON."},
-                {"role": "user", "content": prompt}
-            ],
+            messages=messages,
             temperature=0.7,
             max_tokens=800
         )
+    
+    content = response.choices[0].message.content.strip()
+    partial = get_content_generator()._parse_json_content(content, kind="slide")
+    if partial is None or partial.truncated:
+        return None
+    return _validate_slide(partial.value, slide.slide_number)
+
+
+async def regenerate_slide(query, user_id: int, lecture_index: int, slide_index: int, 
+                           session: UserSession, custom_requirements: Optional[str],
+                           reply_markup: Optional[InlineKeyboardMarkup] = None):
+    """Перегенерирует отдельный слайд (reply_markup - кнопки на время генерации)"""
+    module_content = session.current_module_content
+    lecture = module_content.lectures[lecture_index]
+    slide = lecture.slides[slide_index]
+    
+    await query.edit_message_text(
+        f"🤖 <b>Перегенерация слайда...</b>\n\n"
+        f"Слайд #{slide.slide_number}: {slide.title}\n\n"
+        f"⏳ Подождите немного...",
+        parse_mode="HTML",
+        reply_markup=reply_markup
+    )
+
+    try:
+        new_slide = await _request_slide(session, lecture, slide, custom_requirements)
         
-        content = response.choices[0].message.content.strip()
-        json_content = content_generator._extract_json(content)
-        
-        if json_content:
-            lecture.slides[slide_index] = Slide(**json_content)
+        if new_slide:
+            lecture.slides[slide_index] = new_slide
             
             text = f"✅ <b>Слайд перегенерирован!</b>\n\n"
-            text += f"Слайд #{json_content['slide_number']}: {json_content['title']}\n"
-            text += f"Тип: {json_content['slide_type']}\n\n"
-            text += f"<b>Новый контент:</b>\n{json_content['content'][:200]}...\n\n"
+            text += f"Слайд #{new_slide.slide_number}: {new_slide.title}\n"
+            text += f"Тип: {new_slide.slide_type}\n\n"
+            text += f"<b>Новый контент:</b>\n{new_slide.content[:200]}...\n\n"
+            
+            module_index = next(
+                (i for i, content in session.module_contents.items() if content is module_content), None
+            )
             
             keyboard = [
                 [InlineKeyboardButton("👁️ К списку слайдов", callback_data=f"select_slide_{lecture_index}")],
-                [InlineKeyboardButton("🔄 Перегенерировать заново", callback_data=f"regen_slide_full_{lecture_index}_{slide_index}")],
-                [InlineKeyboardButton("📥 Экспортировать лекцию", callback_data=f"export_mcontent_html_0")],
-                [InlineKeyboardButton("🔙 К лекциям", callback_data="back_to_lectures")]
+                [InlineKeyboardButton("🔄 Перегенерировать заново", callback_data=f"regen_slide_full_{lecture_index}_{slide_index}")]
             ]
+            if module_index is not None:
+                keyboard.append([InlineKeyboardButton("📥 Экспортировать лекцию", callback_data=f"export_mcontent_html_{module_index}")])
+            keyboard.append([InlineKeyboardButton("🔙 К лекциям", callback_data="back_to_lectures")])
             reply_markup = InlineKeyboardMarkup(keyboard)
             
             await query.edit_message_text(text, parse_mode="HTML", reply_markup=reply_markup)
         else:
             await query.edit_message_text("❌ Ошибка перегенерации слайда")
+            raise GenerationFailed("модель не вернула слайд")
             
+    except GenerationFailed:
+        raise
     except Exception as e:
         logger.error(f"Ошибка перегенерации слайда: {e}")
         await query.edit_message_text(f"❌ Ошибка: {e}")
+        raise GenerationFailed(str(e)) from e
+
+
+def _slides_batch_messages(course, module_content, lecture: Lecture,
+                           slides: List[Slide]) -> List[Dict[str, str]]:
+    """Сообщения запроса перегенерации нескольких слайдов лекции"""
+    context = SLIDES_BATCH_CONTEXT_TEMPLATE.format(
+        course_title=course.course_title,
+        target_audience=course.target_audience,
+        module_title=module_content.module_title,
+        lecture_title=lecture.lecture_title,
+        slide_titles="; ".join(f"#{s.slide_number} {s.title}" for s in lecture.slides),
+        slides="\n".join(
+            f"Слайд #{slide.slide_number}: {slide.title}\n"
+            f"Текущий тип: {slide.slide_type}\n"
+            f"Текущий контент:\n{slide.content}\n"
+            for slide in slides
+        )
+    )
+    return build_prompt_messages(
+        "Ты — эксперт по созданию образовательных слайдов.", SLIDES_BATCH_INSTRUCTIONS, context
+    )
+
+
+async def _request_slides_batch(session: UserSession, lecture: Lecture,
+                                slides: List[Slide]) -> Dict[int, Slide]:
+    """
+    Перегенерирует несколько слайдов одним запросом (Function Calling)
+
+    Каждый слайд ответа проверяется отдельно: невалидный или обрезанный
+    слайд не мешает принять остальные.
+
+    Returns:
+        Принятые слайды по номеру слайда
+    """
+    messages = _slides_batch_messages(session.current_course, session.current_module_content, lecture, slides)
+    
+    with llm_call_labels(template="slides_regeneration"):
+        response = await get_async_openai_client().chat_completion(
+            model="gpt-4",
+            messages=messages,
+            tools=SLIDES_REGENERATION_TOOLS,
+            tool_choice={"type": "function", "function": {"name": "regenerate_slides"}},
+            temperature=0.7,
+            max_tokens=SLIDE_BATCH_TOKENS_PER_SLIDE * len(slides)
+        )
+    
+    tool_calls = response.choices[0].message.tool_calls
+    if not tool_calls:
+        logger.warning("⚠️ Пакетная перегенерация слайдов: модель не вызвала функцию")
+        return {}
+    
+    partial = get_content_generator()._parse_json_content(tool_calls[0].function.arguments, kind="slides")
+    if partial is None or not isinstance(partial.value.get("slides"), list):
+        return {}
+    
+    wanted = {slide.slide_number for slide in slides}
+    accepted: Dict[int, Slide] = {}
+    for index, data in enumerate(partial.value["slides"]):
+        # Из обрезанного ответа берём только слайды, полученные целиком
+        if not partial.is_complete(("slides", index)) or not isinstance(data, dict):
+            continue
+        slide_number = data.get("slide_number")
+        if slide_number not in wanted or slide_number in accepted:
+            continue
+        new_slide = _validate_slide(data, slide_number)
+        if new_slide:
+            accepted[slide_number] = new_slide
+    return accepted
+
+
+async def regenerate_slides(query, user_id: int, lecture_index: int, slide_indices: List[int],
+                            session: UserSession, reply_markup: Optional[InlineKeyboardMarkup] = None):
+    """
+    Перегенерирует выбранные слайды лекции (reply_markup - кнопки на время генерации)
+
+    Все слайды запрашиваются одним запросом; отдельными запросами
+    перегенерируются только слайды, которые не удалось принять из него.
+    """
+    module_content = session.current_module_content
+    lecture = module_content.lectures[lecture_index]
+    slides = [lecture.slides[i] for i in slide_indices]
+    
+    await query.edit_message_text(
+        f"🤖 <b>Перегенерация слайдов...</b>\n\n"
+        f"Лекция: {lecture.lecture_title}\n"
+        f"Слайдов: {len(slides)}\n\n"
+        f"⏳ Подождите немного...",
+        parse_mode="HTML",
+        reply_markup=reply_markup
+    )
+
+    try:
+        accepted = await _request_slides_batch(session, lecture, slides)
+    except Exception as e:
+        logger.error(f"Ошибка пакетной перегенерации слайдов: {e}")
+        accepted = {}
+    
+    failed = [slide for slide in slides if slide.slide_number not in accepted]
+    if failed:
+        logger.warning(f"🔁 Слайдов не принято из пакета: {len(failed)} из {len(slides)}, "
+                       f"перегенерируем по одному")
+        results = await asyncio.gather(
+            *(_request_slide(session, lecture, slide, None) for slide in failed),
+            return_exceptions=True
+        )
+        for slide, result in zip(failed, results):
+            if isinstance(result, Slide):
+                accepted[slide.slide_number] = result
+            elif isinstance(result, Exception):
+                logger.error(f"Ошибка перегенерации слайда #{slide.slide_number}: {result}")
+    
+    # Индексы могли сдвинуться, пока шла генерация - ищем слайды по номеру
+    for i, slide in enumerate(lecture.slides):
+        if slide.slide_number in accepted:
+            lecture.slides[i] = accepted[slide.slide_number]
+    session.temp_data.pop('selected_slides', None)
+    
+    if accepted:
+        text = f"✅ <b>Слайдов перегенерировано: {len(accepted)} из {len(slides)}</b>\n\n"
+    else:
+        text = "❌ <b>Ошибка перегенерации слайдов</b>\n\n"
+    text += f"Лекция: {lecture.lecture_title}\n\n"
+    for slide in slides:
+        new_slide = accepted.get(slide.slide_number)
+        mark = "✅" if new_slide else "❌"
+        text += f"{mark} #{slide.slide_number}: {(new_slide or slide).title}\n"
+    
+    keyboard = [
+        [InlineKeyboardButton("👁️ К списку слайдов", callback_data=f"select_slide_{lecture_index}")],
+        [InlineKeyboardButton("🔙 К лекциям", callback_data="back_to_lectures")]
+    ]
+    await query.edit_message_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
+    if not accepted:
+        raise GenerationFailed("ни один слайд не перегенерирован")
 
 
 async def generate_module_goal(query, user_id: int, module_index: int, session: UserSession):
@@ -349,17 +623,18 @@ async def generate_module_goal(query, user_id: int, module_index: int, session:
 Верни ТОЛЬКО текст цели, без дополнительных пояснений."""
 
     try:
-        openai_client = get_openai_client()
+        openai_client = get_async_openai_client()
         
-        response = openai_client.client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "Ты — эксперт по педагогическому дизайну IT-курсов."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=200
-        )
+        with llm_call_labels(template="module_goal"):
+            response = await openai_client.chat_completion(
+                model="gpt-4",
+                messages=[
+                    {"role": "system", "content": "Ты — эксперт по педагогическому дизайну IT-курсов."},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.7,
+                max_tokens=200
+            )
         
         new_goal = response.choices[0].message.content.strip()
         module.module_goal = new_goal
@@ -4,13 +4,17 @@ import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
+from models import CourseArchive
 from utils import get_session_manager
-from exporters import CourseExporter
+from export_pool import export_document, ExportTimeout
 from .callback_helpers import (
     handle_module_edit,
     generate_module_content,
     show_lecture_regenerate_menu,
     show_slides_list,
+    show_slides_selection,
+    selected_slides,
+    toggle_selected_slide,
     show_lessons_for_regen,
     show_lesson_regen_menu,
     show_module_details,
@@ -23,21 +27,23 @@ from .callback_regeneration import (
     show_slide_regenerate_menu,
     regenerate_lecture,
     regenerate_slide,
+    regenerate_slides,
+    patch_lecture,
     generate_module_goal
 )
+from .jobs import submit_generation_job, cancel_job
 
 logger = logging.getLogger(__name__)
 
-# Глобальная переменная для экспортера (ленивая инициализация)
-_course_exporter = None
+# Форматы экспорта: суффикс метода CourseExporter и расширение файла
+EXPORT_FORMATS = {
+    "json": ("json", "json"),
+    "html": ("html", "html"),
+    "md": ("markdown", "md"),
+    "txt": ("txt", "txt"),
+}
 
-
-def get_course_exporter():
-    """Получает или создаёт экземпляр CourseExporter"""
-    global _course_exporter
-    if _course_exporter is None:
-        _course_exporter = CourseExporter()
-    return _course_exporter
+EXPORT_TIMEOUT_TEXT = "⏳ Экспорт занимает слишком много времени, попробуйте чуть позже"
 
 
 async def handle_callback(query_update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -105,12 +111,32 @@ async def handle_callback(query_update: Update, context: ContextTypes.DEFAULT_TY
     
     elif data.startswith("gen_content_"):
         module_index = int(data.split("_")[2])
-        await generate_module_content(query, user_id, module_index, session)
+        await submit_generation_job(
+            query, user_id, "module_content", str(module_index),
+            lambda markup: generate_module_content(query, user_id, module_index, session, reply_markup=markup)
+        )
+    
+    elif data.startswith("regen_content_"):
+        # Перегенерация: не берём результат из кэша LLM
+        module_index = int(data.split("_")[2])
+        await submit_generation_job(
+            query, user_id, "module_content", str(module_index),
+            lambda markup: generate_module_content(
+                query, user_id, module_index, session, use_cache=False, reply_markup=markup
+            )
+        )
+    
+    elif data.startswith("cancel_job_"):
+        job_id = int(data.split("_")[2])
+        await cancel_job(query, user_id, job_id)
     
     # ВАЖНО: Более специфичные паттерны должны проверяться первыми!
     elif data.startswith("regen_lecture_full_"):
         lecture_index = int(data.split("_")[3])
-        await regenerate_lecture(query, user_id, lecture_index, session, None)
+        await submit_generation_job(
+            query, user_id, "regen_lecture", str(lecture_index),
+            lambda markup: regenerate_lecture(query, user_id, lecture_index, session, None, reply_markup=markup)
+        )
     
     elif data.startswith("regen_lecture_custom_"):
         lecture_index = int(data.split("_")[3])
@@ -125,6 +151,26 @@ async def handle_callback(query_update: Update, context: ContextTypes.DEFAULT_TY
             "• Больше визуальных схем"
         )
     
+    elif data.startswith("patch_lecture_custom_"):
+        lecture_index = int(data.split("_")[3])
+        session.editing_mode = True
+        session.editing_path = f"patch_lecture_custom_{lecture_index}"
+        await query.edit_message_text(
+            "🩹 Опишите, что изменить в лекции - остальные слайды останутся как есть:\n\n"
+            "Например:\n"
+            "• Добавить слайд с примером после введения\n"
+            "• Убрать слайд про историю технологии\n"
+            "• Поменять местами последние два слайда"
+        )
+    
+    elif data.startswith("start_patch_lecture_"):
+        lecture_index = int(data.split("_")[3])
+        custom_req = session.temp_data.get('custom_req')
+        await submit_generation_job(
+            query, user_id, "patch_lecture", str(lecture_index),
+            lambda markup: patch_lecture(query, user_id, lecture_index, session, custom_req, reply_markup=markup)
+        )
+    
     elif data.startswith("regen_lecture_"):
         lecture_index = int(data.split("_")[2])
         await show_lecture_regenerate_menu(query, user_id, lecture_index, session)
@@ -133,23 +179,60 @@ async def handle_callback(query_update: Update, context: ContextTypes.DEFAULT_TY
         lecture_index = int(data.split("_")[2])
         await show_slides_list(query, user_id, lecture_index, session)
     
+    elif data.startswith("select_slides_"):
+        lecture_index = int(data.split("_")[2])
+        await show_slides_selection(query, user_id, lecture_index, session)
+    
+    elif data.startswith("toggle_slide_"):
+        parts = data.split("_")
+        lecture_index = int(parts[2])
+        slide_index = int(parts[3])
+        toggle_selected_slide(session, lecture_index, slide_index)
+        await show_slides_selection(query, user_id, lecture_index, session)
+    
+    elif data.startswith("regen_slides_"):
+        lecture_index = int(data.split("_")[2])
+        slide_indices = selected_slides(session, lecture_index)
+        if not slide_indices:
+            await show_slides_selection(query, user_id, lecture_index, session)
+            return
+        await submit_generation_job(
+            query, user_id, "regen_slides", f"{lecture_index}:{','.join(map(str, slide_indices))}",
+            lambda markup: regenerate_slides(
+                query, user_id, lecture_index, slide_indices, session, reply_markup=markup
+            )
+        )
+    
     elif data.startswith("regen_slide_full_"):
         parts = data.split("_")
         lecture_index = int(parts[3])
         slide_index = int(parts[4])
-        await regenerate_slide(query, user_id, lecture_index, slide_index, session, None)
+        await submit_generation_job(
+            query, user_id, "regen_slide", f"{lecture_index}:{slide_index}",
+            lambda markup: regenerate_slide(
+                query, user_id, lecture_index, slide_index, session, None, reply_markup=markup
+            )
+        )
     
     elif data.startswith("start_regen_slide_"):
         parts = data.split("_")
         lecture_index = int(parts[3])
         slide_index = int(parts[4])
         custom_req = session.temp_data.get('custom_req')
-        await regenerate_slide(query, user_id, lecture_index, slide_index, session, custom_req)
+        await submit_generation_job(
+            query, user_id, "regen_slide", f"{lecture_index}:{slide_index}",
+            lambda markup: regenerate_slide(
+                query, user_id, lecture_index, slide_index, session, custom_req, reply_markup=markup
+            )
+        )
     
     elif data.startswith("start_regen_lecture_"):
         lecture_index = int(data.split("_")[3])
         custom_req = session.temp_data.get('custom_req')
-        await regenerate_lecture(query, user_id, lecture_index, session, custom_req)
+        await submit_generation_job(
+            query, user_id, "regen_lecture", str(lecture_index),
+            lambda markup: regenerate_lecture(query, user_id, lecture_index, session, custom_req, reply_markup=markup)
+        )
     
     elif data.startswith("regen_slide_custom_"):
         parts = data.split("_")
@@ -194,7 +277,24 @@ async def handle_callback(query_update: Update, context: ContextTypes.DEFAULT_TY
         parts = data.split("_")
         module_index = int(parts[3])
         lesson_index = int(parts[4])
-        await generate_lesson_topics(query, user_id, module_index, lesson_index, session)
+        await submit_generation_job(
+            query, user_id, "lesson_topics", f"{module_index}:{lesson_index}",
+            lambda markup: generate_lesson_topics(
+                query, user_id, module_index, lesson_index, session, reply_markup=markup
+            )
+        )
+    
+    elif data.startswith("regen_topics_lesson_"):
+        # Перегенерация: не берём материалы из кэша LLM
+        parts = data.split("_")
+        module_index = int(parts[3])
+        lesson_index = int(parts[4])
+        await submit_generation_job(
+            query, user_id, "lesson_topics", f"{module_index}:{lesson_index}",
+            lambda markup: generate_lesson_topics(
+                query, user_id, module_index, lesson_index, session, use_cache=False, reply_markup=markup
+            )
+        )
     
     elif data.startswith("regen_lesson_item_"):
         parts = data.split("_")
@@ -206,7 +306,12 @@ async def handle_callback(query_update: Update, context: ContextTypes.DEFAULT_TY
         parts = data.split("_")
         module_index = int(parts[3])
         lesson_index = int(parts[4])
-        await regenerate_lesson_item(query, user_id, module_index, lesson_index, session, None)
+        await submit_generation_job(
+            query, user_id, "regen_lesson", f"{module_index}:{lesson_index}",
+            lambda markup: regenerate_lesson_item(
+                query, user_id, module_index, lesson_index, session, None, reply_markup=markup
+            )
+        )
     
     elif data.startswith("regen_lesson_custom_"):
         parts = data.split("_")
@@ -228,7 +333,12 @@ async def handle_callback(query_update: Update, context: ContextTypes.DEFAULT_TY
         module_index = int(parts[4])
         lesson_index = int(parts[5])
         custom_req = session.temp_data.get('custom_req')
-        await regenerate_lesson_item(query, user_id, module_index, lesson_index, session, custom_req)
+        await submit_generation_job(
+            query, user_id, "regen_lesson", f"{module_index}:{lesson_index}",
+            lambda markup: regenerate_lesson_item(
+                query, user_id, module_index, lesson_index, session, custom_req, reply_markup=markup
+            )
+        )
     
     # Навигация
     elif data == "back_to_lectures":
@@ -271,7 +381,8 @@ async def handle_callback(query_update: Update, context: ContextTypes.DEFAULT_TY
             [InlineKeyboardButton("📄 JSON", callback_data="export_json")],
             [InlineKeyboardButton("🌐 HTML", callback_data="export_html")],
             [InlineKeyboardButton("📝 Markdown", callback_data="export_md")],
-            [InlineKeyboardButton("📃 TXT", callback_data="export_txt")]
+            [InlineKeyboardButton("📃 TXT", callback_data="export_txt")],
+            [InlineKeyboardButton("🗜 Всё в ZIP", callback_data="export_zip")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
@@ -287,7 +398,7 @@ async def handle_callback(query_update: Update, context: ContextTypes.DEFAULT_TY
         export_format = parts[2]
         module_index = int(parts[3])
         
-        module_content = session.current_module_content
+        module_content = session.module_contents.get(module_index) or session.current_module_content
         
         if not module_content:
             await query.answer("❌ Контент не сгенерирован!")
@@ -295,30 +406,25 @@ async def handle_callback(query_update: Update, context: ContextTypes.DEFAULT_TY
         
         await query.answer("🔄 Создаю файл...")
         
-        course_exporter = get_course_exporter()
-        
-        if export_format == "json":
-            content_str = course_exporter.export_module_content_to_json(module_content)
-            filename = f"{module_content.module_title.replace(' ', '_')}_lectures.json"
-            caption = "📄 Контент модуля в JSON"
-        elif export_format == "html":
-            content_str = course_exporter.export_module_content_to_html(module_content)
-            filename = f"{module_content.module_title.replace(' ', '_')}_lectures.html"
-            caption = "🌐 Презентация лекций - откройте в браузере"
-        elif export_format == "md":
-            content_str = course_exporter.export_module_content_to_markdown(module_content)
-            filename = f"{module_content.module_title.replace(' ', '_')}_lectures.md"
-            caption = "📝 Лекции в Markdown"
-        elif export_format == "txt":
-            content_str = course_exporter.export_module_content_to_txt(module_content)
-            filename = f"{module_content.module_title.replace(' ', '_')}_lectures.txt"
-            caption = "📃 Лекции в TXT"
-        
-        await query.message.reply_document(
-            document=content_str.encode('utf-8'),
-            filename=filename,
-            caption=f"{caption}\n\nЛекций: {len(module_content.lectures)} • Слайдов: {module_content.total_slides}"
-        )
+        method_suffix, extension = EXPORT_FORMATS[export_format]
+        filename = f"{module_content.module_title.replace(' ', '_')}_lectures.{extension}"
+        caption = {
+            "json": "📄 Контент модуля в JSON",
+            "html": "🌐 Презентация лекций - откройте в браузере",
+            "md": "📝 Лекции в Markdown",
+            "txt": "📃 Лекции в TXT",
+        }[export_format]
+        try:
+            async with export_document(f"export_module_content_to_{method_suffix}", module_content) as document:
+                # PTB всё равно читает файл в память целиком (одна копия в UTF-8)
+                await query.message.reply_document(
+                    document=document.read(),
+                    filename=filename,
+                    caption=f"{caption}\n\nЛекций: {len(module_content.lectures)} • Слайдов: {module_content.total_slides}"
+                )
+        except ExportTimeout:
+            await query.message.reply_text(EXPORT_TIMEOUT_TEXT)
+            return
         
         await query.answer("✅ Файл отправлен!")
     
@@ -374,30 +480,24 @@ async def handle_callback(query_update: Update, context: ContextTypes.DEFAULT_TY
         
         await query.answer("🔄 Создаю файл...")
         
-        course_exporter = get_course_exporter()
-        
-        if export_format == "json":
-            content_str = course_exporter.export_lesson_content_to_json(lesson.detailed_content)
-            filename = f"{lesson.lesson_title.replace(' ', '_')}_detailed.json"
-            caption = "📄 Детальные материалы в JSON"
-        elif export_format == "html":
-            content_str = course_exporter.export_lesson_content_to_html(lesson.detailed_content)
-            filename = f"{lesson.lesson_title.replace(' ', '_')}_detailed.html"
-            caption = "🌐 Детальные материалы - откройте в браузере"
-        elif export_format == "md":
-            content_str = course_exporter.export_lesson_content_to_markdown(lesson.detailed_content)
-            filename = f"{lesson.lesson_title.replace(' ', '_')}_detailed.md"
-            caption = "📝 Детальные материалы в Markdown"
-        elif export_format == "txt":
-            content_str = course_exporter.export_lesson_content_to_txt(lesson.detailed_content)
-            filename = f"{lesson.lesson_title.replace(' ', '_')}_detailed.txt"
-            caption = "📃 Детальные материалы в TXT"
-        
-        await query.message.reply_document(
-            document=content_str.encode('utf-8'),
-            filename=filename,
-            caption=f"{caption}\n\nТем: {len(lesson.detailed_content.topics)} | ~{lesson.detailed_content.total_estimated_time_minutes} минут"
-        )
+        method_suffix, extension = EXPORT_FORMATS[export_format]
+        filename = f"{lesson.lesson_title.replace(' ', '_')}_detailed.{extension}"
+        caption = {
+            "json": "📄 Детальные материалы в JSON",
+            "html": "🌐 Детальные материалы - откройте в браузере",
+            "md": "📝 Детальные материалы в Markdown",
+            "txt": "📃 Детальные материалы в TXT",
+        }[export_format]
+        try:
+            async with export_document(f"export_lesson_content_to_{method_suffix}", lesson.detailed_content) as document:
+                await query.message.reply_document(
+                    document=document.read(),
+                    filename=filename,
+                    caption=f"{caption}\n\nТем: {len(lesson.detailed_content.topics)} | ~{lesson.detailed_content.total_estimated_time_minutes} минут"
+                )
+        except ExportTimeout:
+            await query.message.reply_text(EXPORT_TIMEOUT_TEXT)
+            return
         
         await query.edit_message_text(
             f"✅ <b>Файл отправлен!</b>\n\n"
@@ -408,6 +508,37 @@ async def handle_callback(query_update: Update, context: ContextTypes.DEFAULT_TY
         
         await query.answer("✅ Материалы отправлены!")
     
+    # Архив со всем контентом курса
+    elif data == "export_zip":
+        course = session.current_course
+        
+        await query.answer("🔄 Собираю архив...")
+        
+        archive = CourseArchive(course=course, module_contents=session.module_contents)
+        lessons_with_content = sum(
+            1 for module in course.modules for lesson in module.lessons if lesson.detailed_content
+        )
+        filename = f"{course.course_title.replace(' ', '_')}.zip"
+        try:
+            async with export_document("export_archive_to_zip", archive) as document:
+                await query.message.reply_document(
+                    document=document.read(),
+                    filename=filename,
+                    caption=(
+                        f"🗜 Курс во всех форматах (JSON, HTML, Markdown, TXT)\n\n"
+                        f"Лекции модулей: {len(archive.module_contents)} • Материалы уроков: {lessons_with_content}"
+                    )
+                )
+        except ExportTimeout:
+            await query.message.reply_text(EXPORT_TIMEOUT_TEXT)
+            return
+        
+        await query.edit_message_text(
+            f"✅ <b>Архив отправлен!</b>\n\n"
+            f"Файл: {filename}",
+            parse_mode="HTML"
+        )
+    
     # Экспорт курса
     elif data.startswith("export_"):
         export_format = data.split("_")[1]
@@ -415,30 +546,24 @@ async def handle_callback(query_update: Update, context: ContextTypes.DEFAULT_TY
         
         await query.answer("🔄 Генерирую файл...")
         
-        course_exporter = get_course_exporter()
-        
-        if export_format == "json":
-            content = course_exporter.export_to_json(course)
-            filename = f"{course.course_title.replace(' ', '_')}.json"
-            caption = "📄 Курс в JSON формате"
-        elif export_format == "html":
-            content = course_exporter.export_to_html(course)
-            filename = f"{course.course_title.replace(' ', '_')}.html"
-            caption = "🌐 Курс в HTML формате - откройте в браузере"
-        elif export_format == "md":
-            content = course_exporter.export_to_markdown(course)
-            filename = f"{course.course_title.replace(' ', '_')}.md"
-            caption = "📝 Курс в Markdown формате"
-        elif export_format == "txt":
-            content = course_exporter.export_to_txt(course)
-            filename = f"{course.course_title.replace(' ', '_')}.txt"
-            caption = "📃 Курс в TXT формате"
-        
-        await query.message.reply_document(
-            document=content.encode('utf-8'),
-            filename=filename,
-            caption=caption
-        )
+        method_suffix, extension = EXPORT_FORMATS[export_format]
+        filename = f"{course.course_title.replace(' ', '_')}.{extension}"
+        caption = {
+            "json": "📄 Курс в JSON формате",
+            "html": "🌐 Курс в HTML формате - откройте в браузере",
+            "md": "📝 Курс в Markdown формате",
+            "txt": "📃 Курс в TXT формате",
+        }[export_format]
+        try:
+            async with export_document(f"export_to_{method_suffix}", course) as document:
+                await query.message.reply_document(
+                    document=document.read(),
+                    filename=filename,
+                    caption=caption
+                )
+        except ExportTimeout:
+            await query.message.reply_text(EXPORT_TIMEOUT_TEXT)
+            return
         
         await query.edit_message_text(
             f"✅ <b>Файл отправлен!</b>\n\n"
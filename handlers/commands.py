@@ -4,7 +4,10 @@ import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
-from utils import get_session_manager, format_course_info
+from utils import get_session_manager, format_course_info, format_pipeline_progress, ProgressMessage
+from course_pipeline import CoursePipeline
+from .callback_helpers import get_content_generator
+from .jobs import submit_message_job
 
 logger = logging.getLogger(__name__)
 
@@ -27,7 +30,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/generate - создать лекции и слайды\n"
         "/regenerate - перегенерировать лекции/слайды\n"
         "/regenerate_lesson - перегенерировать уроки\n"
-        "/generate_topics - детальные материалы по темам\n\n"
+        "/generate_topics - детальные материалы по темам\n"
+        "/generate_all - сгенерировать весь курс целиком\n"
+        "/jobs - задачи генерации (статус, отмена)\n\n"
         "<b>Экспорт:</b>\n"
         "/export - экспортировать курс (JSON/HTML/MD/TXT)\n\n"
         "/help - подробная справка",
@@ -54,6 +59,8 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "<b>/regenerate</b> - Перегенерировать лекции и слайды\n\n"
         "<b>/regenerate_lesson</b> - Перегенерировать отдельный урок модуля\n\n"
         "<b>/generate_topics</b> - Сгенерировать детальные учебные материалы по каждому пункту плана урока\n\n"
+        "<b>/generate_all</b> - Сгенерировать весь курс: лекции всех модулей и материалы всех уроков\n\n"
+        "<b>/jobs</b> - Показать выполняющиеся и недавние задачи генерации, отменить задачу\n\n"
         "<b>/export</b> - Экспортировать в JSON/HTML/Markdown/TXT\n\n"
         "<b>Пример:</b>\n"
         "Создай курс по Python для junior",
@@ -280,6 +287,64 @@ async def generate_topics(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(text, parse_mode="HTML", reply_markup=reply_markup)
 
 
+async def generate_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Генерация всего контента курса: лекции всех модулей и материалы всех уроков"""
+    user_id = update.effective_user.id
+    session_manager = get_session_manager()
+    
+    if not session_manager.has_session(user_id):
+        await update.message.reply_text("❌ У вас нет курса. Используйте /create")
+        return
+    
+    session = session_manager.get_session(user_id)
+    if not session.current_course:
+        await update.message.reply_text("❌ У вас нет курса. Используйте /create")
+        return
+    
+    course = session.current_course
+    
+    message = await update.message.reply_text(
+        f"⏳ Запускаем генерацию курса <b>{course.course_title}</b>...",
+        parse_mode="HTML"
+    )
+    
+    async def run(cancel_markup):
+        progress = ProgressMessage(message)
+        
+        async def on_progress(pipeline: CoursePipeline):
+            await progress.update(
+                format_pipeline_progress(pipeline.stats(), course.course_title),
+                reply_markup=cancel_markup
+            )
+        
+        pipeline = CoursePipeline(session, get_content_generator(), on_progress=on_progress)
+        await progress.update(
+            format_pipeline_progress(pipeline.stats(), course.course_title),
+            force=True,
+            reply_markup=cancel_markup
+        )
+        
+        stats = await pipeline.run()
+        
+        keyboard = []
+        for module_index in sorted(session.module_contents):
+            keyboard.append([InlineKeyboardButton(
+                f"🌐 Лекции модуля {module_index + 1} (HTML)",
+                callback_data=f"export_mcontent_html_{module_index}"
+            )])
+        keyboard.append([InlineKeyboardButton("📦 Экспорт курса", callback_data="export_now")])
+        keyboard.append([InlineKeyboardButton("👁️ Просмотреть курс", callback_data="back_to_course")])
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await progress.update(
+            format_pipeline_progress(stats, course.course_title, finished=True),
+            force=True,
+            reply_markup=reply_markup
+        )
+    
+    await submit_message_job(message, user_id, "generate_all", "course", run, new_message=True)
+
+
 async def export_course(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Экспорт курса - выбор формата"""
     user_id = update.effective_user.id
@@ -298,7 +363,8 @@ async def export_course(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton("📄 JSON - для программ", callback_data="export_json")],
         [InlineKeyboardButton("🌐 HTML - красивая веб-страница", callback_data="export_html")],
         [InlineKeyboardButton("📝 Markdown - для редакторов", callback_data="export_md")],
-        [InlineKeyboardButton("📃 TXT - простой текст", callback_data="export_txt")]
+        [InlineKeyboardButton("📃 TXT - простой текст", callback_data="export_txt")],
+        [InlineKeyboardButton("🗜 ZIP - всё во всех форматах", callback_data="export_zip")]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
@@ -307,7 +373,8 @@ async def export_course(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "• <b>JSON</b> - для импорта в другие программы\n"
         "• <b>HTML</b> - красивая веб-страница для просмотра\n"
         "• <b>Markdown</b> - для редактирования в Notion, Obsidian\n"
-        "• <b>TXT</b> - простой текстовый файл",
+        "• <b>TXT</b> - простой текстовый файл\n"
+        "• <b>ZIP</b> - курс, лекции модулей и материалы уроков во всех форматах одним архивом",
         parse_mode="HTML",
         reply_markup=reply_markup
     )
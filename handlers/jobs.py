@@ -0,0 +1,198 @@
+"""Запуск генерации в фоновых задачах, список и отмена задач"""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes
+
+from job_manager import Job, get_job_manager, STATUS_QUEUED, STATUS_RUNNING
+from utils import get_session_manager, get_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# Названия действий для пользователя
+JOB_ACTION_LABELS = {
+    "module_content": "Лекции модуля",
+    "lesson_topics": "Материалы урока",
+    "regen_lecture": "Перегенерация лекции",
+    "patch_lecture": "Правка лекции",
+    "regen_slide": "Перегенерация слайда",
+    "regen_slides": "Перегенерация выбранных слайдов",
+    "regen_lesson": "Перегенерация урока",
+    "generate_all": "Генерация всего курса",
+}
+
+JOB_STATUS_LABELS = {
+    "queued": "⏳ в очереди",
+    "running": "⚙️ выполняется",
+    "done": "✅ готово",
+    "failed": "❌ ошибка",
+    "cancelled": "🛑 отменена",
+    "interrupted": "⚠️ прервана перезапуском",
+}
+
+
+class GenerationFailed(Exception):
+    """
+    Генерация не удалась, пользователь уже получил сообщение об ошибке
+
+    Обработчики генерации поднимают её, чтобы JobManager повторил
+    задачу или отметил её как failed.
+    """
+
+
+def cancel_job_markup(job_id: int) -> InlineKeyboardMarkup:
+    """Кнопка отмены задачи"""
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("✖️ Отменить", callback_data=f"cancel_job_{job_id}")
+    ]])
+
+
+async def submit_generation_job(query, user_id: int, action: str, target: str,
+                                run: Callable[[Optional[InlineKeyboardMarkup]], Awaitable[None]]):
+    """
+    Запускает генерацию по нажатию кнопки как фоновую задачу
+
+    Если такая же генерация уже идёт, новая не создаётся - пользователь
+    получает номер выполняющейся задачи.
+
+    Args:
+        action: Тип генерации (ключ JOB_ACTION_LABELS)
+        target: Что генерируем (индексы модуля/урока/лекции)
+        run: Корутина генерации, получает кнопку отмены для промежуточных сообщений
+    """
+    await submit_message_job(query.message, user_id, action, target, run)
+
+
+async def submit_message_job(message, user_id: int, action: str, target: str,
+                             run: Callable[[Optional[InlineKeyboardMarkup]], Awaitable[None]],
+                             new_message: bool = False):
+    """
+    Запускает генерацию как фоновую задачу, статус которой показывается в message
+
+    Args:
+        new_message: message только что отправлен для этой задачи (команда) - если
+            такая генерация уже идёт, об этом сообщается в нём же, а не ответом
+    """
+    job_manager = get_job_manager()
+    notice_sent = asyncio.Event()
+
+    async def job_run(job: Job):
+        # Сначала сообщение "в очереди", затем сообщения самой генерации
+        await notice_sent.wait()
+        try:
+            await run(cancel_job_markup(job.id))
+        except Exception:
+            if job.attempts < job.max_attempts:
+                await _show_retry_notice(message, job)
+            raise
+        # Обработчик апдейта уже завершился - сохраняем результат сами
+        await get_session_manager().persist_async(user_id)
+
+    async def on_cancel(job: Job):
+        await message.edit_text(
+            "🛑 Генерация отменена",
+            reply_markup=InlineKeyboardMarkup([[
+                InlineKeyboardButton("🔙 К курсу", callback_data="back_to_course")
+            ]])
+        )
+
+    job, created = await job_manager.submit(
+        user_id, action, target, job_run, on_cancel,
+        meta={"message_id": message.message_id}
+    )
+
+    if not created:
+        notice = (f"⏳ Эта генерация уже выполняется (задача #{job.id}).\n"
+                  f"Результат появится в исходном сообщении. Статус: /jobs")
+        if new_message:
+            await message.edit_text(notice)
+        else:
+            await message.reply_text(notice)
+        return
+
+    try:
+        if job_manager.running_count >= job_manager.workers:
+            await message.edit_text(
+                f"⏳ <b>Задача #{job.id} в очереди</b>\n\n"
+                f"{JOB_ACTION_LABELS.get(action, action)}\n"
+                f"Задач в очереди: {job_manager.queue_depth}",
+                parse_mode="HTML",
+                reply_markup=cancel_job_markup(job.id)
+            )
+    except Exception as e:
+        logger.warning(f"Не удалось показать статус задачи #{job.id}: {e}")
+    finally:
+        notice_sent.set()
+
+
+async def _show_retry_notice(message, job: Job):
+    """Сообщение об ошибке попытки, после которой JobManager повторит задачу"""
+    try:
+        await message.edit_text(
+            f"⚠️ Не удалось: {JOB_ACTION_LABELS.get(job.action, job.action)}\n\n"
+            f"🔁 Повторяем, попытка {job.attempts + 1} из {job.max_attempts}...",
+            reply_markup=cancel_job_markup(job.id)
+        )
+    except Exception as e:
+        logger.warning(f"Не удалось показать повтор задачи #{job.id}: {e}")
+
+
+async def cancel_job(query, user_id: int, job_id: int):
+    """Отменяет задачу по кнопке"""
+    job = get_job_manager().get_job(job_id)
+    if not await get_job_manager().cancel(job_id, user_id):
+        await query.message.reply_text(f"ℹ️ Задача #{job_id} уже завершена")
+        return
+
+    # Кнопка нажата не в сообщении генерации (например, в /jobs)
+    if job is not None and job.meta.get("message_id") != query.message.message_id:
+        await query.message.reply_text(f"🛑 Задача #{job_id} отменена")
+
+
+def _format_job(job: Job) -> str:
+    label = JOB_ACTION_LABELS.get(job.action, job.action)
+    status = JOB_STATUS_LABELS.get(job.status, job.status)
+    text = f"#{job.id} {label} ({job.target}) - {status}"
+    if job.status == STATUS_RUNNING and job.started_at:
+        text += f", {int(time.time() - job.started_at)} с"
+    if job.attempts > 1:
+        text += f", попытка {job.attempts}"
+    return text
+
+
+async def show_jobs(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /jobs - задачи генерации пользователя"""
+    user_id = update.effective_user.id
+    job_manager = get_job_manager()
+
+    active = job_manager.active_jobs(user_id)
+    active_ids = {job.id for job in active}
+    recent = [job for job in await job_manager.recent_jobs(user_id, limit=10) if job.id not in active_ids]
+
+    text = "🧵 <b>Задачи генерации</b>\n\n"
+    if active:
+        text += "<b>Активные:</b>\n"
+        text += "\n".join(_format_job(job) for job in active) + "\n\n"
+    else:
+        text += "Активных задач нет.\n\n"
+
+    if recent:
+        text += "<b>Недавние:</b>\n"
+        text += "\n".join(_format_job(job) for job in recent[:5]) + "\n\n"
+
+    text += f"Очередь: {job_manager.queue_depth}, выполняется: {job_manager.running_count}"
+    openai_queue = get_rate_limiter().queue_depth
+    if openai_queue:
+        text += f"\nЗапросов к OpenAI в ожидании лимита: {openai_queue}"
+
+    keyboard = [
+        [InlineKeyboardButton(f"✖️ Отменить #{job.id}", callback_data=f"cancel_job_{job.id}")]
+        for job in active if job.status in (STATUS_QUEUED, STATUS_RUNNING)
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
+
+    await update.message.reply_text(text, parse_mode="HTML", reply_markup=reply_markup)
@@ -6,21 +6,10 @@ from telegram.ext import ContextTypes
 
 from models import Course
 from utils import get_session_manager
-from openai_client import OpenAIClient
+from openai_client import get_async_openai_client
 
 logger = logging.getLogger(__name__)
 
-# Глобальная переменная для клиента (ленивая инициализация)
-_openai_client = None
-
-
-def get_openai_client():
-    """Получает или создаёт экземпляр OpenAIClient"""
-    global _openai_client
-    if _openai_client is None:
-        _openai_client = OpenAIClient()
-    return _openai_client
-
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка текстовых сообщений"""
@@ -119,6 +108,28 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup = InlineKeyboardMarkup(keyboard)
         await update.message.reply_text("Нажмите для запуска:", reply_markup=reply_markup)
     
+    # Обработка точечной правки лекции
+    elif session.editing_path and session.editing_path.startswith("patch_lecture_custom_"):
+        lecture_index = int(session.editing_path.split("_")[3])
+        custom_requirements = update.message.text
+        session.editing_mode = False
+        session.editing_path = None
+        
+        await update.message.reply_text(
+            f"✅ <b>Требования получены!</b>\n\n"
+            f"🤖 Правлю лекцию с учётом:\n{custom_requirements[:200]}\n\n"
+            f"⏳ Это займёт 10-20 секунд...",
+            parse_mode="HTML"
+        )
+        
+        session.temp_data['custom_req'] = custom_requirements
+        session.temp_data['regen_type'] = 'lecture_patch'
+        session.temp_data['lecture_idx'] = lecture_index
+        
+        keyboard = [[InlineKeyboardButton("▶️ Начать правку", callback_data=f"start_patch_lecture_{lecture_index}")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await update.message.reply_text("Нажмите для запуска:", reply_markup=reply_markup)
+    
     # Обработка редактирования названия модуля
     elif session.editing_path and session.editing_path.startswith("edit_module_name_"):
         module_index = int(session.editing_path.split("_")[3])
@@ -207,8 +218,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("🔄 Генерирую курс... Подождите немного...")
             
             # Генерируем курс
-            openai_client = get_openai_client()
-            course_data = openai_client.generate_course_structure(
+            openai_client = get_async_openai_client()
+            course_data = await openai_client.generate_course_structure(
                 topic=session.temp_data['topic'],
                 audience_level=session.temp_data['level'],
                 module_count=session.temp_data['module_count'],
@@ -220,6 +231,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 try:
                     course = Course(**course_data)
                     session.current_course = course
+                    # Контент модулей относится к прежнему курсу
+                    session.module_contents = {}
+                    session.current_module_content = None
                     session.editing_mode = False
                     
                     # Показываем результат
@@ -0,0 +1,52 @@
+"""Загрузка сессий перед обработкой апдейтов и их сохранение после обработки"""
+
+import logging
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from job_manager import get_job_manager
+from utils import get_session_manager
+
+logger = logging.getLogger(__name__)
+
+
+async def persist_session(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Сохраняет изменённые части сессии пользователя
+
+    Регистрируется в отдельной группе обработчиков и выполняется
+    после основного обработчика апдейта.
+    """
+    if not update.effective_user:
+        return
+
+    try:
+        await get_session_manager().persist_async(update.effective_user.id)
+    except Exception as e:
+        logger.error(f"❌ Ошибка сохранения сессии {update.effective_user.id}: {e}")
+
+
+async def load_session(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Готовит сессию пользователя к обработке апдейта
+
+    Регистрируется в группе перед основными обработчиками. Если
+    хранилище сессий общее для нескольких процессов бота, сессия
+    перечитывается, когда её изменил другой процесс; пока у
+    пользователя выполняется задача генерации в этом процессе, сессия
+    не сбрасывается - задача запишет в неё результат. Затем сессия
+    загружается в память с чтением хранилища в отдельном потоке, и
+    get_session в обработчиках не обращается к хранилищу в event loop.
+    """
+    if not update.effective_user:
+        return
+
+    user_id = update.effective_user.id
+    session_manager = get_session_manager()
+    try:
+        if session_manager.shared and not get_job_manager().active_jobs(user_id):
+            await session_manager.refresh(user_id)
+        await session_manager.load_async(user_id)
+    except Exception as e:
+        logger.error(f"❌ Ошибка загрузки сессии {user_id}: {e}")
@@ -0,0 +1,478 @@
+"""
+Фоновые задачи генерации
+
+Пул asyncio-воркеров с очередью и таблицей задач в SQLite.
+Повторное нажатие той же кнопки присоединяется к уже выполняющейся
+задаче (ключ идемпотентности пользователь:действие:цель), упавшие
+задачи перезапускаются с экспоненциальной задержкой, любую задачу
+можно отменить.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Количество воркеров, выполняющих задачи одновременно
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '8'))
+
+# Сколько раз пробовать выполнить задачу
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+
+# Базовая задержка перед повтором (секунды), удваивается с каждой попыткой
+JOB_RETRY_BASE_DELAY = float(os.getenv('JOB_RETRY_BASE_DELAY', '2'))
+
+# Путь к файлу SQLite с задачами
+JOBS_DB_PATH = os.getenv('JOBS_DB_PATH', 'jobs.sqlite3')
+
+# Владелец задач в общей таблице: номер процесса-воркера бота (см. BOT_WORKERS)
+JOB_OWNER = f"worker-{os.getenv('BOT_WORKER_ID', '0')}"
+
+# Как часто проверять отмену задач, запрошенную из другого процесса (секунды)
+JOB_CANCEL_POLL_INTERVAL = float(os.getenv('JOB_CANCEL_POLL_INTERVAL', '1'))
+
+# Статусы задач
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+STATUS_INTERRUPTED = "interrupted"  # Процесс перезапущен во время выполнения
+
+ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+
+class Job:
+    """Задача генерации"""
+
+    def __init__(self, user_id: int, action: str, target: str,
+                 run: Optional[Callable[["Job"], Awaitable[Any]]] = None,
+                 on_cancel: Optional[Callable[["Job"], Awaitable[None]]] = None,
+                 max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.id: Optional[int] = None
+        self.user_id = user_id
+        self.action = action
+        self.target = target
+        self.run = run
+        self.on_cancel = on_cancel
+        self.max_attempts = max_attempts
+        self.meta: Dict[str, Any] = {}  # Произвольные данные вызывающей стороны
+
+        self.status = STATUS_QUEUED
+        self.attempts = 0
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+        self.cancel_requested = False
+        self._task: Optional[asyncio.Task] = None
+        self._done: Optional[asyncio.Event] = None
+
+    @property
+    def key(self) -> str:
+        """Ключ идемпотентности"""
+        return make_job_key(self.user_id, self.action, self.target)
+
+    @property
+    def is_active(self) -> bool:
+        return self.status in ACTIVE_STATUSES
+
+    async def wait(self):
+        """Ждёт завершения задачи"""
+        if self._done is not None:
+            await self._done.wait()
+
+
+def make_job_key(user_id: int, action: str, target: str) -> str:
+    """Ключ идемпотентности задачи"""
+    return f"{user_id}:{action}:{target}"
+
+
+class JobStore:
+    """
+    Таблица задач в SQLite
+
+    Таблица может быть общей для нескольких процессов бота: у каждой
+    задачи есть владелец (процесс, который её выполняет).
+    """
+
+    def __init__(self, path: str = JOBS_DB_PATH, owner: str = JOB_OWNER):
+        self.path = path
+        self.owner = owner
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                action TEXT NOT NULL,
+                target TEXT NOT NULL,
+                job_key TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )"""
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "owner" not in columns:
+            # Задачи, созданные до появления колонки, принадлежат единственному процессу
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT NOT NULL DEFAULT 'worker-0'")
+        if "cancel_requested" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0")
+        # Не больше одной активной задачи на ключ (в том числе между процессами)
+        self._conn.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active_key ON jobs(job_key) "
+            "WHERE status IN ('queued', 'running')"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs(user_id, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_owner ON jobs(owner, status)")
+        self._conn.commit()
+
+    def insert(self, job: Job) -> bool:
+        """Сохраняет новую задачу (False, если активная задача с таким ключом уже есть)"""
+        with self._lock:
+            try:
+                with self._conn:
+                    cursor = self._conn.execute(
+                        "INSERT INTO jobs (user_id, action, target, job_key, status, created_at, owner) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (job.user_id, job.action, job.target, job.key, job.status, job.created_at, self.owner)
+                    )
+            except sqlite3.IntegrityError:
+                return False
+        job.id = cursor.lastrowid
+        return True
+
+    def update(self, job: Job):
+        """Сохраняет статус задачи"""
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = ?, error = ?, started_at = ?, finished_at = ? "
+                    "WHERE id = ?",
+                    (job.status, job.attempts, job.error, job.started_at, job.finished_at, job.id)
+                )
+
+    def find_active(self, key: str) -> Optional[Job]:
+        """Активная задача по ключу"""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {self._COLUMNS} FROM jobs WHERE job_key = ? AND status IN ('queued', 'running')",
+                (key,)
+            ).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def list_for_user(self, user_id: int, limit: int = 10) -> List[Job]:
+        """Последние задачи пользователя"""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {self._COLUMNS} FROM jobs WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+                (user_id, limit)
+            ).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def interrupt_active(self) -> int:
+        """Помечает активные задачи этого владельца прерванными (при старте процесса)"""
+        with self._lock:
+            with self._conn:
+                cursor = self._conn.execute(
+                    "UPDATE jobs SET status = ?, finished_at = ? "
+                    "WHERE owner = ? AND status IN ('queued', 'running')",
+                    (STATUS_INTERRUPTED, time.time(), self.owner)
+                )
+        return cursor.rowcount
+
+    def request_cancel(self, job_id: int, user_id: int) -> bool:
+        """Запрашивает отмену активной задачи, выполняющейся в другом процессе"""
+        with self._lock:
+            with self._conn:
+                cursor = self._conn.execute(
+                    "UPDATE jobs SET cancel_requested = 1 "
+                    "WHERE id = ? AND user_id = ? AND status IN ('queued', 'running')",
+                    (job_id, user_id)
+                )
+        return cursor.rowcount > 0
+
+    def cancel_requested_ids(self) -> List[int]:
+        """Задачи этого владельца, отмену которых запросил другой процесс"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE owner = ? AND cancel_requested = 1 "
+                "AND status IN ('queued', 'running')",
+                (self.owner,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    _COLUMNS = "id, user_id, action, target, status, attempts, error, created_at, started_at, finished_at"
+
+    @staticmethod
+    def _row_to_job(row) -> Job:
+        job = Job(user_id=row[1], action=row[2], target=row[3])
+        job.id = row[0]
+        job.status = row[4]
+        job.attempts = row[5]
+        job.error = row[6]
+        job.created_at = row[7]
+        job.started_at = row[8]
+        job.finished_at = row[9]
+        return job
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JobManager:
+    """
+    Очередь задач и пул воркеров
+
+    Сама задача (корутина) живёт только в памяти процесса, в SQLite
+    хранятся её статус и история. Задачи, активные на момент
+    перезапуска, помечаются как interrupted. Если таблица общая для
+    нескольких процессов, отмена задачи другого процесса передаётся
+    через таблицу и подхватывается владельцем.
+    """
+
+    def __init__(self, store: Optional[JobStore] = None, workers: int = JOB_WORKERS,
+                 retry_base_delay: float = JOB_RETRY_BASE_DELAY):
+        self.store = store or JobStore()
+        self.workers = workers
+        self.retry_base_delay = retry_base_delay
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._cancel_poller: Optional[asyncio.Task] = None
+        self._retries: set = set()
+        self._jobs: Dict[int, Job] = {}
+        self._active_keys: Dict[str, Job] = {}
+
+    @property
+    def started(self) -> bool:
+        return bool(self._workers)
+
+    async def start(self):
+        """Запускает воркеров"""
+        if self.started:
+            return
+        interrupted = await asyncio.to_thread(self.store.interrupt_active)
+        if interrupted:
+            logger.warning(f"⚠️ Прервано перезапуском задач: {interrupted}")
+
+        self._queue = asyncio.Queue()
+        self._workers = [
+            asyncio.create_task(self._worker(index), name=f"job-worker-{index}")
+            for index in range(self.workers)
+        ]
+        if JOB_CANCEL_POLL_INTERVAL > 0:
+            self._cancel_poller = asyncio.create_task(self._poll_cancel_requests(), name="job-cancel-poller")
+        logger.info(f"🧵 Очередь задач запущена: {self.workers} воркеров")
+
+    async def stop(self):
+        """Останавливает воркеров, активные задачи помечаются прерванными"""
+        pollers = [self._cancel_poller] if self._cancel_poller else []
+        for task in self._workers + list(self._retries) + pollers:
+            task.cancel()
+        await asyncio.gather(*self._workers, *self._retries, *pollers, return_exceptions=True)
+        self._workers = []
+        self._cancel_poller = None
+        self._retries.clear()
+
+        for job in list(self._active_keys.values()):
+            await self._finish(job, STATUS_INTERRUPTED)
+
+    async def submit(self, user_id: int, action: str, target: str,
+                     run: Callable[[Job], Awaitable[Any]],
+                     on_cancel: Optional[Callable[[Job], Awaitable[None]]] = None,
+                     meta: Optional[Dict[str, Any]] = None) -> Tuple[Job, bool]:
+        """
+        Ставит задачу в очередь
+
+        Args:
+            run: Корутина-фабрика, получает Job (например, для кнопки отмены)
+            on_cancel: Вызывается после отмены задачи
+            meta: Данные вызывающей стороны (сохраняются в job.meta)
+
+        Returns:
+            (задача, создана ли новая). Если такая задача уже выполняется,
+            возвращается она и False.
+        """
+        if not self.started:
+            await self.start()
+
+        key = make_job_key(user_id, action, target)
+        existing = self._active_keys.get(key)
+        if existing is not None:
+            logger.info(f"🔁 Задача {key} уже выполняется (#{existing.id}), присоединяемся")
+            return existing, False
+
+        job = Job(user_id, action, target, run=run, on_cancel=on_cancel)
+        job.meta.update(meta or {})
+        if not await asyncio.to_thread(self.store.insert, job):
+            # Активная задача с таким ключом есть в другом процессе
+            existing = await asyncio.to_thread(self.store.find_active, key)
+            if existing is not None:
+                return existing, False
+            raise RuntimeError(f"Не удалось создать задачу {key}")
+
+        job._done = asyncio.Event()
+        self._jobs[job.id] = job
+        self._active_keys[key] = job
+        self._queue.put_nowait(job)
+        logger.info(f"📥 Задача #{job.id} {key} в очереди (длина очереди: {self.queue_depth})")
+        return job, True
+
+    async def cancel(self, job_id: int, user_id: int) -> bool:
+        """Отменяет задачу пользователя (True, если задача была активна)"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            # Задача другого процесса: владелец отменит её при следующей проверке
+            return await asyncio.to_thread(self.store.request_cancel, job_id, user_id)
+        if job.user_id != user_id or not job.is_active:
+            return False
+        return await self._cancel(job)
+
+    async def _cancel(self, job: Job) -> bool:
+        job.cancel_requested = True
+        if job.status == STATUS_RUNNING and job._task is not None:
+            job._task.cancel()
+        else:
+            # В очереди или ждёт повтора - воркер её пропустит
+            await self._finish(job, STATUS_CANCELLED)
+        return True
+
+    def get_job(self, job_id: int) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def active_jobs(self, user_id: int) -> List[Job]:
+        """Активные задачи пользователя в этом процессе"""
+        return [job for job in self._active_keys.values() if job.user_id == user_id]
+
+    async def recent_jobs(self, user_id: int, limit: int = 10) -> List[Job]:
+        """Последние задачи пользователя из таблицы"""
+        return await asyncio.to_thread(self.store.list_for_user, user_id, limit)
+
+    @property
+    def running_count(self) -> int:
+        """Количество выполняющихся задач"""
+        return sum(1 for job in self._active_keys.values() if job.status == STATUS_RUNNING)
+
+    @property
+    def queue_depth(self) -> int:
+        """Количество задач, ожидающих воркера"""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _worker(self, index: int):
+        while True:
+            job = await self._queue.get()
+            try:
+                if job.is_active and not job.cancel_requested:
+                    await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Воркер {index}: ошибка обработки задачи #{job.id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: Job):
+        """Одна попытка выполнения задачи"""
+        job.status = STATUS_RUNNING
+        job.attempts += 1
+        job.started_at = job.started_at or time.time()
+        await asyncio.to_thread(self.store.update, job)
+        if job.cancel_requested or not job.is_active:
+            # Отменена, пока сохранялся статус: задачи ещё нет, _cancel уже завершил её
+            logger.info(f"🛑 Задача #{job.id} отменена до запуска")
+            return
+        logger.info(f"▶️ Задача #{job.id} {job.key}: попытка {job.attempts}/{job.max_attempts}")
+
+        job._task = asyncio.create_task(job.run(job))
+        try:
+            await job._task
+        except asyncio.CancelledError:
+            if not job.cancel_requested:
+                raise
+            logger.info(f"🛑 Задача #{job.id} отменена")
+            await self._finish(job, STATUS_CANCELLED)
+            if job.on_cancel:
+                try:
+                    await job.on_cancel(job)
+                except Exception as e:
+                    logger.warning(f"Ошибка обработчика отмены задачи #{job.id}: {e}")
+            return
+        except Exception as e:
+            job.error = str(e)
+            if job.attempts < job.max_attempts:
+                delay = self.retry_base_delay * 2 ** (job.attempts - 1)
+                logger.warning(f"⚠️ Задача #{job.id} упала ({e}), повтор через {delay:.0f} с")
+                job.status = STATUS_QUEUED
+                await asyncio.to_thread(self.store.update, job)
+                retry = asyncio.create_task(self._requeue_later(job, delay))
+                self._retries.add(retry)
+                retry.add_done_callback(self._retries.discard)
+            else:
+                logger.error(f"❌ Задача #{job.id} не выполнена после {job.attempts} попыток: {e}")
+                await self._finish(job, STATUS_FAILED)
+            return
+        finally:
+            job._task = None
+
+        job.error = None
+        await self._finish(job, STATUS_DONE)
+        logger.info(f"✅ Задача #{job.id} выполнена за {job.finished_at - job.started_at:.1f} с")
+
+    async def _poll_cancel_requests(self):
+        """Отмена задач, запрошенная другими процессами через таблицу"""
+        while True:
+            await asyncio.sleep(JOB_CANCEL_POLL_INTERVAL)
+            if not self._active_keys:
+                continue
+            try:
+                job_ids = await asyncio.to_thread(self.store.cancel_requested_ids)
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось проверить запросы отмены задач: {e}")
+                continue
+            for job_id in job_ids:
+                job = self._jobs.get(job_id)
+                if job is not None and job.is_active and not job.cancel_requested:
+                    logger.info(f"🛑 Отмена задачи #{job_id} запрошена другим процессом")
+                    await self._cancel(job)
+
+    async def _requeue_later(self, job: Job, delay: float):
+        await asyncio.sleep(delay)
+        if job.is_active and not job.cancel_requested:
+            self._queue.put_nowait(job)
+
+    async def _finish(self, job: Job, status: str):
+        """Переводит задачу в конечный статус"""
+        job.status = status
+        job.finished_at = time.time()
+        self._active_keys.pop(job.key, None)
+        self._jobs.pop(job.id, None)
+        if job._done is not None:
+            job._done.set()
+        try:
+            await asyncio.to_thread(self.store.update, job)
+        except Exception as e:
+            logger.error(f"❌ Не удалось сохранить статус задачи #{job.id}: {e}")
+
+
+# Глобальный экземпляр менеджера задач
+_job_manager: Optional[JobManager] = None
+
+
+def get_job_manager() -> JobManager:
+    """Получает глобальный экземпляр JobManager"""
+    global _job_manager
+    if _job_manager is None:
+        _job_manager = JobManager()
+    return _job_manager
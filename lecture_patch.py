@@ -0,0 +1,177 @@
+"""
+Точечная правка лекции патчем
+
+Вместо новой лекции целиком модель получает текущие слайды с
+идентификаторами (s1, s2, ...) и возвращает только операции над ними:
+замену, вставку, удаление и перестановку слайдов. Неизменённые слайды
+остаются как есть, а ответ модели короче в разы.
+"""
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from pydantic import ValidationError
+
+from models import Lecture, Slide
+from utils.metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+PATCH_OPERATIONS = ("replace", "insert", "delete", "move")
+
+# Слайд в операции патча (slide_number выставляется при применении)
+_PATCH_SLIDE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "content": {"type": "string"},
+        "slide_type": {"type": "string"},
+        "code_example": {"type": ["string", "null"]},
+        "notes": {"type": "string"}
+    },
+    "required": ["title", "content", "slide_type", "notes"]
+}
+
+# Функция для патча лекции (Function Calling)
+LECTURE_PATCH_TOOLS = [{
+    "type": "function",
+    "function": {
+        "name": "patch_lecture",
+        "description": "Изменяет лекцию операциями над слайдами; неизменённые слайды не передаются",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "operations": {
+                    "type": "array",
+                    "description": "Операции в порядке применения",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "op": {
+                                "type": "string",
+                                "enum": list(PATCH_OPERATIONS),
+                                "description": "replace - заменить слайд, insert - вставить новый, "
+                                               "delete - удалить, move - переставить"
+                            },
+                            "slide_id": {
+                                "type": "string",
+                                "description": "Слайд для replace, delete и move"
+                            },
+                            "after_id": {
+                                "type": ["string", "null"],
+                                "description": "Для insert и move: после какого слайда; null - в начало лекции"
+                            },
+                            "slide": _PATCH_SLIDE_SCHEMA
+                        },
+                        "required": ["op"]
+                    }
+                }
+            },
+            "required": ["operations"]
+        }
+    }
+}]
+
+
+@dataclass
+class PatchResult:
+    """Итог применения патча"""
+    applied: List[str] = field(default_factory=list)  # Описания применённых операций
+    skipped: List[str] = field(default_factory=list)  # Операции, которые не удалось применить
+
+
+def slide_ids(lecture: Lecture) -> List[str]:
+    """Идентификаторы слайдов лекции в промпте патча"""
+    return [f"s{i + 1}" for i in range(len(lecture.slides))]
+
+
+def format_slides_for_patch(lecture: Lecture) -> str:
+    """Слайды лекции с идентификаторами для промпта"""
+    lines = []
+    for slide_id, slide in zip(slide_ids(lecture), lecture.slides):
+        lines.append(f"[{slide_id}] {slide.title} ({slide.slide_type})\n{slide.content}")
+        if slide.code_example:
+            lines.append(f"Код:\n{slide.code_example}")
+    return "\n\n".join(lines)
+
+
+def _parse_slide(data: Any) -> Slide:
+    if not isinstance(data, dict):
+        raise ValueError("нет данных слайда")
+    with get_metrics().validation_seconds.time(model="Slide"):
+        return Slide(**{**data, "slide_number": 0})
+
+
+def apply_lecture_patch(lecture: Lecture, operations: List[Dict[str, Any]]) -> PatchResult:
+    """
+    Применяет операции патча к слайдам лекции на месте
+
+    Идентификаторы в операциях - идентификаторы исходных слайдов
+    (slide_ids до применения). Операция с неизвестным слайдом или
+    невалидным слайдом пропускается, остальные применяются. После
+    применения слайды перенумеровываются по порядку.
+    """
+    result = PatchResult()
+    # Слайды с идентификаторами; у вставленных идентификатор None
+    slides: List[List[Any]] = [[slide_id, slide] for slide_id, slide in zip(slide_ids(lecture), lecture.slides)]
+
+    def position(slide_id: Optional[str]) -> Optional[int]:
+        for index, (current_id, _) in enumerate(slides):
+            if current_id is not None and current_id == slide_id:
+                return index
+        return None
+
+    def insert_position(after_id: Optional[str]) -> Optional[int]:
+        if after_id is None:
+            return 0
+        index = position(after_id)
+        return None if index is None else index + 1
+
+    for number, operation in enumerate(operations, 1):
+        if not isinstance(operation, dict):
+            operation = {}
+        op = operation.get("op")
+        label = f"{number}. {op} {operation.get('slide_id') or operation.get('after_id') or ''}".rstrip()
+        try:
+            if op == "replace":
+                index = position(operation.get("slide_id"))
+                if index is None:
+                    raise ValueError("неизвестный слайд")
+                slides[index][1] = _parse_slide(operation.get("slide"))
+            elif op == "insert":
+                index = insert_position(operation.get("after_id"))
+                if index is None:
+                    raise ValueError("неизвестный слайд в after_id")
+                slides.insert(index, [None, _parse_slide(operation.get("slide"))])
+            elif op == "delete":
+                index = position(operation.get("slide_id"))
+                if index is None:
+                    raise ValueError("неизвестный слайд")
+                slides.pop(index)
+            elif op == "move":
+                index = position(operation.get("slide_id"))
+                if index is None:
+                    raise ValueError("неизвестный слайд")
+                moved = slides.pop(index)
+                target = insert_position(operation.get("after_id"))
+                if target is None:
+                    slides.insert(index, moved)
+                    raise ValueError("неизвестный слайд в after_id")
+                slides.insert(target, moved)
+            else:
+                raise ValueError("неизвестная операция")
+        except (ValueError, ValidationError) as e:
+            logger.warning(f"⚠️ Операция патча {label} пропущена: {e}")
+            result.skipped.append(label)
+            continue
+        result.applied.append(label)
+
+    if not slides:
+        # Лекция без слайдов не сохраняется - патч целиком отклоняется
+        logger.warning("⚠️ Патч удаляет все слайды лекции, не применяется")
+        return PatchResult(skipped=result.applied + result.skipped)
+
+    lecture.slides = [
+        slide.copy(update={"slide_number": number}) for number, (_, slide) in enumerate(slides, 1)
+    ]
+    return result
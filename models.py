@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Union
 from enum import Enum
 
 class DifficultyLevel(str, Enum):
@@ -106,10 +106,19 @@ class ModuleContent(BaseModel):
     estimated_duration_minutes: int
 
 
+class CourseArchive(BaseModel):
+    """Курс со всем сгенерированным контентом (для экспорта одним архивом)"""
+    course: Course
+    module_contents: Dict[int, ModuleContent] = {}  # индекс модуля -> контент
+
+
 class UserSession(BaseModel):
+    __slots__ = ('__weakref__',)  # SessionManager отслеживает выгруженные сессии через weakref
+    
     user_id: int
     current_course: Optional[Course] = None
     current_module_content: Optional[ModuleContent] = None  # Контент модуля
+    module_contents: Dict[int, ModuleContent] = {}  # Контент всех модулей (индекс модуля -> контент)
     editing_mode: bool = False
     editing_path: Optional[str] = None  # JSON path for editing
     temp_data: dict = {}  # Временные данные для создания курса
@@ -1,6 +1,14 @@
 """
 Шаблоны промптов для генерации и перегенерации контента
+
+Длинные промпты разделены на статическую часть (инструкции и схема
+ответа) и переменный контекст, см. build_prompt_messages.
 """
+import os
+from typing import Dict, List, Optional
+
+# Компактная схема ответа: сигнатура полей вместо развёрнутого примера JSON
+PROMPT_COMPACT_SCHEMA = os.getenv('PROMPT_COMPACT_SCHEMA', '0') == '1'
 
 # ============================================================================
 # ПРОМПТ ДЛЯ ГЕНЕРАЦИИ СТРУКТУРЫ КУРСА
@@ -61,19 +69,12 @@ MODULE_CONTENT_SYSTEM_PROMPT = """Ты — эксперт по созданию
 НИКОГДА не возвращай структуру урока с полями lesson_title, lesson_goal, content_outline.
 Отвечаешь строго в указанном JSON формате без отклонений."""
 
-MODULE_CONTENT_PROMPT_TEMPLATE = """Создай ДЕТАЛЬНЫЙ учебный контент для модуля IT-курса в формате ЛЕКЦИЙ СО СЛАЙДАМИ.
-
-КОНТЕКСТ КУРСА:
-- Курс: {course_title}
-- Аудитория: {target_audience}
-- Модуль №{module_number}: {module_title}
-- Цель модуля: {module_goal}
-
-ТЕМЫ ДЛЯ ЛЕКЦИЙ (создай по одной лекции на каждую тему):
-{lessons_list}
+# Статическая часть промпта: одинакова для всех модулей, идёт первой (см. build_prompt_messages)
+MODULE_CONTENT_INSTRUCTIONS = """Создай ДЕТАЛЬНЫЙ учебный контент для модуля IT-курса в формате ЛЕКЦИЙ СО СЛАЙДАМИ.
+Контекст курса и темы лекций - в конце сообщения.
 
 ЗАДАЧА: 
-Создай {num_lessons} ЛЕКЦИЙ (lectures) в формате презентаций.
+Создай по одной ЛЕКЦИИ (lectures) на каждую тему из списка в формате презентаций.
 Каждая ЛЕКЦИЯ должна содержать массив СЛАЙДОВ (slides).
 Одна лекция = 8-12 слайдов презентации.
 
@@ -94,19 +95,19 @@ MODULE_CONTENT_PROMPT_TEMPLATE = """Создай ДЕТАЛЬНЫЙ учебны
 ТРЕБОВАНИЯ К ЛЕКЦИЯМ:
 - learning_objectives - 3-5 конкретных целей обучения
 - key_takeaways - 3-5 ключевых выводов, которые студент должен запомнить
-- duration_minutes - реалистичная оценка времени
+- duration_minutes - реалистичная оценка времени"""
 
-ФОРМАТ ОТВЕТА: строго JSON со следующей структурой
+MODULE_CONTENT_SCHEMA = """ФОРМАТ ОТВЕТА: строго JSON со следующей структурой
 
 ОБЯЗАТЕЛЬНАЯ СТРУКТУРА JSON:
-{{
-  "module_number": {module_number},
-  "module_title": "{module_title}",
+{
+  "module_number": 1,
+  "module_title": "название модуля",
   "lectures": [
-    {{
+    {
       "lecture_title": "название лекции (например: 'Введение в переменные и типы данных')",
-      "module_number": {module_number},
-      "module_title": "{module_title}",
+      "module_number": 1,
+      "module_title": "название модуля",
       "duration_minutes": 45,
       "learning_objectives": [
         "конкретная цель 1",
@@ -119,52 +120,84 @@ MODULE_CONTENT_PROMPT_TEMPLATE = """Создай ДЕТАЛЬНЫЙ учебны
         "ключевой вывод 3"
       ],
       "slides": [
-        {{
+        {
           "slide_number": 1,
           "title": "Заголовок слайда",
           "content": "Текст слайда (3-5 пунктов через \\n)",
           "slide_type": "title",
           "code_example": null,
           "notes": "Заметки для преподавателя о том, как подать материал"
-        }},
-        {{
+        },
+        {
           "slide_number": 2,
           "title": "Пример кода",
           "content": "Описание примера",
           "slide_type": "code",
           "code_example": "# Код с комментариями\\nprint('Hello')",
           "notes": "Объясните построчно"
-        }}
+        }
       ]
-    }}
+    }
   ]
-}}
+}
 
 ❌ НЕПРАВИЛЬНЫЙ ФОРМАТ (НЕ ТАК):
-{{
+{
   "lesson_title": "...",
   "lesson_goal": "...",
   "content_outline": [...]
-}}
+}
 
 ✅ ПРАВИЛЬНЫЙ ФОРМАТ (ИМЕННО ТАК):
-{{
+{
   "lectures": [
-    {{
+    {
       "lecture_title": "...",
       "slides": [...]
-    }}
+    }
   ]
-}}
+}
 
 КРИТИЧЕСКИ ВАЖНО:
 1. Корневой объект ОБЯЗАТЕЛЬНО должен содержать поле "lectures" (массив лекций)
 2. Каждая лекция в "lectures" ОБЯЗАТЕЛЬНО должна содержать поле "slides" (массив слайдов)
 3. НЕ возвращай структуру УРОКА (lesson с полями lesson_title, lesson_goal, content_outline)
 4. Возвращай структуру ЛЕКЦИЙ (lectures с вложенными slides)
-5. Создай {num_lessons} лекций, каждая с 8-12 слайдами
+5. Создай по одной лекции на каждую тему, каждая с 8-12 слайдами
 6. Верни ТОЛЬКО JSON, без комментариев и markdown блоков!"""
 
+# Компактная схема (PROMPT_COMPACT_SCHEMA=1): сигнатура полей вместо примера
+MODULE_CONTENT_SCHEMA_COMPACT = """ФОРМАТ ОТВЕТА: строго JSON, без комментариев и markdown блоков:
+{"module_number":int,"module_title":str,"lectures":[{"lecture_title":str,"module_number":int,"module_title":str,"duration_minutes":int,"learning_objectives":[str],"key_takeaways":[str],"slides":[{"slide_number":int,"title":str,"content":str,"slide_type":str,"code_example":str|null,"notes":str}]}]}
+Корень - объект с "lectures" (по одной лекции на тему, 8-12 слайдов в каждой), НЕ структура урока (lesson_title, lesson_goal, content_outline)."""
+
+# Переменная часть промпта: контекст модуля, идёт последней
+MODULE_CONTENT_CONTEXT_TEMPLATE = """КОНТЕКСТ КУРСА:
+- Курс: {course_title}
+- Аудитория: {target_audience}
+- Модуль №{module_number}: {module_title}
+- Цель модуля: {module_goal}
+
+ТЕМЫ ДЛЯ ЛЕКЦИЙ (создай по одной лекции на каждую тему):
+{lessons_list}
+Создай {num_lessons} лекций. В JSON: module_number = {module_number}, module_title = "{module_title}"."""
+
+# Контекст запроса одной лекции (генерация модуля по урокам): контекст модуля
+# одинаков для всех уроков и идёт первым, тема лекции - в конце
+MODULE_LECTURE_CONTEXT_TEMPLATE = """КОНТЕКСТ КУРСА:
+- Курс: {course_title}
+- Аудитория: {target_audience}
+- Модуль №{module_number}: {module_title}
+- Цель модуля: {module_goal}
+
+ТЕМЫ ЛЕКЦИЙ МОДУЛЯ (лекции по остальным темам создаются отдельно):
+{lessons_list}
+Создай ОДНУ лекцию - по теме №{lesson_number}: {lesson_title}
+План темы:
+{content_outline}
+Не повторяй материал других тем модуля. В JSON: module_number = {module_number}, module_title = "{module_title}", в lectures - одна лекция."""
+
+
 
 # ============================================================================
 # ПРОМПТ ДЛЯ ПЕРЕГЕНЕРАЦИИ УРОКА (LESSON)
@@ -409,17 +442,9 @@ TOPIC_MATERIAL_SYSTEM_PROMPT = """Ты — эксперт по созданию
 Материалы должны быть понятными, структурированными и содержать много примеров.
 Отвечаешь строго в JSON формате."""
 
-TOPIC_MATERIAL_PROMPT_TEMPLATE = """Создай ДЕТАЛЬНЫЙ учебный материал для изучения конкретной темы из IT-курса.
-
-КОНТЕКСТ КУРСА:
-- Курс: {course_title}
-- Аудитория: {target_audience}
-- Модуль: {module_title}
-- Урок: {lesson_title}
-- Цель урока: {lesson_goal}
-
-ТЕМА ДЛЯ ДЕТАЛИЗАЦИИ:
-Тема №{topic_number}: {topic_title}
+# Статическая часть промпта: одинакова для всех тем, идёт первой (см. build_prompt_messages)
+TOPIC_MATERIAL_INSTRUCTIONS = """Создай ДЕТАЛЬНЫЙ учебный материал для изучения конкретной темы из IT-курса.
+Контекст курса и тема - в конце сообщения.
 
 ЗАДАЧА:
 Создай полноценный учебный материал, который студент может изучать самостоятельно.
@@ -468,13 +493,13 @@ TOPIC_MATERIAL_PROMPT_TEMPLATE = """Создай ДЕТАЛЬНЫЙ учебны
 
 9. ВОПРОСЫ ДЛЯ САМОПРОВЕРКИ (quiz_questions):
    - 5-7 вопросов
-   - Проверка понимания материала
+   - Проверка понимания материала"""
 
-ФОРМАТ ОТВЕТА: строго JSON
+TOPIC_MATERIAL_SCHEMA = """ФОРМАТ ОТВЕТА: строго JSON
 
-{{
-  "topic_title": "{topic_title}",
-  "topic_number": {topic_number},
+{
+  "topic_title": "название темы",
+  "topic_number": 1,
   "introduction": "Многострочное введение в тему (2-3 абзаца)...",
   "theory": "Подробное теоретическое объяснение (4-6 абзацев)...",
   "examples": [
@@ -516,12 +541,193 @@ TOPIC_MATERIAL_PROMPT_TEMPLATE = """Создай ДЕТАЛЬНЫЙ учебны
     "Рекомендуемая статья..."
   ],
   "estimated_reading_time_minutes": 25
-}}
+}
 
 ВАЖНО:
 - Все тексты должны быть содержательными и развернутыми
 - Примеры должны быть конкретными и практичными
 - Код должен быть рабочим и с комментариями
-- Учитывай уровень аудитории: {target_audience}
 - Верни ТОЛЬКО JSON, без комментариев и markdown блоков!"""
 
+# Компактная схема (PROMPT_COMPACT_SCHEMA=1): сигнатура полей вместо примера
+TOPIC_MATERIAL_SCHEMA_COMPACT = """ФОРМАТ ОТВЕТА: строго JSON, без комментариев и markdown блоков:
+{"topic_title":str,"topic_number":int,"introduction":str,"theory":str,"examples":[str],"code_snippets":[str],"key_points":[str],"common_mistakes":[str],"best_practices":[str],"practice_exercises":[str],"quiz_questions":[str],"additional_resources":[str],"estimated_reading_time_minutes":int}
+Тексты содержательные и развёрнутые, код рабочий и с комментариями."""
+
+# Переменная часть промпта: контекст темы, идёт последней
+TOPIC_MATERIAL_CONTEXT_TEMPLATE = """КОНТЕКСТ КУРСА:
+- Курс: {course_title}
+- Аудитория: {target_audience}
+- Модуль: {module_title}
+- Урок: {lesson_title}
+- Цель урока: {lesson_goal}
+
+ТЕМА ДЛЯ ДЕТАЛИЗАЦИИ:
+Тема №{topic_number}: {topic_title}
+
+В JSON: topic_title = "{topic_title}", topic_number = {topic_number}.
+Учитывай уровень аудитории: {target_audience}"""
+
+
+# ============================================================================
+# ПРОМПТЫ ПЕРЕГЕНЕРАЦИИ ИЗ ОБРАБОТЧИКОВ (ЛЕКЦИЯ, СЛАЙДЫ, ПРАВКА ЛЕКЦИИ)
+# ============================================================================
+
+SLIDE_TYPES_HINT = """ТИПЫ СЛАЙДОВ:
+- title: Заглавный
+- content: Теория (3-5 пунктов)
+- code: Примеры кода (обязательно добавь code_example)
+- diagram: Схемы (описание визуализации)
+- quiz: Вопросы для проверки
+- summary: Итоги"""
+
+SLIDE_SCHEMA = """ФОРМАТ ОТВЕТА: строго JSON
+{
+  "slide_number": номер слайда,
+  "title": "заголовок слайда",
+  "content": "содержание слайда (3-5 пунктов через \\n)",
+  "slide_type": "тип слайда",
+  "code_example": "код если нужен или null",
+  "notes": "заметки для преподавателя"
+}
+
+ВАЖНО: Верни ТОЛЬКО JSON, без комментариев!"""
+
+SLIDE_SCHEMA_COMPACT = """ФОРМАТ ОТВЕТА: только JSON без комментариев:
+{"slide_number":int,"title":str,"content":str,"slide_type":str,"code_example":str|null,"notes":str}"""
+
+SLIDE_REGENERATION_INSTRUCTIONS = f"""Перегенерируй ОДИН слайд для IT-лекции.
+Контекст и текущий слайд - в конце сообщения.
+
+ЗАДАЧА: Создай улучшенную версию этого слайда. Сохрани номер и тип слайда.
+
+{SLIDE_TYPES_HINT}"""
+
+SLIDE_REGENERATION_CONTEXT_TEMPLATE = """КОНТЕКСТ:
+Курс: {course_title}
+Аудитория: {target_audience}
+Модуль: {module_title}
+Лекция: {lecture_title}
+Слайд #{slide_number}: {slide_title}
+Текущий тип: {slide_type}
+
+ТЕКУЩИЙ КОНТЕНТ СЛАЙДА:
+{slide_content}
+{custom_requirements}"""
+
+SLIDES_BATCH_INSTRUCTIONS = f"""Перегенерируй НЕСКОЛЬКО слайдов IT-лекции.
+Контекст и слайды для перегенерации - в конце сообщения.
+
+ЗАДАЧА: Создай улучшенную версию каждого из этих слайдов. Сохрани номер
+и тип каждого слайда, слайды не должны повторять друг друга.
+
+{SLIDE_TYPES_HINT}
+
+Верни слайды вызовом функции regenerate_slides - по одному элементу на каждый слайд."""
+
+SLIDES_BATCH_CONTEXT_TEMPLATE = """КОНТЕКСТ:
+Курс: {course_title}
+Аудитория: {target_audience}
+Модуль: {module_title}
+Лекция: {lecture_title}
+Все слайды лекции: {slide_titles}
+
+СЛАЙДЫ ДЛЯ ПЕРЕГЕНЕРАЦИИ:
+{slides}"""
+
+LECTURE_SCHEMA = """ФОРМАТ ОТВЕТА: строго JSON
+{
+  "lecture_title": "название лекции",
+  "module_number": номер модуля,
+  "module_title": "название модуля",
+  "duration_minutes": 45,
+  "learning_objectives": ["цель 1", "цель 2"],
+  "key_takeaways": ["вывод 1", "вывод 2"],
+  "slides": [
+    {
+      "slide_number": 1,
+      "title": "...",
+      "content": "...",
+      "slide_type": "title",
+      "code_example": null,
+      "notes": "заметки"
+    }
+  ]
+}"""
+
+LECTURE_SCHEMA_COMPACT = """ФОРМАТ ОТВЕТА: только JSON без комментариев:
+{"lecture_title":str,"module_number":int,"module_title":str,"duration_minutes":int,"learning_objectives":[str],"key_takeaways":[str],"slides":[{"slide_number":int,"title":str,"content":str,"slide_type":str,"code_example":str|null,"notes":str}]}"""
+
+LECTURE_REGENERATION_INSTRUCTIONS = f"""Перегенерируй ДЕТАЛЬНУЮ лекцию для IT-курса в формате слайдов.
+Контекст лекции - в конце сообщения.
+
+ЗАДАЧА: Создай улучшенную версию лекции с 8-12 слайдами.
+
+{SLIDE_TYPES_HINT}"""
+
+LECTURE_REGENERATION_CONTEXT_TEMPLATE = """КУРС: {course_title}
+АУДИТОРИЯ: {target_audience}
+МОДУЛЬ: {module_title}
+ЛЕКЦИЯ: {lecture_title}
+ТЕКУЩЕЕ КОЛИЧЕСТВО СЛАЙДОВ: {num_slides}
+{custom_requirements}
+В JSON: lecture_title = "{lecture_title}", module_number = {module_number}, module_title = "{module_title}"."""
+
+LECTURE_PATCH_INSTRUCTIONS = f"""Внеси изменения в лекцию IT-курса по требованиям пользователя.
+Текущие слайды (в квадратных скобках - идентификатор слайда) и требования - в конце сообщения.
+
+ЗАДАЧА: Верни вызовом функции patch_lecture только необходимые изменения:
+- replace - заменить слайд slide_id новым slide
+- insert - вставить новый slide после слайда after_id (null - в начало)
+- delete - удалить слайд slide_id
+- move - переставить слайд slide_id после слайда after_id (null - в начало)
+
+Идентификаторы - только из списка слайдов. Слайды, которые не нужно менять,
+не передавай. Нумерация слайдов обновится автоматически.
+
+{SLIDE_TYPES_HINT}"""
+
+LECTURE_PATCH_CONTEXT_TEMPLATE = """КУРС: {course_title}
+АУДИТОРИЯ: {target_audience}
+МОДУЛЬ: {module_title}
+ЛЕКЦИЯ: {lecture_title}
+
+ТЕКУЩИЕ СЛАЙДЫ:
+
+{slides}
+
+ТРЕБОВАНИЯ:
+{custom_requirements}"""
+
+
+# ============================================================================
+# СБОРКА СООБЩЕНИЙ ЗАПРОСА
+# ============================================================================
+
+def response_schema(full: str, compact: str, in_tools: bool = False) -> Optional[str]:
+    """
+    Схема ответа в промпте: полная или компактная (PROMPT_COMPACT_SCHEMA)
+
+    in_tools - схема уже передана в описании функции (Function Calling):
+    в компактном режиме в промпт она не добавляется.
+    """
+    if not PROMPT_COMPACT_SCHEMA:
+        return full
+    return None if in_tools else compact
+
+
+def build_prompt_messages(system: str, instructions: str, context: str,
+                          schema: Optional[str] = None) -> List[Dict[str, str]]:
+    """
+    Сообщения запроса: статическая часть первой, контекст последним
+
+    Провайдер кэширует совпадающий префикс запросов (OpenAI - начиная
+    с 1024 токенов). Системный промпт, инструкции и схема ответа одинаковы
+    для всех запросов шаблона, поэтому идут первыми; курс, модуль и
+    требования пользователя - в конце сообщения.
+    """
+    static = f"{instructions}\n\n{schema}" if schema else instructions
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": f"{static}\n\n{context}"}
+    ]
@@ -40,6 +40,8 @@ async def set_commands():
         BotCommand("regenerate", "🔄 Перегенерировать лекции/слайды"),
         BotCommand("regenerate_lesson", "🔁 Перегенерировать отдельный урок"),
         BotCommand("generate_topics", "📖 Детальные материалы по темам урока"),
+        BotCommand("generate_all", "🚀 Сгенерировать весь курс целиком"),
+        BotCommand("jobs", "🧵 Задачи генерации"),
         BotCommand("export", "📥 Экспортировать курс (JSON/HTML/MD/TXT)"),
     ]
     
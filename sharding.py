@@ -0,0 +1,523 @@
+"""
+Шардированный запуск бота по user_id
+
+Фронт-процесс получает апдейты (polling или webhook) и отправляет каждый
+в один из BOT_SHARDS процессов-шардов через Unix-сокет. Все апдейты
+пользователя попадают в один шард и обрабатываются там по порядку,
+поэтому сессии и задачи пользователя живут только в его шарде.
+
+Бюджет RPM/TPM OpenAI общий: шарды получают его у фронта через тот же
+сокет, пауза после 429 в одном шарде действует на все. Кэш LLM общий
+через файл SQLite.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import signal
+import subprocess
+import tempfile
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from telegram import Update
+
+from utils.metrics import get_metrics, start_metrics_server
+from utils.rate_limiter import get_rate_limiter
+from utils.webhook import WebhookServer, WEBHOOK_MAX_CONNECTIONS, webhook_url
+
+logger = logging.getLogger(__name__)
+
+# Unix-сокет фронт-процесса, к которому подключаются шарды
+BOT_SHARD_SOCKET = os.getenv('BOT_SHARD_SOCKET', os.path.join(tempfile.gettempdir(), 'course-bot-shards.sock'))
+
+# Сколько апдейтов фронт держит для шарда, пока тот не забрал их (при переполнении
+# фронт перестаёт принимать апдейты)
+BOT_SHARD_QUEUE_SIZE = int(os.getenv('BOT_SHARD_QUEUE_SIZE', '10000'))
+
+# Сколько полученных апдейтов шард держит в обработке и ожидании своей очереди
+BOT_SHARD_MAX_PENDING = int(os.getenv('BOT_SHARD_MAX_PENDING', '1000'))
+
+# Сколько ждать обработки оставшихся апдейтов при остановке (секунды)
+BOT_SHARD_DRAIN_TIMEOUT = float(os.getenv('BOT_SHARD_DRAIN_TIMEOUT', '30'))
+
+# Предел строки протокола: апдейт в JSON
+IPC_LIMIT = 16 * 1024 * 1024
+
+# Сколько раз отправлять шарду апдейт, не подтверждённый из-за падения шарда
+# (апдейт, который роняет шард, не должен ронять его бесконечно)
+MAX_DELIVERIES = 2
+
+
+def update_shard_key(update: Update) -> int:
+    """Ключ шардирования апдейта: пользователь, иначе чат"""
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return 0
+
+
+def shard_for(key: int, shards: int) -> int:
+    return key % shards
+
+
+def _encode(message: Dict[str, Any]) -> bytes:
+    return json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+async def _read_messages(reader: asyncio.StreamReader) -> AsyncIterator[Dict[str, Any]]:
+    """Сообщения протокола (JSON по строке) до закрытия соединения"""
+    while True:
+        line = await reader.readline()
+        if not line:
+            return
+        yield json.loads(line)
+
+
+def _install_stop_handlers(stop_event: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+
+class ProcessSupervisor:
+    """Дочерние процессы бота: запуск, перезапуск упавших, остановка"""
+
+    def __init__(self, count: int, command: List[str], env_for: Callable[[int], Dict[str, str]],
+                 name: str = "процесс"):
+        self.count = count
+        self.command = command
+        self.env_for = env_for
+        self.name = name
+        self.stopping = False
+        self._processes: Dict[int, subprocess.Popen] = {}
+
+    def _spawn(self, index: int) -> subprocess.Popen:
+        return subprocess.Popen(self.command, env={**os.environ, **self.env_for(index)})
+
+    def start(self):
+        for index in range(self.count):
+            self._processes[index] = self._spawn(index)
+        logger.info(f"👥 Запущено: {self.count} ({self.name})")
+
+    def check(self):
+        """Перезапускает завершившиеся процессы"""
+        for index, process in list(self._processes.items()):
+            code = process.poll()
+            if code is None or self.stopping:
+                continue
+            logger.error(f"❌ {self.name.capitalize()} {index} завершился с кодом {code}, перезапуск")
+            self._processes[index] = self._spawn(index)
+
+    async def watch(self, interval: float = 1.0):
+        while not self.stopping:
+            await asyncio.sleep(interval)
+            self.check()
+
+    def terminate(self):
+        """Отправляет SIGTERM всем процессам"""
+        self.stopping = True
+        for process in self._processes.values():
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+
+    def wait(self, timeout: float = BOT_SHARD_DRAIN_TIMEOUT + 10):
+        """Ждёт завершения процессов, не успевшие завершиться убивает"""
+        deadline = time.monotonic() + timeout
+        for index, process in self._processes.items():
+            try:
+                process.wait(timeout=max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                logger.warning(f"⚠️ {self.name.capitalize()} {index} не завершился, останавливаем принудительно")
+                process.kill()
+                process.wait()
+
+
+class ShardRouter:
+    """
+    Фронт: раздаёт апдейты шардам и выдаёт им общий бюджет OpenAI
+
+    У каждого шарда своя очередь апдейтов; пока шард не подключён
+    (запускается или перезапускается), апдейты копятся в очереди.
+    Шард подтверждает обработанные апдейты; неподтверждённые на момент
+    падения шарда отправляются перезапущенному шарду повторно.
+    """
+
+    def __init__(self, shards: int, queue_size: int = BOT_SHARD_QUEUE_SIZE):
+        self.shards = shards
+        self.queues: List[asyncio.Queue] = [asyncio.Queue(maxsize=queue_size) for _ in range(shards)]
+        # Отправленные, но не подтверждённые апдейты: update_id -> (апдейт, число отправок)
+        self.unacked: List[Dict[int, Tuple[Dict[str, Any], int]]] = [{} for _ in range(shards)]
+        self.connected: set = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._socket_path: Optional[str] = None
+        self._connections: set = set()
+
+    async def start(self, socket_path: str = BOT_SHARD_SOCKET):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        self._socket_path = socket_path
+        self._server = await asyncio.start_unix_server(self._handle_shard, path=socket_path, limit=IPC_LIMIT)
+        logger.info(f"🔀 Фронт ждёт шарды на {socket_path}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for task in list(self._connections):
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        if self._socket_path and os.path.exists(self._socket_path):
+            os.unlink(self._socket_path)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(queue.qsize() for queue in self.queues)
+
+    async def route(self, update: Update):
+        shard = shard_for(update_shard_key(update), self.shards)
+        await self.queues[shard].put(update.to_dict())
+        get_metrics().shard_updates.inc(shard=str(shard))
+
+    async def run(self, update_queue: asyncio.Queue):
+        """Раздаёт апдейты из очереди Application (её наполняет Updater или WebhookServer)"""
+        while True:
+            update = await update_queue.get()
+            if isinstance(update, Update):
+                await self.route(update)
+
+    async def flush(self, timeout: float = BOT_SHARD_DRAIN_TIMEOUT):
+        """Ждёт, пока подключённые шарды заберут накопленные апдейты"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and any(
+            self.queues[shard].qsize() for shard in self.connected
+        ):
+            await asyncio.sleep(0.1)
+
+    async def _handle_shard(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        shard = None
+        sender = None
+        grants: set = set()
+        try:
+            hello = json.loads(await reader.readline() or b"{}")
+            shard = hello.get("shard")
+            if not isinstance(shard, int) or not 0 <= shard < self.shards:
+                logger.warning(f"⚠️ Неизвестный шард: {hello}")
+                return
+            self.connected.add(shard)
+            logger.info(f"🔌 Шард {shard} подключён")
+            sender = asyncio.create_task(self._send_updates(shard, writer))
+
+            limiter = get_rate_limiter()
+            async for message in _read_messages(reader):
+                kind = message.get("type")
+                budget = limiter.for_model(message.get("model", "default")).budget
+                if kind == "ack":
+                    self.unacked[shard].pop(message["update_id"], None)
+                elif kind == "take":
+                    grant = asyncio.create_task(self._grant(writer, budget, message))
+                    grants.add(grant)
+                    grant.add_done_callback(grants.discard)
+                elif kind == "adjust":
+                    budget.adjust(message["tokens"])
+                elif kind == "pause":
+                    budget.pause(message["seconds"])
+        except (ConnectionError, asyncio.IncompleteReadError, json.JSONDecodeError) as e:
+            logger.warning(f"⚠️ Соединение с шардом {shard} прервано: {e}")
+        finally:
+            self.connected.discard(shard)
+            for pending in [sender, *grants]:
+                if pending is not None:
+                    pending.cancel()
+            self._connections.discard(task)
+            writer.close()
+            if shard is not None:
+                logger.info(f"🔌 Шард {shard} отключён")
+
+    async def _send_updates(self, shard: int, writer: asyncio.StreamWriter):
+        unacked = self.unacked[shard]
+        # Сначала - апдейты, не обработанные прошлым экземпляром шарда
+        redelivery = list(unacked.values())
+        unacked.clear()
+        for update, deliveries in redelivery:
+            if deliveries >= MAX_DELIVERIES:
+                logger.error(f"❌ Апдейт {update['update_id']} не обработан шардом {shard} после {deliveries} попыток")
+                continue
+            await self._send_update(shard, writer, update, deliveries)
+        if redelivery:
+            logger.warning(f"⚠️ Шарду {shard} повторно отправлено апдейтов: {len(redelivery)}")
+
+        queue = self.queues[shard]
+        while True:
+            update = await queue.get()
+            await self._send_update(shard, writer, update, 0)
+
+    async def _send_update(self, shard: int, writer: asyncio.StreamWriter, update: Dict[str, Any], deliveries: int):
+        self.unacked[shard][update["update_id"]] = (update, deliveries + 1)
+        writer.write(_encode({"type": "update", "update": update}))
+        await writer.drain()
+
+    @staticmethod
+    async def _grant(writer: asyncio.StreamWriter, budget, message: Dict[str, Any]):
+        await budget.take(message["tokens"])
+        writer.write(_encode({"type": "granted", "id": message["id"]}))
+        await writer.drain()
+
+
+class FrontConnection:
+    """Соединение шарда с фронтом: входящие апдейты и общий бюджет OpenAI"""
+
+    def __init__(self, shard_id: int, socket_path: str = BOT_SHARD_SOCKET):
+        self.shard_id = shard_id
+        self.socket_path = socket_path
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._ids = itertools.count(1)
+        self._grants: Dict[int, asyncio.Future] = {}
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.open_unix_connection(self.socket_path, limit=IPC_LIMIT)
+        self._send({"type": "hello", "shard": self.shard_id})
+        await self._writer.drain()
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._fail_grants()
+
+    async def updates(self) -> AsyncIterator[Dict[str, Any]]:
+        """Апдейты от фронта (ответы на запросы бюджета разбираются по пути)"""
+        try:
+            async for message in _read_messages(self._reader):
+                if message.get("type") == "update":
+                    yield message["update"]
+                elif message.get("type") == "granted":
+                    future = self._grants.pop(message["id"], None)
+                    if future is not None and not future.done():
+                        future.set_result(None)
+        finally:
+            self._fail_grants()
+
+    async def take(self, model: str, tokens: int):
+        """Ждёт выдачи бюджета фронтом"""
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._grants[request_id] = future
+        self._send({"type": "take", "id": request_id, "model": model, "tokens": tokens})
+        try:
+            await future
+        finally:
+            self._grants.pop(request_id, None)
+
+    def notify(self, message: Dict[str, Any]):
+        """Сообщение без ответа (потеря при разрыве соединения не критична)"""
+        try:
+            self._send(message)
+        except ConnectionError as e:
+            logger.debug(f"Сообщение фронту не отправлено: {e}")
+
+    def _send(self, message: Dict[str, Any]):
+        if self._writer is None or self._writer.is_closing():
+            raise ConnectionError("Нет соединения с фронт-процессом")
+        self._writer.write(_encode(message))
+
+    def _fail_grants(self):
+        for future in self._grants.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Соединение с фронт-процессом закрыто"))
+        self._grants.clear()
+
+    def budget_for(self, model: str) -> "RemoteBudget":
+        return RemoteBudget(self, model)
+
+
+class RemoteBudget:
+    """Бюджет RPM/TPM модели, общий для шардов (хранится во фронт-процессе)"""
+
+    def __init__(self, connection: FrontConnection, model: str):
+        self.connection = connection
+        self.model = model
+
+    async def take(self, tokens: int):
+        await self.connection.take(self.model, tokens)
+
+    def adjust(self, tokens: int):
+        self.connection.notify({"type": "adjust", "model": self.model, "tokens": tokens})
+
+    def pause(self, seconds: float):
+        self.connection.notify({"type": "pause", "model": self.model, "seconds": seconds})
+
+    def stats(self) -> Dict[str, Any]:
+        return {"budget": "shared"}
+
+
+class OrderedDispatcher:
+    """
+    Обработка апдейтов шарда
+
+    Апдейты разных пользователей обрабатываются параллельно (не больше
+    concurrency одновременно), апдейты одного пользователя - строго по
+    порядку поступления.
+    """
+
+    def __init__(self, application, concurrency: int, max_pending: int = BOT_SHARD_MAX_PENDING,
+                 on_processed: Optional[Callable[[Update], None]] = None):
+        self.application = application
+        self.on_processed = on_processed
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._pending = asyncio.Semaphore(max_pending)
+        self._tails: Dict[int, asyncio.Task] = {}
+        self._tasks: set = set()
+
+    async def submit(self, update: Update):
+        """Ставит апдейт в обработку (ждёт, если в обработке уже max_pending апдейтов)"""
+        await self._pending.acquire()
+        key = update_shard_key(update)
+        task = asyncio.create_task(self._process(update, self._tails.get(key)))
+        self._tails[key] = task
+        self._tasks.add(task)
+        task.add_done_callback(lambda done: self._on_done(key, done))
+
+    def _on_done(self, key: int, task: asyncio.Task):
+        self._tasks.discard(task)
+        if self._tails.get(key) is task:
+            del self._tails[key]
+        self._pending.release()
+
+    async def _process(self, update: Update, previous: Optional[asyncio.Task]):
+        if previous is not None:
+            await asyncio.wait([previous])
+        async with self._semaphore:
+            try:
+                await self.application.process_update(update)
+            except Exception as e:
+                logger.error(f"❌ Ошибка обработки апдейта {update.update_id}: {e}")
+        if self.on_processed:
+            self.on_processed(update)
+
+    async def drain(self, timeout: float = BOT_SHARD_DRAIN_TIMEOUT):
+        """Дожидается обработки полученных апдейтов"""
+        if self._tasks:
+            await asyncio.wait(list(self._tasks), timeout=timeout)
+
+
+async def _route_remaining(router: ShardRouter, update_queue: asyncio.Queue):
+    while not update_queue.empty():
+        update = update_queue.get_nowait()
+        if isinstance(update, Update):
+            await router.route(update)
+    await router.flush()
+
+
+async def serve_shard(application, shard_id: int, concurrency: int, socket_path: str = BOT_SHARD_SOCKET):
+    """
+    Запускает Application как шард: апдейты приходят от фронт-процесса
+
+    Работает до SIGTERM или закрытия соединения с фронтом.
+    """
+    stop_event = asyncio.Event()
+    _install_stop_handlers(stop_event)
+
+    connection = FrontConnection(shard_id, socket_path)
+    await connection.connect()
+    get_rate_limiter().budget_factory = connection.budget_for
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+
+    dispatcher = OrderedDispatcher(
+        application, concurrency,
+        on_processed=lambda update: connection.notify({"type": "ack", "update_id": update.update_id}),
+    )
+
+    async def consume():
+        async for data in connection.updates():
+            await dispatcher.submit(Update.de_json(data, application.bot))
+        logger.warning(f"⚠️ Шард {shard_id}: фронт закрыл соединение")
+
+    consumer = asyncio.create_task(consume())
+    stopper = asyncio.create_task(stop_event.wait())
+    logger.info(f"🧩 Шард {shard_id} готов к работе")
+    try:
+        await asyncio.wait([consumer, stopper], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        consumer.cancel()
+        stopper.cancel()
+        await asyncio.gather(consumer, stopper, return_exceptions=True)
+        await dispatcher.drain()
+        connection.close()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+async def serve_front(application, supervisor: ProcessSupervisor, shards: int, mode: str = "polling",
+                      socket_path: str = BOT_SHARD_SOCKET, secret_token: str = ""):
+    """
+    Запускает фронт-процесс: приём апдейтов, раздача шардам, общий бюджет OpenAI
+
+    application используется только для приёма апдейтов (Updater при
+    polling или WebhookServer), обработчиков в нём нет.
+    """
+    stop_event = asyncio.Event()
+    _install_stop_handlers(stop_event)
+
+    router = ShardRouter(shards)
+    await router.start(socket_path)
+    supervisor.start()
+
+    metrics = get_metrics()
+    metrics.gauge("shard_queue_depth", "Апдейты, ожидающие отправки шардам", lambda: router.queue_depth)
+    metrics.gauge("shards_connected", "Подключённые шарды", lambda: len(router.connected))
+    metrics_server = await start_metrics_server()
+
+    await application.initialize()
+    webhook_server = None
+    if mode == "webhook":
+        webhook_server = WebhookServer(application, secret_token=secret_token)
+        await webhook_server.start()
+        await application.bot.set_webhook(
+            url=webhook_url(),
+            secret_token=secret_token or None,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+        logger.info(f"🔗 Webhook зарегистрирован: {webhook_url()}")
+    else:
+        await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+
+    background = [
+        asyncio.create_task(router.run(application.update_queue), name="shard-router"),
+        asyncio.create_task(supervisor.watch(), name="shard-supervisor"),
+    ]
+    try:
+        await stop_event.wait()
+    finally:
+        logger.info("⏹️ Остановка фронт-процесса...")
+        if webhook_server is not None:
+            await webhook_server.stop()
+        elif application.updater.running:
+            await application.updater.stop()
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        # Оставшиеся апдейты - шардам, затем останавливаем шарды
+        try:
+            await asyncio.wait_for(_route_remaining(router, application.update_queue), BOT_SHARD_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ Не все апдейты отправлены шардам, осталось {router.queue_depth}")
+        supervisor.terminate()
+        await asyncio.to_thread(supervisor.wait)
+        await router.stop()
+        if metrics_server:
+            metrics_server.close()
+        await application.shutdown()
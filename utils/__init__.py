@@ -1,21 +1,41 @@
 """Утилиты для работы бота"""
 
 from .session_manager import SessionManager, get_session_manager
+from .session_store import SessionStore, MemorySessionStore, SQLiteSessionStore
+from .progress import ProgressMessage
+from .llm_cache import LLMCache, get_llm_cache
+from .rate_limiter import RateLimiter, get_rate_limiter
+from .metrics import get_metrics
 from .formatters import (
     format_course_info,
     format_module_info,
     format_lesson_info,
     format_module_content_info,
-    format_lesson_content_info
+    format_lesson_content_info,
+    format_pipeline_progress,
+    format_module_generation_progress,
+    format_topics_generation_progress
 )
 
 __all__ = [
     'SessionManager',
     'get_session_manager',
+    'SessionStore',
+    'MemorySessionStore',
+    'SQLiteSessionStore',
+    'ProgressMessage',
+    'LLMCache',
+    'get_llm_cache',
+    'RateLimiter',
+    'get_rate_limiter',
+    'get_metrics',
     'format_course_info',
     'format_module_info',
     'format_lesson_info',
     'format_module_content_info',
-    'format_lesson_content_info'
+    'format_lesson_content_info',
+    'format_pipeline_progress',
+    'format_module_generation_progress',
+    'format_topics_generation_progress'
 ]
 
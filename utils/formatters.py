@@ -1,6 +1,6 @@
 """Форматирование сообщений для Telegram"""
 
-from typing import List
+from typing import Any, Dict, List
 from models import Course, Module, Lesson, ModuleContent, LessonContent
 
 
@@ -104,6 +104,52 @@ def format_lesson_content_info(lesson_content: LessonContent, lesson_title: str)
     return text
 
 
+def format_pipeline_progress(stats: Dict[str, Any], course_title: str, finished: bool = False) -> str:
+    """Форматирует прогресс генерации всего курса"""
+    if finished:
+        text = f"✅ <b>Курс сгенерирован!</b>\n\n"
+    else:
+        text = f"🤖 <b>Генерация всего курса...</b>\n\n"
+    text += f"🎓 {course_title}\n\n"
+    text += f"📚 <b>Лекции модулей:</b> {stats['modules_done']}/{stats['modules_total']}\n"
+    text += f"📖 <b>Темы уроков:</b> {stats['topics_done']}/{stats['topics_total']}\n"
+    text += f"📝 <b>Уроки готовы:</b> {stats['lessons_done']}/{stats['lessons_total']}\n"
+    if stats.get('failed'):
+        text += f"⚠️ <b>Ошибок:</b> {stats['failed']}\n"
+    text += f"\n⏱️ {int(stats['elapsed_seconds'])} с"
+    
+    if finished:
+        text += "\n\n<b>Что дальше?</b>"
+    
+    return text
+
+
+def format_module_generation_progress(module_title: str, progress: Dict[str, Any]) -> str:
+    """Форматирует прогресс потоковой генерации лекций модуля"""
+    lectures_total = progress['lectures_total']
+    current_lecture = min(progress['lectures_done'] + 1, lectures_total)
+    
+    text = f"🤖 <b>Генерация контента для модуля...</b>\n\n"
+    text += f"Модуль: {module_title}\n\n"
+    if progress['lectures_done'] >= lectures_total:
+        text += f"📚 Лекции: {lectures_total}/{lectures_total}, завершаем…\n"
+    else:
+        text += f"📚 Лекция {current_lecture}/{lectures_total}, слайд {progress['current_slide']}…\n"
+    text += f"🖼 Готово слайдов: {progress['slides_done']}"
+    if progress.get('invalid_slides'):
+        text += f" (⚠️ с ошибками: {progress['invalid_slides']})"
+    return text
+
+
+def format_topics_generation_progress(lesson_title: str, progress: Dict[str, Any]) -> str:
+    """Форматирует прогресс генерации материалов по темам урока"""
+    text = f"🤖 <b>Генерация детальных материалов...</b>\n\n"
+    text += f"Урок: {lesson_title}\n\n"
+    text += f"📖 Готово тем: {progress['topics_done']}/{progress['topics_total']}\n"
+    text += f"✅ Последняя: {progress['topic_title']}"
+    return text
+
+
 def truncate_text(text: str, max_length: int = 200) -> str:
     """Обрезает текст до указанной длины"""
     if len(text) <= max_length:
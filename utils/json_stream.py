@@ -0,0 +1,238 @@
+"""Инкрементальный разбор JSON из потока токенов"""
+
+import json
+import logging
+from bisect import bisect_right
+from typing import Any, List, Optional, Sequence, Set, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Путь до значения внутри JSON: ключи объектов и индексы массивов
+JsonPath = Tuple[Union[str, int], ...]
+
+# Элемент шаблона пути, совпадающий с любым индексом массива
+ANY_INDEX = "*"
+
+
+# Символы, не входящие в литералы (числа, true, false, null)
+_NON_LITERAL = set('{}[]",: \t\r\n')
+
+
+class _Frame:
+    """Открытый объект или массив"""
+
+    __slots__ = ("kind", "start", "path", "key", "index", "expect_key", "last_complete", "literal_end")
+
+    def __init__(self, kind: str, start: int, path: JsonPath):
+        self.kind = kind  # '{' или '['
+        self.start = start
+        self.path = path
+        self.key: Optional[str] = None
+        self.index = 0
+        self.expect_key = kind == "{"
+        # Конец последнего целиком полученного элемента (для восстановления обрезанного JSON)
+        self.last_complete = start + 1
+        # Конец литерала, который завершится на ',' или закрывающей скобке
+        self.literal_end = 0
+
+    def child_path(self) -> JsonPath:
+        return self.path + ((self.key,) if self.kind == "{" else (self.index,))
+
+
+class PartialJson:
+    """
+    Результат разбора JSON, возможно обрезанного
+
+    value - разобранное значение (для обрезанного ответа - валидный префикс
+    с закрытыми структурами), truncated - был ли ответ обрезан,
+    incomplete - пути объектов и массивов, которые не успели завершиться.
+    """
+
+    def __init__(self, value: Any, truncated: bool = False, incomplete: Optional[Set[JsonPath]] = None):
+        self.value = value
+        self.truncated = truncated
+        self.incomplete = incomplete or set()
+
+    def is_complete(self, path: JsonPath) -> bool:
+        """Был ли элемент по пути получен целиком"""
+        return path not in self.incomplete
+
+
+class JsonStreamScanner:
+    """
+    Сканер JSON, который получает текст кусками по мере генерации
+
+    Отслеживает вложенность объектов и массивов и сообщает о каждом
+    завершённом значении, путь которого совпадает с одним из шаблонов.
+    Например, шаблон ("lectures", "*", "slides", "*") отдаёт слайды
+    по одному, не дожидаясь конца ответа.
+
+    Текст до начала корневого значения (пояснения модели, ```json)
+    и после его конца пропускается. Если поток оборвался, result()
+    восстанавливает валидный префикс, закрывая открытые структуры.
+
+    Фрагменты хранятся списком и просматриваются по одному разу;
+    полный текст (text) склеивается только при обращении.
+    """
+
+    def __init__(self, patterns: Sequence[Sequence[Union[str, int]]] = (), root: str = "{["):
+        self.patterns = [tuple(pattern) for pattern in patterns]
+        self.root = root
+        self.root_start: Optional[int] = None
+        self.root_end: Optional[int] = None
+        self.finished = False
+
+        self._stack: List[_Frame] = []
+        self._chunks: List[str] = []
+        self._offsets: List[int] = []  # Смещение начала каждого фрагмента в тексте
+        self._length = 0
+        self._joined: Optional[str] = ""
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._string_is_key = False
+
+    def feed(self, chunk: str) -> List[Tuple[JsonPath, Any]]:
+        """
+        Добавляет фрагмент текста
+
+        Returns:
+            Список (путь, значение) для завершённых значений, подходящих под шаблоны
+        """
+        completed: List[Tuple[JsonPath, Any]] = []
+        if not chunk:
+            return completed
+        base = self._length
+        self._chunks.append(chunk)
+        self._offsets.append(base)
+        self._length += len(chunk)
+        self._joined = None
+
+        for i, char in enumerate(chunk, base):
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._string_is_key:
+                        self._stack[-1].key = json.loads(self._slice(self._string_start, i + 1))
+                    else:
+                        self._stack[-1].last_complete = i + 1
+                continue
+
+            if not self._stack:
+                if self.finished or char not in self.root:
+                    continue
+                self.root_start = i
+                self._stack.append(_Frame(char, i, ()))
+                continue
+
+            frame = self._stack[-1]
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = i
+                self._string_is_key = frame.kind == "{" and frame.expect_key
+            elif char in "{[":
+                self._stack.append(_Frame(char, i, frame.child_path()))
+            elif char in "}]":
+                self._stack.pop()
+                if self._stack:
+                    self._stack[-1].last_complete = i + 1
+                else:
+                    self.finished = True
+                    self.root_end = i + 1
+                if self._matches(frame.path):
+                    try:
+                        completed.append((frame.path, json.loads(self._slice(frame.start, i + 1))))
+                    except json.JSONDecodeError as e:
+                        logger.warning(f"Не удалось разобрать фрагмент JSON {frame.path}: {e}")
+            elif char == ":" and frame.kind == "{":
+                frame.expect_key = False
+            elif char == ",":
+                if frame.literal_end:
+                    frame.last_complete = frame.literal_end
+                    frame.literal_end = 0
+                if frame.kind == "{":
+                    frame.expect_key = True
+                else:
+                    frame.index += 1
+            elif char not in _NON_LITERAL:
+                frame.literal_end = i + 1
+
+        return completed
+
+    @property
+    def text(self) -> str:
+        """Весь полученный текст"""
+        if self._joined is None:
+            self._joined = "".join(self._chunks)
+            self._chunks = [self._joined]
+            self._offsets = [0]
+        return self._joined
+
+    def _slice(self, start: int, end: int) -> str:
+        """Участок текста [start, end), склеивает только покрывающие его фрагменты"""
+        first = bisect_right(self._offsets, start) - 1
+        last = bisect_right(self._offsets, end - 1) - 1
+        offset = self._offsets[first]
+        if first == last:
+            return self._chunks[first][start - offset:end - offset]
+        return "".join(self._chunks[first:last + 1])[start - offset:end - offset]
+
+    def result(self) -> Optional[PartialJson]:
+        """
+        Разобранное корневое значение
+
+        Если поток оборвался, обрезает текст до последнего целого элемента
+        самой вложенной открытой структуры и закрывает все открытые структуры.
+        Незавершённые строки, литералы и ключи без значений отбрасываются.
+
+        Returns:
+            PartialJson или None, если JSON в тексте не найден
+        """
+        if self.root_start is None:
+            return None
+
+        if self.finished:
+            return PartialJson(json.loads(self._slice(self.root_start, self.root_end)))
+
+        innermost = self._stack[-1]
+        closers = "".join("}" if frame.kind == "{" else "]" for frame in reversed(self._stack))
+        repaired = self._slice(self.root_start, innermost.last_complete) + closers
+        incomplete = {frame.path for frame in self._stack}
+        return PartialJson(json.loads(repaired), truncated=True, incomplete=incomplete)
+
+    def _matches(self, path: JsonPath) -> bool:
+        for pattern in self.patterns:
+            if len(pattern) != len(path):
+                continue
+            if all(
+                part == ANY_INDEX and isinstance(value, int) or part == value
+                for part, value in zip(pattern, path)
+            ):
+                return True
+        return False
+
+
+def parse_partial_json(text: str, root: str = "{") -> Optional[PartialJson]:
+    """
+    Разбирает JSON из ответа модели, восстанавливая обрезанный вывод
+
+    Args:
+        text: Ответ модели (допускаются пояснения и ```json вокруг JSON)
+        root: С каких символов может начинаться корневое значение
+
+    Returns:
+        PartialJson или None, если JSON не найден или не разбирается
+    """
+    scanner = JsonStreamScanner(root=root)
+    scanner.feed(text)
+    try:
+        return scanner.result()
+    except json.JSONDecodeError as e:
+        logger.error(f"Ошибка парсинга JSON: {e}")
+        return None
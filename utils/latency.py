@@ -0,0 +1,79 @@
+"""Сбор латентностей и расчёт перцентилей"""
+
+import math
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+# Сколько последних замеров храним на каждый ключ
+LATENCY_WINDOW = 500
+
+
+def percentile(samples: List[float], q: float) -> Optional[float]:
+    """Перцентиль q (0-100) по методу ближайшего ранга"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class LatencyRecorder:
+    """
+    Скользящее окно латентностей по ключам
+
+    Ключ - произвольная строка (например, стратегия генерации),
+    замеры хранятся отдельно для успешных и неуспешных вызовов.
+    """
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.window = window
+        self._samples: Dict[Tuple[str, bool], Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, key: str, seconds: float, ok: bool = True):
+        """Сохраняет замер"""
+        with self._lock:
+            samples = self._samples.setdefault((key, ok), deque(maxlen=self.window))
+            samples.append(seconds)
+
+    def samples(self, key: str, ok: bool = True) -> List[float]:
+        """Замеры по ключу"""
+        with self._lock:
+            return list(self._samples.get((key, ok), ()))
+
+    def percentiles(self, key: str, ok: bool = True,
+                    quantiles=(50, 90, 95, 99)) -> Dict[str, Optional[float]]:
+        """Перцентили латентности по ключу, например {'p50': 12.3, ...}"""
+        samples = self.samples(key, ok)
+        return {f"p{q}": percentile(samples, q) for q in quantiles}
+
+    def count(self, key: str, ok: bool = True) -> int:
+        """Количество замеров по ключу"""
+        with self._lock:
+            return len(self._samples.get((key, ok), ()))
+
+    def report(self) -> Dict[str, Dict[str, object]]:
+        """Сводка по всем ключам: количество успехов/ошибок и перцентили успешных вызовов"""
+        with self._lock:
+            keys = sorted({key for key, _ in self._samples})
+        return {
+            key: {
+                "ok": self.count(key, True),
+                "failed": self.count(key, False),
+                **self.percentiles(key, True),
+            }
+            for key in keys
+        }
+
+
+# Глобальный экземпляр
+_latency_recorder: Optional[LatencyRecorder] = None
+
+
+def get_latency_recorder() -> LatencyRecorder:
+    """Получает глобальный экземпляр LatencyRecorder"""
+    global _latency_recorder
+    if _latency_recorder is None:
+        _latency_recorder = LatencyRecorder()
+    return _latency_recorder
@@ -0,0 +1,206 @@
+"""Персистентный кэш результатов запросов к LLM"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from .metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# Включён ли кэш
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', '1') == '1'
+
+# Путь к файлу SQLite
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', 'llm_cache.sqlite3')
+
+# Время жизни записи (секунды), по умолчанию 7 дней
+LLM_CACHE_TTL = int(os.getenv('LLM_CACHE_TTL', str(7 * 24 * 3600)))
+
+# Максимум записей (при превышении удаляются давно не использованные)
+LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', '5000'))
+
+# Поля запроса, от которых зависит ответ модели (max_tokens - ответ, обрезанный
+# по меньшему бюджету, не должен отдаваться на запрос с большим)
+CACHE_KEY_FIELDS = ("model", "messages", "temperature", "tools", "tool_choice", "response_format", "max_tokens")
+
+
+class LLMCache:
+    """
+    Content-addressed кэш: ключ - хэш параметров запроса, значение - разобранный результат
+
+    Хранит уже провалидированный результат (JSON), поэтому попадание
+    в кэш не требует ни запроса к OpenAI, ни повторного разбора ответа.
+    Поддерживает TTL, вытеснение по LRU и счётчики попаданий.
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl: int = LLM_CACHE_TTL,
+                 max_entries: int = LLM_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                namespace TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_access ON llm_cache(last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(namespace: str, request: Dict[str, Any]) -> str:
+        """
+        Строит ключ кэша по параметрам запроса
+
+        Args:
+            namespace: Тип результата (module_content, topic_material, ...)
+            request: Параметры chat.completions.create
+        """
+        payload = {field: request.get(field) for field in CACHE_KEY_FIELDS}
+        payload["namespace"] = namespace
+        raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Возвращает сохранённый результат или None"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+
+            if not row:
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+
+        logger.info(f"💾 Кэш LLM: попадание (hit rate {self.hit_rate:.0%})")
+        return row[0]
+
+    def set(self, key: str, namespace: str, value: str):
+        """Сохраняет результат"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, namespace, value, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, namespace, value, now, now)
+            )
+            self.writes += 1
+            self._evict()
+            self._conn.commit()
+
+    async def aget(self, key: str) -> Optional[str]:
+        """Асинхронная версия get (запрос к SQLite выполняется в потоке)"""
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, namespace: str, value: str):
+        """Асинхронная версия set"""
+        await asyncio.to_thread(self.set, key, namespace, value)
+
+    def _evict(self):
+        """Удаляет просроченные записи и лишние по LRU (вызывается под блокировкой)"""
+        self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl,))
+        count = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN "
+                "(SELECT key FROM llm_cache ORDER BY last_access ASC LIMIT ?)",
+                (excess,)
+            )
+
+    @property
+    def hit_rate(self) -> float:
+        """Доля попаданий"""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """Счётчики кэша"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "hit_rate": self.hit_rate,
+            "entries": entries,
+        }
+
+    def clear(self):
+        """Очищает кэш"""
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+
+
+# Глобальный экземпляр кэша
+_llm_cache: Optional[LLMCache] = None
+
+
+def get_llm_cache() -> Optional[LLMCache]:
+    """Получает глобальный экземпляр LLMCache (None, если кэш выключен)"""
+    global _llm_cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    if _llm_cache is None:
+        _llm_cache = LLMCache()
+    return _llm_cache
+
+
+async def cache_lookup(namespace: str, request: Dict[str, Any]) -> Optional[str]:
+    """
+    Ищет результат запроса в кэше
+
+    Ошибки кэша не прерывают генерацию - в этом случае возвращается None.
+    """
+    cache = get_llm_cache()
+    if cache is None:
+        return None
+    try:
+        value = await cache.aget(cache.make_key(namespace, request))
+    except Exception as e:
+        logger.warning(f"⚠️ Ошибка чтения кэша LLM: {e}")
+        get_metrics().llm_cache_requests.inc(namespace=namespace, result="error")
+        return None
+    get_metrics().llm_cache_requests.inc(namespace=namespace, result="hit" if value is not None else "miss")
+    return value
+
+
+async def cache_store(namespace: str, request: Dict[str, Any], value: str):
+    """Сохраняет результат запроса в кэш (ошибки только логируются)"""
+    cache = get_llm_cache()
+    if cache is None:
+        return
+    try:
+        await cache.aset(cache.make_key(namespace, request), namespace, value)
+    except Exception as e:
+        logger.warning(f"⚠️ Ошибка записи в кэш LLM: {e}")
@@ -0,0 +1,236 @@
+"""Контроль задержки event loop и поиск блокирующих вызовов"""
+
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# Периодический замер задержки event loop
+LOOP_MONITOR_ENABLED = os.getenv('LOOP_MONITOR_ENABLED', '1') == '1'
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', '0.25'))
+
+# С какой задержки считаем event loop заблокированным и ищем виновника (секунды)
+LOOP_BLOCK_THRESHOLD = float(os.getenv('LOOP_BLOCK_THRESHOLD', '0.5'))
+
+# Отчёт о медленных колбэках: замер каждого шага event loop (включается явно, есть накладные расходы)
+LOOP_SLOW_CALLBACKS = os.getenv('LOOP_SLOW_CALLBACKS', '0') == '1'
+LOOP_SLOW_CALLBACK_THRESHOLD = float(os.getenv('LOOP_SLOW_CALLBACK_THRESHOLD', '0.1'))
+
+# Корень проекта: кадры стека из этих файлов считаются кодом бота
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Location: (модуль.функция, файл:строка)
+Location = Tuple[str, str]
+
+
+def _is_project_file(filename: str) -> bool:
+    return (
+        filename.startswith(PROJECT_ROOT)
+        and "site-packages" not in filename
+        and not filename.endswith(os.path.join("utils", "loop_monitor.py"))
+    )
+
+
+def _location(filename: str, lineno: int, function: str) -> Location:
+    """("handlers.callback_helpers.generate_module_content", "handlers/callback_helpers.py:120")"""
+    relative = os.path.relpath(filename, PROJECT_ROOT)
+    module = os.path.splitext(relative)[0].replace(os.sep, ".")
+    return f"{module}.{function}", f"{relative}:{lineno}"
+
+
+def _project_frames_of_stack(frame) -> List[Location]:
+    """Кадры кода бота в стеке потока, от внешнего к внутреннему"""
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        if _is_project_file(code.co_filename):
+            frames.append(_location(code.co_filename, frame.f_lineno, code.co_name))
+        frame = frame.f_back
+    return list(reversed(frames))
+
+
+def _project_frames_of_task(task: asyncio.Task) -> List[Location]:
+    """Кадры кода бота в цепочке await задачи, от внешнего к внутреннему"""
+    frames = []
+    awaitable = task.get_coro()
+    while awaitable is not None:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None) \
+            or getattr(awaitable, "ag_frame", None)
+        if frame is not None and _is_project_file(frame.f_code.co_filename):
+            frames.append(_location(frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name))
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None) \
+            or getattr(awaitable, "ag_await", None)
+    return frames
+
+
+class LoopMonitor:
+    """
+    Сторож event loop
+
+    Задача в event loop раз в interval отмечает "пульс" и измеряет, насколько
+    позже запланированного она проснулась (задержка event loop). Отдельный
+    поток следит за пульсом: если его нет дольше block_threshold, он снимает
+    стек потока event loop - в нём виден обработчик и блокирующий вызов.
+    После разблокировки событие пишется в лог (JSON) и в метрики.
+
+    Опционально (slow_callbacks) замеряется каждый шаг event loop: медленные
+    шаги задач сообщаются с цепочкой корутин до и после шага.
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, block_threshold: float = LOOP_BLOCK_THRESHOLD,
+                 slow_callbacks: bool = LOOP_SLOW_CALLBACKS,
+                 slow_callback_threshold: float = LOOP_SLOW_CALLBACK_THRESHOLD):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.slow_callbacks = slow_callbacks
+        self.slow_callback_threshold = slow_callback_threshold
+        self.max_lag = 0.0
+
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        # Стек, снятый сторожем во время текущей блокировки
+        self._blocked_stack: Optional[List[Location]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._original_handle_run = None
+
+    async def start(self):
+        """Запускает замеры в текущем event loop"""
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._sample_lag(), name="loop-monitor")
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+        if self.slow_callbacks:
+            self._patch_handle_run()
+        logger.info(
+            f"🩺 Контроль event loop: замер каждые {self.interval} с, порог блокировки {self.block_threshold} с"
+            + (f", медленные колбэки от {self.slow_callback_threshold} с" if self.slow_callbacks else "")
+        )
+
+    async def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._watchdog:
+            self._watchdog.join(timeout=self.interval * 2)
+        self._unpatch_handle_run()
+
+    # ---------- Задержка event loop ----------
+
+    async def _sample_lag(self):
+        metrics = get_metrics()
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            lag = max(0.0, now - started - self.interval)
+            metrics.event_loop_lag_seconds.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.block_threshold:
+                self._report_block(lag)
+            self._blocked_stack = None
+
+    def _watch(self):
+        """Поток-сторож: снимает стек event loop, пока тот заблокирован"""
+        while not self._stop.wait(self.interval):
+            stalled = time.monotonic() - self._heartbeat - self.interval
+            if stalled < self.block_threshold or self._blocked_stack is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                self._blocked_stack = _project_frames_of_stack(frame)
+
+    def _report_block(self, lag: float):
+        stack = self._blocked_stack or []
+        handler = stack[0][0] if stack else "unknown"
+        call_site = stack[-1][1] if stack else "unknown"
+        event = {
+            "event": "loop_blocked",
+            "seconds": round(lag, 3),
+            "handler": handler,
+            "call_site": call_site,
+            "stack": [f"{name} ({location})" for name, location in stack],
+        }
+        get_metrics().event_loop_blocks.inc(handler=handler, call_site=call_site)
+        logger.warning(f"🐢 Event loop заблокирован на {lag:.2f} с: {json.dumps(event, ensure_ascii=False)}")
+
+    # ---------- Медленные колбэки ----------
+
+    def _patch_handle_run(self):
+        if self._original_handle_run is not None:
+            return
+        original = asyncio.events.Handle._run
+        monitor = self
+
+        def _run(handle):
+            task = getattr(handle._callback, "__self__", None)
+            if not isinstance(task, asyncio.Task):
+                task = None
+            before = _project_frames_of_task(task) if task is not None else None
+            started = time.perf_counter()
+            try:
+                return original(handle)
+            finally:
+                duration = time.perf_counter() - started
+                if duration >= monitor.slow_callback_threshold:
+                    monitor._report_slow_callback(handle, task, before, duration)
+
+        self._original_handle_run = original
+        asyncio.events.Handle._run = _run
+
+    def _unpatch_handle_run(self):
+        if self._original_handle_run is not None:
+            asyncio.events.Handle._run = self._original_handle_run
+            self._original_handle_run = None
+
+    def _report_slow_callback(self, handle, task: Optional[asyncio.Task],
+                              before: Optional[List[Location]], duration: float):
+        try:
+            if task is not None:
+                after = _project_frames_of_task(task) if not task.done() else []
+                frames = before or after
+                callback = frames[0][0] if frames else task.get_name()
+                event: Dict[str, Any] = {
+                    "event": "slow_callback",
+                    "seconds": round(duration, 3),
+                    "callback": callback,
+                    "task": task.get_name(),
+                    # Блокирующий код - между точкой возобновления и следующим await
+                    "resumed_at": before[-1][1] if before else None,
+                    "suspended_at": after[-1][1] if after else None,
+                }
+            else:
+                callback = getattr(handle._callback, "__qualname__", repr(handle._callback))
+                event = {"event": "slow_callback", "seconds": round(duration, 3), "callback": callback}
+
+            metrics = get_metrics()
+            metrics.event_loop_slow_callbacks.inc(callback=callback)
+            metrics.event_loop_slow_callback_seconds.observe(duration)
+            logger.warning(f"🐌 Медленный шаг event loop {duration:.2f} с: {json.dumps(event, ensure_ascii=False)}")
+        except Exception as e:
+            logger.debug(f"Не удалось описать медленный колбэк: {e}")
+
+
+# Глобальный экземпляр монитора
+_loop_monitor: Optional[LoopMonitor] = None
+
+
+def get_loop_monitor() -> Optional[LoopMonitor]:
+    """Получает глобальный монитор event loop (None, если выключен)"""
+    global _loop_monitor
+    if _loop_monitor is None and LOOP_MONITOR_ENABLED:
+        _loop_monitor = LoopMonitor()
+    return _loop_monitor
@@ -0,0 +1,342 @@
+"""Метрики горячих путей в формате Prometheus и HTTP-эндпоинт /metrics"""
+
+import asyncio
+import bisect
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+# Адрес эндпоинта /metrics (METRICS_PORT=0 - не запускать)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+
+# Границы корзин гистограмм, секунды: от разбора JSON до долгих запросов к GPT-4
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    """Метрика с набором меток"""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        return lines + self._render_samples()
+
+    def _render_samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Монотонный счётчик"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def total(self) -> float:
+        """Сумма по всем наборам меток"""
+        with self._lock:
+            return sum(self._values.values())
+
+    def _render_samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value}" for key, value in values]
+
+
+class Gauge(_Metric):
+    """Текущее значение, вычисляемое при чтении метрик"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, function: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.function = function
+
+    def _render_samples(self) -> List[str]:
+        try:
+            return [f"{self.name} {float(self.function())}"]
+        except Exception as e:
+            logger.debug(f"Не удалось вычислить {self.name}: {e}")
+            return []
+
+
+class Histogram(_Metric):
+    """Гистограмма длительностей с кумулятивными корзинами"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # Для каждого набора меток: счётчики корзин (+Inf последней), сумма
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._series.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[Dict[str, str]]:
+        """
+        Замеряет длительность блока
+
+        Метки можно дополнить внутри блока через возвращаемый словарь
+        (например, status после получения ответа).
+        """
+        started = time.perf_counter()
+        labels = dict(labels)
+        try:
+            yield labels
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return sum(series[0]) if series else 0
+
+    def _render_samples(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._series.items())
+
+        lines = []
+        for key, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                bucket_labels = _format_labels(self.label_names, key, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Набор метрик, отдаваемых эндпоинтом /metrics"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, label_names))
+
+    def histogram(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def gauge(self, name: str, documentation: str, function: Callable[[], float]) -> Gauge:
+        return self._register(Gauge(name, documentation, function))
+
+    def render(self) -> str:
+        """Текстовый формат экспозиции Prometheus"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class BotMetrics(MetricsRegistry):
+    """Метрики бота"""
+
+    def __init__(self):
+        super().__init__()
+        self.openai_request_seconds = self.histogram(
+            "openai_request_seconds", "Длительность запросов к OpenAI",
+            ("model", "strategy", "template", "status")
+        )
+        self.openai_tokens = self.counter(
+            "openai_tokens_total", "Токены OpenAI по данным usage", ("model", "kind")
+        )
+        self.prompt_tokens = self.histogram(
+            "prompt_tokens", "Токены промпта по локальному токенизатору", ("model", "template"),
+            buckets=(250, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000, 16000, 32000)
+        )
+        self.token_budget_ratio = self.histogram(
+            "token_budget_ratio", "Фактический размер ответа к прогнозу бюджета токенов", ("template",),
+            buckets=(0.25, 0.5, 0.75, 0.9, 1.0, 1.1, 1.25, 1.5, 2.0, 3.0)
+        )
+        self.json_extract_seconds = self.histogram(
+            "json_extract_seconds", "Извлечение JSON из ответа модели", ("kind",)
+        )
+        self.validation_seconds = self.histogram(
+            "validation_seconds", "Валидация pydantic-моделей", ("model",)
+        )
+        self.export_render_seconds = self.histogram(
+            "export_render_seconds", "Рендеринг экспорта", ("method",)
+        )
+        self.export_seconds = self.histogram(
+            "export_seconds", "Экспорт в пуле процессов: ожидание, передача и рендеринг", ("method", "status")
+        )
+        self.telegram_request_seconds = self.histogram(
+            "telegram_request_seconds", "Запросы к Bot API", ("method", "status")
+        )
+        self.llm_cache_requests = self.counter(
+            "llm_cache_requests_total", "Обращения к кэшу LLM", ("namespace", "result")
+        )
+        self.fallbacks = self.counter(
+            "generation_fallbacks_total", "Использование тестового контента вместо ответа модели", ("kind",)
+        )
+        self.webhook_requests = self.counter(
+            "webhook_requests_total", "Запросы к webhook по HTTP-статусу", ("status",)
+        )
+        self.shard_updates = self.counter(
+            "shard_updates_total", "Апдейты, отправленные фронтом шардам", ("shard",)
+        )
+        self.event_loop_lag_seconds = self.histogram(
+            "event_loop_lag_seconds", "Задержка event loop",
+            buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+        )
+        self.event_loop_blocks = self.counter(
+            "event_loop_blocks_total", "Блокировки event loop дольше порога", ("handler", "call_site")
+        )
+        self.event_loop_slow_callbacks = self.counter(
+            "event_loop_slow_callbacks_total", "Медленные шаги event loop", ("callback",)
+        )
+        self.event_loop_slow_callback_seconds = self.histogram(
+            "event_loop_slow_callback_seconds", "Длительность медленных шагов event loop"
+        )
+
+
+# Метки текущего вызова LLM (стратегия и шаблон промпта), задаются вызывающим кодом
+_llm_labels: contextvars.ContextVar[Dict[str, str]] = contextvars.ContextVar("llm_labels", default={})
+
+
+@contextmanager
+def llm_call_labels(**labels) -> Iterator[None]:
+    """Метки strategy/template для запросов к OpenAI внутри блока"""
+    token = _llm_labels.set({**_llm_labels.get(), **labels})
+    try:
+        yield
+    finally:
+        _llm_labels.reset(token)
+
+
+def current_llm_labels() -> Dict[str, str]:
+    labels = _llm_labels.get()
+    return {"strategy": labels.get("strategy", "default"), "template": labels.get("template", "unknown")}
+
+
+def timed_render(method: Callable) -> Callable:
+    """Декоратор метода экспорта: время рендеринга по имени метода"""
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        with get_metrics().export_render_seconds.time(method=method.__name__):
+            return method(*args, **kwargs)
+    return wrapper
+
+
+class InstrumentedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest, замеряющий латентность запросов к Bot API"""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        with get_metrics().telegram_request_seconds.time(method=api_method, status="error") as labels:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+            labels["status"] = str(code)
+        return code, payload
+
+
+async def _handle_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Заголовки запроса не нужны, но их нужно дочитать
+        while (await asyncio.wait_for(reader.readline(), timeout=5)).strip():
+            pass
+
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", get_metrics().render().encode("utf-8")
+        else:
+            status, body = "404 Not Found", b"not found\n"
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> Optional[asyncio.AbstractServer]:
+    """Запускает HTTP-эндпоинт /metrics в текущем event loop"""
+    if not port:
+        return None
+    try:
+        server = await asyncio.start_server(_handle_http, host, port)
+    except OSError as e:
+        logger.warning(f"⚠️ Эндпоинт метрик не запущен ({host}:{port}): {e}")
+        return None
+    logger.info(f"📈 Метрики доступны на http://{host}:{port}/metrics")
+    return server
+
+
+# Глобальный экземпляр метрик
+_metrics: Optional[BotMetrics] = None
+
+
+def get_metrics() -> BotMetrics:
+    """Получает глобальный экземпляр метрик"""
+    global _metrics
+    if _metrics is None:
+        _metrics = BotMetrics()
+    return _metrics
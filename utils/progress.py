@@ -0,0 +1,60 @@
+"""Обновляемое сообщение о прогрессе долгих операций"""
+
+import logging
+import os
+import time
+from typing import Optional
+
+from telegram.error import BadRequest, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Минимальный интервал между редактированиями сообщения (секунды)
+PROGRESS_MIN_INTERVAL = float(os.getenv('PROGRESS_MIN_INTERVAL', '2'))
+
+
+class ProgressMessage:
+    """
+    Одно сообщение Telegram, которое редактируется по ходу операции
+
+    Промежуточные обновления троттлятся (не чаще PROGRESS_MIN_INTERVAL),
+    чтобы не упираться в лимиты Bot API на редактирование.
+    """
+
+    def __init__(self, message, min_interval: Optional[float] = None):
+        self.message = message
+        self.min_interval = PROGRESS_MIN_INTERVAL if min_interval is None else min_interval
+        self._last_text: Optional[str] = None
+        self._last_edit = 0.0
+
+    async def update(self, text: str, force: bool = False, **kwargs) -> bool:
+        """
+        Обновляет текст сообщения
+
+        Args:
+            text: Новый текст (HTML)
+            force: Обновить без учёта троттлинга (финальное сообщение)
+            **kwargs: Дополнительные параметры edit_text (reply_markup и т.д.)
+
+        Returns:
+            True, если сообщение было отредактировано
+        """
+        now = time.monotonic()
+        if text == self._last_text and not kwargs:
+            return False
+        if not force and now - self._last_edit < self.min_interval:
+            return False
+
+        try:
+            await self.message.edit_text(text, parse_mode="HTML", **kwargs)
+        except RetryAfter as e:
+            logger.warning(f"Прогресс: Telegram просит подождать {e.retry_after} с")
+            return False
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                logger.warning(f"Не удалось обновить прогресс: {e}")
+            return False
+
+        self._last_text = text
+        self._last_edit = now
+        return True
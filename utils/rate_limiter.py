@@ -0,0 +1,328 @@
+"""Ограничение запросов к OpenAI: бюджеты RPM/TPM и адаптивная параллельность"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Лимиты по умолчанию (запросов и токенов в минуту на модель)
+OPENAI_DEFAULT_RPM = int(os.getenv('OPENAI_DEFAULT_RPM', '500'))
+OPENAI_DEFAULT_TPM = int(os.getenv('OPENAI_DEFAULT_TPM', '80000'))
+
+# Лимиты отдельных моделей: "gpt-4=500,gpt-4-turbo-preview=5000"
+OPENAI_RPM_LIMITS = os.getenv('OPENAI_RPM_LIMITS', '')
+OPENAI_TPM_LIMITS = os.getenv('OPENAI_TPM_LIMITS', '')
+
+# Границы адаптивной параллельности на модель (AIMD)
+OPENAI_CONCURRENCY_INITIAL = int(os.getenv('OPENAI_CONCURRENCY_INITIAL', '16'))
+OPENAI_CONCURRENCY_MIN = int(os.getenv('OPENAI_CONCURRENCY_MIN', '1'))
+OPENAI_CONCURRENCY_MAX = int(os.getenv('OPENAI_CONCURRENCY_MAX', '64'))
+
+# Сколько раз повторять запрос после 429
+OPENAI_RATE_LIMIT_RETRIES = int(os.getenv('OPENAI_RATE_LIMIT_RETRIES', '3'))
+
+# Оценка токенов без токенизатора: символов на токен и накладные расходы на сообщение
+CHARS_PER_TOKEN = 3.0
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Ожидаемый размер ответа, если max_tokens не задан
+DEFAULT_COMPLETION_TOKENS = 4096
+
+
+def _parse_limits(value: str) -> Dict[str, int]:
+    """Разбирает строку вида "model=limit,model=limit" """
+    limits = {}
+    for item in value.split(","):
+        if "=" in item:
+            model, limit = item.split("=", 1)
+            limits[model.strip()] = int(limit)
+    return limits
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов в тексте"""
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+def estimate_request_tokens(request: Dict[str, Any]) -> Dict[str, int]:
+    """
+    Оценивает токены запроса chat.completions
+
+    Returns:
+        {"prompt": ..., "completion": ...}; completion - max_tokens запроса
+    """
+    prompt = 0
+    for message in request.get("messages", []):
+        prompt += estimate_tokens(str(message.get("content") or "")) + MESSAGE_OVERHEAD_TOKENS
+    if request.get("tools"):
+        prompt += estimate_tokens(json.dumps(request["tools"], ensure_ascii=False))
+    completion = request.get("max_tokens") or DEFAULT_COMPLETION_TOKENS
+    return {"prompt": prompt, "completion": completion}
+
+
+class TokenBucket:
+    """Ведро токенов с равномерным пополнением"""
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.level = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.refill_per_second)
+        self._updated = now
+
+    async def take(self, amount: float):
+        """Забирает amount, ожидая пополнения (не больше ёмкости ведра)"""
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.level >= amount:
+                self.level -= amount
+                return
+            await asyncio.sleep((amount - self.level) / self.refill_per_second)
+
+    def adjust(self, amount: float):
+        """Возвращает (amount > 0) или дополнительно списывает (amount < 0) токены"""
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+    @property
+    def available(self) -> float:
+        self._refill()
+        return self.level
+
+
+class AdaptiveConcurrency:
+    """
+    Лимит параллельных запросов, подстраиваемый по AIMD
+
+    Успешный запрос увеличивает лимит на 1/limit (примерно +1 за "окно"),
+    ответ 429 уменьшает лимит вдвое. Серия 429 от запросов, отправленных
+    одновременно, уменьшает лимит один раз.
+    """
+
+    # Сколько секунд после уменьшения лимита игнорировать следующие 429
+    DECREASE_COOLDOWN = 1.0
+
+    def __init__(self, initial: int, minimum: int, maximum: int):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self):
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_overload(self):
+        now = time.monotonic()
+        if now - self._last_decrease < self.DECREASE_COOLDOWN:
+            return
+        self._last_decrease = now
+        self.limit = max(self.minimum, self.limit / 2)
+
+
+class LocalBudget:
+    """
+    Бюджет RPM/TPM модели в памяти процесса
+
+    Запросы получают бюджет в порядке очереди, после 429 выдача
+    бюджета приостанавливается.
+    """
+
+    def __init__(self, rpm: int, tpm: int):
+        self.requests = TokenBucket(rpm, rpm / 60)
+        self.tokens = TokenBucket(tpm, tpm / 60)
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def take(self, tokens: int):
+        """Списывает один запрос и tokens токенов"""
+        async with self._lock:
+            pause = self.paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            await self.requests.take(1)
+            await self.tokens.take(tokens)
+
+    def adjust(self, tokens: int):
+        """Возвращает (tokens > 0) или дополнительно списывает токены"""
+        self.tokens.adjust(tokens)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rpm_available": int(self.requests.available),
+            "tpm_available": int(self.tokens.available),
+        }
+
+
+class ModelLimiter:
+    """Бюджеты и параллельность одной модели"""
+
+    def __init__(self, model: str, rpm: int, tpm: int, budget: Optional[Any] = None):
+        self.model = model
+        # Бюджет с тем же интерфейсом, что LocalBudget (например, общий для нескольких процессов)
+        self.budget = budget or LocalBudget(rpm, tpm)
+        self.concurrency = AdaptiveConcurrency(
+            OPENAI_CONCURRENCY_INITIAL, OPENAI_CONCURRENCY_MIN, OPENAI_CONCURRENCY_MAX
+        )
+        self.waiting = 0
+        self.rate_limited = 0
+        self._admission = asyncio.Lock()
+
+    async def admit(self, tokens: int):
+        """Ждёт слот параллельности и бюджет RPM/TPM (в порядке очереди)"""
+        self.waiting += 1
+        try:
+            async with self._admission:
+                await self.concurrency.acquire()
+                try:
+                    await self.take_budget(tokens)
+                except BaseException:
+                    await self.concurrency.release()
+                    raise
+        finally:
+            self.waiting -= 1
+
+    async def take_budget(self, tokens: int):
+        """Списывает один запрос и tokens токенов, учитывая паузу после 429"""
+        await self.budget.take(tokens)
+
+    def pause(self, seconds: float):
+        """Приостанавливает выдачу бюджета (после 429)"""
+        self.budget.pause(seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "waiting": self.waiting,
+            "in_flight": self.concurrency.in_flight,
+            "concurrency_limit": round(self.concurrency.limit, 2),
+            **self.budget.stats(),
+            "rate_limited": self.rate_limited,
+        }
+
+
+class Admission:
+    """Допуск одного запроса: учёт фактических токенов и ответов 429"""
+
+    def __init__(self, limiter: ModelLimiter, estimated_tokens: int):
+        self.limiter = limiter
+        self.estimated_tokens = estimated_tokens
+        self.overloaded = False
+
+    async def retry_after_rate_limit(self, delay: float):
+        """
+        Ответ 429: уменьшаем параллельность, ждём и снова берём бюджет
+
+        Отклонённый запрос токенов не израсходовал: прежнее списание
+        возвращается, чтобы повтор не занимал бюджет TPM повторно.
+        """
+        limiter = self.limiter
+        self.overloaded = True
+        limiter.rate_limited += 1
+        limiter.concurrency.on_overload()
+        limiter.pause(delay)
+        logger.warning(
+            f"🚦 OpenAI 429 ({limiter.model}): пауза {delay:.1f} с, "
+            f"параллельность {limiter.concurrency.limit:.1f}"
+        )
+        limiter.budget.adjust(self.estimated_tokens)
+        await limiter.take_budget(self.estimated_tokens)
+
+    def complete(self, usage: Optional[Any] = None):
+        """Запрос выполнен; usage - фактический расход токенов из ответа"""
+        if usage is not None and getattr(usage, "total_tokens", None):
+            self.limiter.budget.adjust(self.estimated_tokens - usage.total_tokens)
+        if not self.overloaded:
+            self.limiter.concurrency.on_success()
+
+
+class RateLimiter:
+    """
+    Лимитер запросов к OpenAI для всего процесса
+
+    budget_factory(model) позволяет брать бюджет RPM/TPM не из памяти
+    процесса (см. sharding.RemoteBudget); параллельность всегда локальная.
+    """
+
+    def __init__(self, budget_factory: Optional[Callable[[str], Any]] = None):
+        self.rpm_limits = _parse_limits(OPENAI_RPM_LIMITS)
+        self.tpm_limits = _parse_limits(OPENAI_TPM_LIMITS)
+        self.budget_factory = budget_factory
+        self._models: Dict[str, ModelLimiter] = {}
+
+    def for_model(self, model: str) -> ModelLimiter:
+        if model not in self._models:
+            self._models[model] = ModelLimiter(
+                model,
+                rpm=self.rpm_limits.get(model, OPENAI_DEFAULT_RPM),
+                tpm=self.tpm_limits.get(model, OPENAI_DEFAULT_TPM),
+                budget=self.budget_factory(model) if self.budget_factory else None,
+            )
+        return self._models[model]
+
+    @asynccontextmanager
+    async def acquire(self, request: Dict[str, Any]) -> AsyncIterator[Admission]:
+        """
+        Допуск запроса к OpenAI
+
+        Ждёт слот параллельности и бюджет RPM/TPM модели, держит слот
+        до выхода из контекста (для потоковых ответов - до конца потока).
+        """
+        limiter = self.for_model(request.get("model", "default"))
+        estimate = estimate_request_tokens(request)
+        tokens = estimate["prompt"] + estimate["completion"]
+
+        started = time.monotonic()
+        await limiter.admit(tokens)
+        waited = time.monotonic() - started
+        if waited > 1:
+            logger.info(f"⏳ Лимит OpenAI ({limiter.model}): ожидание {waited:.1f} с, в очереди {limiter.waiting}")
+
+        try:
+            yield Admission(limiter, tokens)
+        finally:
+            await limiter.concurrency.release()
+
+    @property
+    def queue_depth(self) -> int:
+        """Количество запросов, ожидающих допуска"""
+        return sum(limiter.waiting for limiter in self._models.values())
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Состояние лимитов по моделям"""
+        return {model: limiter.stats() for model, limiter in self._models.items()}
+
+
+# Глобальный экземпляр лимитера
+_rate_limiter: Optional[RateLimiter] = None
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Получает глобальный экземпляр RateLimiter"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = RateLimiter()
+    return _rate_limiter
@@ -1,33 +1,326 @@
 """Менеджер сессий пользователей"""
 
-from typing import Dict, Optional
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import weakref
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
 from models import UserSession
+from .session_store import SessionStore, create_session_store, split_session, join_session
+
+logger = logging.getLogger(__name__)
+
+# Сколько сессий держать в памяти (горячий уровень, LRU)
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', '1000'))
+
+# Через сколько секунд бездействия сессия выгружается из памяти
+SESSION_IDLE_TTL = int(os.getenv('SESSION_IDLE_TTL', '1800'))
+
+# Хранилище общее для нескольких процессов бота: перед обработкой апдейта
+# проверяется, не изменил ли сессию другой процесс (включается при BOT_WORKERS > 1)
+SESSION_SHARED = os.getenv('SESSION_SHARED', '0') == '1'
+
+
+def _hash_part(data: str) -> str:
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
 
 
 class SessionManager:
-    """Управление сеансами пользователей"""
-    
-    def __init__(self):
-        self._sessions: Dict[int, UserSession] = {}
-    
+    """
+    Управление сеансами пользователей
+
+    Сессии хранятся в SessionStore и загружаются по требованию.
+    В памяти держится не более SESSION_CACHE_SIZE сессий (LRU),
+    неактивные дольше SESSION_IDLE_TTL выгружаются. Сохранение
+    инкрементальное: записываются только изменившиеся части сессии.
+
+    В event loop хранилище читается и пишется только в отдельном потоке:
+    load_async загружает сессию перед обработкой апдейта (get_session
+    затем берёт её из памяти), выгружаемые сессии сохраняются фоновой
+    записью. Синхронные обращения к хранилищу остаются для вызовов вне
+    event loop.
+
+    В режиме shared хранилище общее для нескольких процессов:
+    refresh сбрасывает сессию из памяти, если версия в хранилище
+    изменилась не этим процессом.
+    """
+
+    def __init__(self, store: Optional[SessionStore] = None,
+                 cache_size: int = SESSION_CACHE_SIZE, idle_ttl: int = SESSION_IDLE_TTL,
+                 shared: bool = SESSION_SHARED):
+        self.store = store or create_session_store()
+        self.cache_size = cache_size
+        self.idle_ttl = idle_ttl
+        self.shared = shared
+        self._sessions: "OrderedDict[int, UserSession]" = OrderedDict()
+        self._last_access: Dict[int, float] = {}
+        # Хэши сохранённых частей сессий
+        self._saved_hashes: Dict[int, Dict[str, str]] = {}
+        # Версии сессий в хранилище, известные этому процессу (-1 - неизвестна)
+        self._versions: Dict[int, int] = {}
+        # Выгруженные сессии, которые ещё используются обработчиками
+        self._detached: "weakref.WeakValueDictionary[int, UserSession]" = weakref.WeakValueDictionary()
+        # Фоновые записи выгруженных сессий (задача держит сессию до конца записи)
+        self._pending_writes: Set[asyncio.Task] = set()
+        # Пользователи без сессии в хранилище по последнему load_async (LRU)
+        self._absent: "OrderedDict[int, None]" = OrderedDict()
+
     def get_session(self, user_id: int) -> UserSession:
         """Получает или создает сессию пользователя"""
-        if user_id not in self._sessions:
-            self._sessions[user_id] = UserSession(user_id=user_id)
-        return self._sessions[user_id]
-    
+        session = self._get_loaded(user_id)
+        if session is None:
+            session = UserSession(user_id=user_id)
+            self._attach(session, {})
+        return session
+
     def has_session(self, user_id: int) -> bool:
         """Проверяет наличие сессии"""
-        return user_id in self._sessions
-    
+        return self._get_loaded(user_id) is not None
+
     def clear_session(self, user_id: int):
         """Очищает сессию пользователя"""
-        if user_id in self._sessions:
-            del self._sessions[user_id]
-    
+        self._sessions.pop(user_id, None)
+        self._last_access.pop(user_id, None)
+        self._saved_hashes.pop(user_id, None)
+        self._versions.pop(user_id, None)
+        self._detached.pop(user_id, None)
+        self._absent.pop(user_id, None)
+        self.store.delete(user_id)
+
     def get_all_sessions(self) -> Dict[int, UserSession]:
-        """Возвращает все активные сессии"""
-        return self._sessions.copy()
+        """Возвращает все активные сессии (загруженные в память)"""
+        return dict(self._sessions)
+
+    def persist(self, user_id: int):
+        """Сохраняет изменённые части сессии в хранилище"""
+        changes = self._collect_changes(user_id)
+        if changes:
+            self._write(user_id, *changes)
+
+    async def load_async(self, user_id: int) -> Optional[UserSession]:
+        """
+        Загружает сессию в память, читая хранилище в отдельном потоке
+
+        Вызывается перед обработкой апдейта, чтобы get_session в
+        обработчиках не обращался к хранилищу в event loop.
+
+        Returns:
+            Сессия или None, если её нет и в хранилище
+        """
+        session = self._get_cached(user_id)
+        if session is not None:
+            return session
+
+        self._absent.pop(user_id, None)
+        version, parts = await asyncio.to_thread(self._read, user_id)
+        # Пока читали, сессию мог загрузить или создать другой обработчик
+        session = self._get_cached(user_id)
+        if session is not None:
+            return session
+        if not parts:
+            # Обработчики апдейта не будут повторно читать хранилище
+            self._absent[user_id] = None
+            if len(self._absent) > self.cache_size:
+                self._absent.popitem(last=False)
+            return None
+        return self._attach_loaded(user_id, version, parts)
+
+    async def drain(self):
+        """Дожидается фоновой записи выгруженных сессий (перед flush при остановке)"""
+        while self._pending_writes:
+            await asyncio.gather(*list(self._pending_writes), return_exceptions=True)
+
+    async def persist_async(self, user_id: int):
+        """
+        Асинхронная версия persist
+
+        Сериализация выполняется в event loop (сессию меняют обработчики),
+        запись в хранилище - в отдельном потоке.
+        """
+        changes = self._collect_changes(user_id)
+        if changes:
+            await asyncio.to_thread(self._write, user_id, *changes)
+
+    async def refresh(self, user_id: int) -> bool:
+        """
+        Сбрасывает сессию из памяти, если её изменил другой процесс
+
+        Вызывается перед обработкой апдейта в режиме shared: следующий
+        get_session загрузит актуальную версию из хранилища.
+
+        Returns:
+            True, если сессия была сброшена
+        """
+        if not self.shared:
+            return False
+        if user_id not in self._sessions and user_id not in self._detached:
+            return False
+
+        version = await asyncio.to_thread(self.store.version, user_id)
+        if version == self._versions.get(user_id, 0):
+            return False
+
+        self._sessions.pop(user_id, None)
+        self._detached.pop(user_id, None)
+        self._last_access.pop(user_id, None)
+        self._saved_hashes.pop(user_id, None)
+        self._versions.pop(user_id, None)
+        logger.info(f"🔄 Сессия {user_id} изменена другим процессом, перечитываем")
+        return True
+
+    def flush(self):
+        """Сохраняет все загруженные сессии (при остановке бота)"""
+        for user_id in list(self._sessions):
+            self.persist(user_id)
+
+    def _get_loaded(self, user_id: int) -> Optional[UserSession]:
+        """Сессия из памяти или из хранилища (None, если её нет)"""
+        session = self._get_cached(user_id)
+        if session is not None or user_id in self._absent:
+            return session
+
+        version, parts = self._read(user_id)
+        if not parts:
+            return None
+        return self._attach_loaded(user_id, version, parts)
+
+    def _get_cached(self, user_id: int) -> Optional[UserSession]:
+        """Сессия из памяти, в том числе выгруженная, но ещё используемая (без обращения к хранилищу)"""
+        session = self._sessions.get(user_id)
+        if session is not None:
+            self._touch(user_id)
+            return session
+
+        # Сессия выгружена, но объект ещё жив - возвращаем его, а не копию из хранилища
+        session = self._detached.pop(user_id, None)
+        if session is not None:
+            self._attach(session, None)
+        return session
+
+    def _read(self, user_id: int) -> Tuple[int, Dict[str, str]]:
+        """Версия и части сессии из хранилища"""
+        # Версия читается до частей: если между чтениями сессию изменят,
+        # следующий refresh просто перечитает её ещё раз
+        version = self.store.version(user_id) if self.shared else 0
+        return version, self.store.load_parts(user_id)
+
+    def _attach_loaded(self, user_id: int, version: int, parts: Dict[str, str]) -> UserSession:
+        """Собирает сессию из прочитанных частей и помещает её в память"""
+        session = join_session(user_id, parts)
+        self._versions[user_id] = version
+        self._attach(session, {name: _hash_part(data) for name, data in parts.items()})
+        logger.info(f"📂 Сессия пользователя {user_id} загружена из хранилища")
+        return session
+
+    def _attach(self, session: UserSession, saved_hashes: Optional[Dict[str, str]]):
+        """Помещает сессию в горячий уровень"""
+        user_id = session.user_id
+        self._sessions[user_id] = session
+        self._absent.pop(user_id, None)
+        if saved_hashes is not None:
+            self._saved_hashes[user_id] = saved_hashes
+        self._touch(user_id)
+        self._evict()
+
+    def _touch(self, user_id: int):
+        self._sessions.move_to_end(user_id)
+        self._last_access[user_id] = time.monotonic()
+
+    def _evict(self):
+        """Выгружает лишние (LRU) и неактивные сессии, предварительно сохранив их"""
+        now = time.monotonic()
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            idle = now - self._last_access.get(user_id, now)
+            if len(self._sessions) <= self.cache_size and idle < self.idle_ttl:
+                break
+
+            changes = self._collect_changes(user_id)
+            if changes and not self._in_event_loop():
+                try:
+                    self._write(user_id, *changes)
+                except Exception as e:
+                    # Не выгружаем сессию, которую не удалось сохранить
+                    logger.error(f"❌ Не удалось сохранить сессию {user_id}: {e}")
+                    self._touch(user_id)
+                    break
+                changes = None
+
+            del self._sessions[user_id]
+            self._last_access.pop(user_id, None)
+            self._detached[user_id] = session
+            if changes:
+                task = asyncio.get_running_loop().create_task(self._write_evicted(session, changes))
+                self._pending_writes.add(task)
+                task.add_done_callback(self._pending_writes.discard)
+
+        # Хэши нужны только сессиям в памяти и ещё используемым выгруженным
+        if len(self._saved_hashes) > 2 * self.cache_size:
+            for user_id in list(self._saved_hashes):
+                if user_id not in self._sessions and user_id not in self._detached:
+                    del self._saved_hashes[user_id]
+                    self._versions.pop(user_id, None)
+
+    @staticmethod
+    def _in_event_loop() -> bool:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        return True
+
+    async def _write_evicted(self, session: UserSession,
+                             changes: Tuple[Dict[str, str], List[str], Dict[str, str]]):
+        """Сохраняет выгруженную сессию в отдельном потоке; при ошибке возвращает её в память"""
+        user_id = session.user_id
+        try:
+            await asyncio.to_thread(self._write, user_id, *changes)
+        except Exception as e:
+            logger.error(f"❌ Не удалось сохранить сессию {user_id}: {e}")
+            # Сессия остаётся в памяти, её сохранит следующий persist
+            if user_id not in self._sessions:
+                self._detached.pop(user_id, None)
+                self._sessions[user_id] = session
+                self._touch(user_id)
+
+    def _collect_changes(self, user_id: int) -> Optional[Tuple[Dict[str, str], List[str], Dict[str, str]]]:
+        """Изменённые и удалённые части сессии по сравнению с сохранёнными"""
+        session = self._sessions.get(user_id)
+        if session is None:
+            session = self._detached.get(user_id)
+        if session is None:
+            return None
+
+        parts = split_session(session)
+        hashes = {name: _hash_part(data) for name, data in parts.items()}
+        saved = self._saved_hashes.get(user_id, {})
+
+        changed = {name: data for name, data in parts.items() if saved.get(name) != hashes[name]}
+        removed = [name for name in saved if name not in parts]
+        if not changed and not removed:
+            return None
+
+        # Хэши обновляем сразу, чтобы параллельный persist не записал то же самое
+        self._saved_hashes[user_id] = hashes
+        return changed, removed, saved
+
+    def _write(self, user_id: int, changed: Dict[str, str], removed: List[str],
+               previous_hashes: Dict[str, str]):
+        """Записывает части в хранилище (при ошибке откатывает хэши)"""
+        known_version = self._versions.get(user_id, 0)
+        try:
+            version = self.store.write_parts(user_id, changed, removed)
+        except Exception:
+            if user_id in self._saved_hashes:
+                self._saved_hashes[user_id] = previous_hashes
+            raise
+        # Версия выросла больше чем на 1 - между нашими записями писал другой процесс
+        self._versions[user_id] = version if version == known_version + 1 else -1
+        logger.debug(f"💾 Сессия {user_id}: записано частей {len(changed)}, удалено {len(removed)}")
 
 
 # Глобальный экземпляр менеджера сессий
@@ -40,4 +333,3 @@ def get_session_manager() -> SessionManager:
     if _session_manager is None:
         _session_manager = SessionManager()
     return _session_manager
-
@@ -0,0 +1,271 @@
+"""Хранилища сессий пользователей"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from models import Course, Module, ModuleContent, UserSession
+
+logger = logging.getLogger(__name__)
+
+# Бэкенд хранения сессий: sqlite или memory
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'sqlite')
+
+# Путь к файлу SQLite с сессиями
+SESSION_DB_PATH = os.getenv('SESSION_DB_PATH', 'sessions.sqlite3')
+
+# Части сессии, которые сохраняются отдельно
+PART_META = "meta"
+PART_COURSE = "course"
+PART_COURSE_MODULE = "course_module:"
+PART_CURRENT_CONTENT = "current_module_content"  # только если текущего контента нет в module_contents
+PART_MODULE_CONTENT = "module_content:"
+
+
+def split_session(session: UserSession) -> Dict[str, str]:
+    """
+    Разбивает сессию на независимо сохраняемые части (JSON)
+
+    Курс хранится как заголовок плюс отдельная часть на каждый модуль,
+    контент модулей - отдельная часть на каждый модуль. Поэтому правка
+    одного слайда перезаписывает только контент одного модуля.
+    Текущий контент модуля - тот же объект, что и в module_contents,
+    поэтому сохраняется индекс модуля, а не вторая копия контента.
+    """
+    current_index = next(
+        (index for index, module_content in session.module_contents.items()
+         if module_content is session.current_module_content),
+        None
+    )
+    parts = {
+        PART_META: json.dumps({
+            "editing_mode": session.editing_mode,
+            "editing_path": session.editing_path,
+            "temp_data": session.temp_data,
+            "current_module_index": current_index,
+        }, ensure_ascii=False, default=str)
+    }
+
+    course = session.current_course
+    if course is not None:
+        parts[PART_COURSE] = course.json(exclude={"modules"}, ensure_ascii=False)
+        for index, module in enumerate(course.modules):
+            parts[f"{PART_COURSE_MODULE}{index}"] = module.json(ensure_ascii=False)
+
+    if session.current_module_content is not None and current_index is None:
+        parts[PART_CURRENT_CONTENT] = session.current_module_content.json(ensure_ascii=False)
+
+    for index, module_content in session.module_contents.items():
+        parts[f"{PART_MODULE_CONTENT}{index}"] = module_content.json(ensure_ascii=False)
+
+    return parts
+
+
+def join_session(user_id: int, parts: Dict[str, str]) -> UserSession:
+    """Собирает сессию из частей, сохранённых split_session"""
+    session = UserSession(user_id=user_id)
+    meta = {}
+
+    if PART_META in parts:
+        meta = json.loads(parts[PART_META])
+        session.editing_mode = meta.get("editing_mode", False)
+        session.editing_path = meta.get("editing_path")
+        session.temp_data = meta.get("temp_data") or {}
+
+    if PART_COURSE in parts:
+        module_parts = sorted(
+            (int(name[len(PART_COURSE_MODULE):]), data)
+            for name, data in parts.items() if name.startswith(PART_COURSE_MODULE)
+        )
+        session.current_course = Course(
+            **json.loads(parts[PART_COURSE]),
+            modules=[Module.parse_raw(data) for _, data in module_parts]
+        )
+
+    session.module_contents = {
+        int(name[len(PART_MODULE_CONTENT):]): ModuleContent.parse_raw(data)
+        for name, data in parts.items() if name.startswith(PART_MODULE_CONTENT)
+    }
+
+    # Текущий контент - ссылка на контент модуля (правки видны и в экспорте модуля)
+    current_index = meta.get("current_module_index")
+    if current_index is not None and current_index in session.module_contents:
+        session.current_module_content = session.module_contents[current_index]
+    elif PART_CURRENT_CONTENT in parts:
+        session.current_module_content = ModuleContent.parse_raw(parts[PART_CURRENT_CONTENT])
+
+    return session
+
+
+class SessionStore:
+    """
+    Базовый класс хранилища сессий
+
+    Хранилище работает с частями сессии (см. split_session):
+    load_parts возвращает все части пользователя, write_parts
+    записывает изменённые и удаляет исчезнувшие. Каждая запись
+    увеличивает версию сессии - по ней процессы, работающие с общим
+    хранилищем, узнают об изменениях, сделанных другими.
+    """
+
+    def load_parts(self, user_id: int) -> Dict[str, str]:
+        """Загружает все части сессии пользователя (пустой dict, если сессии нет)"""
+        raise NotImplementedError
+
+    def write_parts(self, user_id: int, changed: Dict[str, str], removed: Iterable[str]) -> int:
+        """Записывает изменённые части и удаляет удалённые, возвращает новую версию сессии"""
+        raise NotImplementedError
+
+    def version(self, user_id: int) -> int:
+        """Версия сессии (0, если сессии нет)"""
+        raise NotImplementedError
+
+    def exists(self, user_id: int) -> bool:
+        """Проверяет наличие сессии"""
+        raise NotImplementedError
+
+    def delete(self, user_id: int):
+        """Удаляет сессию пользователя"""
+        raise NotImplementedError
+
+    def user_ids(self) -> List[int]:
+        """Идентификаторы всех сохранённых сессий"""
+        raise NotImplementedError
+
+    def close(self):
+        """Освобождает ресурсы хранилища"""
+
+
+class MemorySessionStore(SessionStore):
+    """Хранилище в памяти процесса (части хранятся в сериализованном виде)"""
+
+    def __init__(self):
+        self._parts: Dict[int, Dict[str, str]] = {}
+        self._versions: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def load_parts(self, user_id: int) -> Dict[str, str]:
+        with self._lock:
+            return dict(self._parts.get(user_id, {}))
+
+    def write_parts(self, user_id: int, changed: Dict[str, str], removed: Iterable[str]) -> int:
+        with self._lock:
+            parts = self._parts.setdefault(user_id, {})
+            parts.update(changed)
+            for name in removed:
+                parts.pop(name, None)
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            return self._versions[user_id]
+
+    def version(self, user_id: int) -> int:
+        with self._lock:
+            return self._versions.get(user_id, 0)
+
+    def exists(self, user_id: int) -> bool:
+        with self._lock:
+            return user_id in self._parts
+
+    def delete(self, user_id: int):
+        with self._lock:
+            self._parts.pop(user_id, None)
+            self._versions.pop(user_id, None)
+
+    def user_ids(self) -> List[int]:
+        with self._lock:
+            return list(self._parts)
+
+
+class SQLiteSessionStore(SessionStore):
+    """Хранилище в SQLite: одна строка на каждую часть сессии"""
+
+    def __init__(self, path: str = SESSION_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS session_parts (
+                user_id INTEGER NOT NULL,
+                part TEXT NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (user_id, part)
+            )"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS session_versions (
+                user_id INTEGER PRIMARY KEY,
+                version INTEGER NOT NULL
+            )"""
+        )
+        self._conn.commit()
+
+    def load_parts(self, user_id: int) -> Dict[str, str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT part, data FROM session_parts WHERE user_id = ?", (user_id,)
+            ).fetchall()
+        return dict(rows)
+
+    def write_parts(self, user_id: int, changed: Dict[str, str], removed: Iterable[str]) -> int:
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO session_parts (user_id, part, data) VALUES (?, ?, ?)",
+                    [(user_id, name, data) for name, data in changed.items()]
+                )
+                self._conn.executemany(
+                    "DELETE FROM session_parts WHERE user_id = ? AND part = ?",
+                    [(user_id, name) for name in removed]
+                )
+                self._conn.execute(
+                    "INSERT INTO session_versions (user_id, version) VALUES (?, 1) "
+                    "ON CONFLICT(user_id) DO UPDATE SET version = version + 1",
+                    (user_id,)
+                )
+                row = self._conn.execute(
+                    "SELECT version FROM session_versions WHERE user_id = ?", (user_id,)
+                ).fetchone()
+        return row[0]
+
+    def version(self, user_id: int) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version FROM session_versions WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def exists(self, user_id: int) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM session_parts WHERE user_id = ? LIMIT 1", (user_id,)
+            ).fetchone()
+        return row is not None
+
+    def delete(self, user_id: int):
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM session_parts WHERE user_id = ?", (user_id,))
+                self._conn.execute("DELETE FROM session_versions WHERE user_id = ?", (user_id,))
+
+    def user_ids(self) -> List[int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT user_id FROM session_parts").fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_session_store(backend: str = SESSION_BACKEND) -> SessionStore:
+    """Создаёт хранилище сессий по имени бэкенда"""
+    if backend == "memory":
+        return MemorySessionStore()
+    if backend == "sqlite":
+        logger.info(f"💾 Сессии хранятся в SQLite: {SESSION_DB_PATH}")
+        return SQLiteSessionStore()
+    raise ValueError(f"Неизвестный бэкенд сессий: {backend}")
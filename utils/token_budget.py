@@ -0,0 +1,119 @@
+"""
+Бюджет токенов ответа: прогноз размера и max_tokens для запроса
+
+Размер ответа прогнозируется по тому, что просим сгенерировать
+(число лекций и слайдов, модулей и уроков), max_tokens - прогноз с
+запасом TOKEN_BUDGET_MARGIN, но не больше лимита модели. Если прогноз
+не помещается в лимит, запрос нужно разбить (см. TokenBudget.fits).
+После ответа прогноз сравнивается с фактическим completion_tokens.
+"""
+import logging
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, Sequence, Tuple
+
+from .metrics import get_metrics
+from .tokens import count_prompt_tokens
+
+logger = logging.getLogger(__name__)
+
+# Запас к прогнозу при выборе max_tokens
+TOKEN_BUDGET_MARGIN = float(os.getenv('TOKEN_BUDGET_MARGIN', '1.3'))
+
+# Минимальный max_tokens (короткие ответы сильнее отклоняются от прогноза)
+TOKEN_BUDGET_MIN = int(os.getenv('TOKEN_BUDGET_MIN', '512'))
+
+# Лимиты моделей: (окно контекста, максимум токенов ответа)
+MODEL_TOKEN_LIMITS: Dict[str, Tuple[int, int]] = {
+    "gpt-4": (8192, 8192),
+    "gpt-4-turbo-preview": (128000, 4096),
+}
+DEFAULT_MODEL_TOKEN_LIMITS = (8192, 4096)
+
+# Калибровка прогноза (токены ответа, по записанным ответам benchmarks/fixtures)
+TOKENS_PER_SLIDE = int(os.getenv('TOKEN_BUDGET_PER_SLIDE', '230'))
+TOKENS_PER_LECTURE = 200           # название, цели, выводы лекции
+TOKENS_PER_COURSE_MODULE = 80      # название и цель модуля в структуре курса
+TOKENS_PER_COURSE_LESSON = 100     # урок в структуре курса
+COURSE_LESSONS_PER_MODULE = 5      # промпт структуры просит 3-7 уроков
+TOKENS_PER_TOPIC_MATERIAL = 1600   # материал одной темы урока
+
+# Слайдов в лекции: промпты просят 8-12, больше пунктов плана - больше слайдов
+SLIDES_PER_LECTURE_MIN = 8
+SLIDES_PER_LECTURE_MAX = 12
+
+
+@dataclass
+class TokenBudget:
+    """Бюджет ответа одного запроса"""
+    template: str
+    predicted: int    # Прогноз токенов ответа
+    max_tokens: int   # max_tokens запроса
+    fits: bool        # Прогноз с запасом помещается в лимит модели
+
+    def observe(self, completion_tokens: int):
+        """Сравнивает прогноз с фактическим размером ответа (лог и метрика)"""
+        if not completion_tokens or not self.predicted:
+            return
+        ratio = completion_tokens / self.predicted
+        get_metrics().token_budget_ratio.observe(ratio, template=self.template)
+        logger.info(f"📏 Бюджет {self.template}: прогноз {self.predicted}, ответ {completion_tokens} "
+                    f"({ratio - 1:+.0%}), max_tokens {self.max_tokens}")
+
+    def observe_response(self, response: Any):
+        """observe по usage ответа chat.completions"""
+        usage = getattr(response, "usage", None)
+        self.observe(getattr(usage, "completion_tokens", 0) or 0)
+
+
+def model_output_limit(model: str, prompt_tokens: int) -> int:
+    """Сколько токенов ответа допускает модель при данном промпте"""
+    context_window, max_output = MODEL_TOKEN_LIMITS.get(model, DEFAULT_MODEL_TOKEN_LIMITS)
+    return max(0, min(max_output, context_window - prompt_tokens))
+
+
+def plan_token_budget(request: Dict[str, Any], template: str, predicted: int) -> TokenBudget:
+    """
+    Бюджет запроса по прогнозу: max_tokens = прогноз * TOKEN_BUDGET_MARGIN
+    в пределах [TOKEN_BUDGET_MIN, лимит модели]
+    """
+    limit = model_output_limit(request.get("model", ""), count_prompt_tokens(request))
+    wanted = max(TOKEN_BUDGET_MIN, int(predicted * TOKEN_BUDGET_MARGIN))
+    return TokenBudget(template=template, predicted=predicted, max_tokens=min(wanted, limit), fits=wanted <= limit)
+
+
+def apply_token_budget(request: Dict[str, Any], template: str, predicted: int) -> TokenBudget:
+    """plan_token_budget и max_tokens в запрос"""
+    budget = plan_token_budget(request, template, predicted)
+    request["max_tokens"] = budget.max_tokens
+    return budget
+
+
+def lecture_slide_target(outline_items: int) -> int:
+    """Ожидаемое число слайдов лекции по плану урока: титул, итоги и 1-2 слайда на пункт"""
+    return max(SLIDES_PER_LECTURE_MIN, min(SLIDES_PER_LECTURE_MAX, 2 + outline_items * 3 // 2))
+
+
+def predict_lecture_tokens(slides: int) -> int:
+    """Токены одной лекции с заданным числом слайдов"""
+    return TOKENS_PER_LECTURE + slides * TOKENS_PER_SLIDE
+
+
+def predict_module_content_tokens(outline_lengths: Sequence[int]) -> int:
+    """Токены контента модуля: по лекции на урок, outline_lengths - пункты плана уроков"""
+    return sum(predict_lecture_tokens(lecture_slide_target(items)) for items in outline_lengths)
+
+
+def predict_slides_tokens(slides: int) -> int:
+    """Токены нескольких слайдов (перегенерация слайдов)"""
+    return slides * TOKENS_PER_SLIDE
+
+
+def predict_course_structure_tokens(module_count: int) -> int:
+    """Токены структуры курса из module_count модулей"""
+    return module_count * (TOKENS_PER_COURSE_MODULE + COURSE_LESSONS_PER_MODULE * TOKENS_PER_COURSE_LESSON)
+
+
+def predict_topic_material_tokens() -> int:
+    """Токены материала одной темы урока"""
+    return TOKENS_PER_TOPIC_MATERIAL
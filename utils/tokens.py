@@ -0,0 +1,79 @@
+"""
+Подсчёт токенов промпта локальным токенизатором
+
+Используется tiktoken, если он установлен и словарь модели доступен
+(при первом обращении tiktoken скачивает его и кэширует на диске,
+поэтому бот загружает словарь при запуске). Иначе токены оцениваются
+по длине текста, как в лимитере запросов.
+"""
+import json
+import logging
+from typing import Any, Dict, Optional
+
+from .rate_limiter import MESSAGE_OVERHEAD_TOKENS, estimate_tokens
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Словарь для моделей, неизвестных tiktoken
+DEFAULT_ENCODING = "cl100k_base"
+
+# Токены, которыми API начинает ответ ассистента
+REPLY_PRIMING_TOKENS = 3
+
+# Словари tiktoken по модели
+_encodings: Dict[str, Any] = {}
+
+# Словарь не удалось загрузить (нет сети) - больше не пытаемся
+_unavailable = tiktoken is None
+
+
+def _get_encoding(model: str):
+    global _unavailable
+    if _unavailable:
+        return None
+    if model not in _encodings:
+        try:
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding(DEFAULT_ENCODING)
+        except Exception as e:
+            logger.warning(f"⚠️ Токенизатор недоступен, токены оцениваются по длине текста: {e}")
+            _unavailable = True
+            return None
+    return _encodings[model]
+
+
+def tokenizer_name(model: str = "gpt-4") -> str:
+    """Чем считаются токены модели: имя словаря tiktoken или "estimate" """
+    encoding = _get_encoding(model)
+    return encoding.name if encoding is not None else "estimate"
+
+
+def count_tokens(text: str, model: str = "gpt-4") -> int:
+    """Число токенов в тексте"""
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_prompt_tokens(request: Dict[str, Any], model: Optional[str] = None) -> int:
+    """
+    Токены промпта запроса chat.completions: сообщения и описание функций
+
+    Служебные токены сообщений считаются как в API; описание функций
+    API кодирует по-своему, его размер приблизительный.
+    """
+    model = model or request.get("model") or "gpt-4"
+    tokens = REPLY_PRIMING_TOKENS
+    for message in request.get("messages", []):
+        tokens += count_tokens(str(message.get("content") or ""), model) + MESSAGE_OVERHEAD_TOKENS
+    if request.get("tools"):
+        tokens += count_tokens(json.dumps(request["tools"], ensure_ascii=False), model)
+    return tokens
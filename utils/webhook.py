@@ -0,0 +1,221 @@
+"""Приём апдейтов Telegram через webhook на asyncio HTTP-сервере"""
+
+import asyncio
+import hmac
+import json
+import logging
+import os
+import signal
+from typing import Dict, Optional, Tuple
+
+from telegram import Update
+
+from .metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# Публичный адрес бота (https://bot.example.com), на него Telegram отправляет апдейты
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+
+# Путь, на котором принимаются апдейты
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+
+# Адрес, который слушает HTTP-сервер (TLS обычно завершает прокси перед ботом)
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+
+# Секрет, который Telegram передаёт в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN', '')
+
+# Максимальный размер тела запроса (байты) и время на чтение запроса (секунды)
+WEBHOOK_MAX_BODY_SIZE = int(os.getenv('WEBHOOK_MAX_BODY_SIZE', str(1024 * 1024)))
+WEBHOOK_READ_TIMEOUT = float(os.getenv('WEBHOOK_READ_TIMEOUT', '10'))
+
+# Сколько параллельных соединений Telegram открывает к webhook (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+MAX_HEADERS = 100
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    431: "Request Header Fields Too Large",
+}
+
+
+class WebhookServer:
+    """
+    HTTP-сервер, принимающий апдейты от Telegram
+
+    Апдейт проверяется (секрет, размер тела, JSON) и кладётся в
+    update_queue приложения - дальше его обрабатывает Application так же,
+    как при polling. Соединения keep-alive: Telegram переиспользует их.
+    С reuse_port несколько процессов слушают один порт, и ядро
+    распределяет соединения между ними.
+    """
+
+    def __init__(self, application, path: str = WEBHOOK_PATH, secret_token: str = WEBHOOK_SECRET_TOKEN,
+                 max_body_size: int = WEBHOOK_MAX_BODY_SIZE, read_timeout: float = WEBHOOK_READ_TIMEOUT):
+        self.application = application
+        self.path = path
+        self.secret_token = secret_token
+        self.max_body_size = max_body_size
+        self.read_timeout = read_timeout
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: set = set()
+
+    async def start(self, host: str = WEBHOOK_LISTEN, port: int = WEBHOOK_PORT, reuse_port: bool = False):
+        self._server = await asyncio.start_server(
+            self._handle_connection, host, port, reuse_port=reuse_port or None
+        )
+        logger.info(f"🌐 Webhook слушает http://{host}:{port}{self.path}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for task in list(self._connections):
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                request = await asyncio.wait_for(self._read_head(reader), timeout=self.read_timeout)
+                if request is None:
+                    break
+                status, keep_alive = await self._handle_request(reader, *request)
+                get_metrics().webhook_requests.inc(status=str(status))
+                self._respond(writer, status, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except ValueError:
+            # Строка запроса или заголовок длиннее лимита StreamReader
+            self._respond(writer, 431, keep_alive=False)
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _read_head(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str]]]:
+        """Строка запроса и заголовки (None, если клиент закрыл соединение)"""
+        request_line = await reader.readline()
+        if not request_line.strip():
+            return None
+        parts = request_line.decode("latin-1").split()
+        method, target = (parts[0], parts[1]) if len(parts) >= 2 else ("", "")
+
+        headers: Dict[str, str] = {}
+        while True:
+            line = await reader.readline()
+            if not line.strip():
+                break
+            if len(headers) >= MAX_HEADERS:
+                raise ValueError("Слишком много заголовков")
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return method, target, headers
+
+    async def _handle_request(self, reader: asyncio.StreamReader, method: str, target: str,
+                              headers: Dict[str, str]) -> Tuple[int, bool]:
+        """Обрабатывает запрос, возвращает (HTTP-статус, оставить ли соединение открытым)"""
+        keep_alive = headers.get("connection", "").lower() != "close"
+        length = headers.get("content-length")
+
+        if target.split("?")[0] != self.path:
+            return 404, False
+        if method != "POST":
+            return 405, False
+        if self.secret_token and not hmac.compare_digest(
+            headers.get(SECRET_HEADER, "").encode("latin-1"), self.secret_token.encode("latin-1")
+        ):
+            logger.warning("⚠️ Webhook: запрос с неверным секретом отклонён")
+            return 403, False
+        if length is None or not length.isdigit() or "transfer-encoding" in headers:
+            return 411, False
+        if int(length) > self.max_body_size:
+            logger.warning(f"⚠️ Webhook: тело запроса {length} байт больше лимита {self.max_body_size}")
+            return 413, False
+
+        body = await asyncio.wait_for(reader.readexactly(int(length)), timeout=self.read_timeout)
+        try:
+            data = json.loads(body)
+            if not isinstance(data, dict):
+                raise ValueError("Апдейт должен быть объектом JSON")
+            update = Update.de_json(data, self.application.bot)
+        except Exception as e:
+            logger.warning(f"⚠️ Webhook: некорректный апдейт: {e}")
+            return 400, keep_alive
+
+        await self.application.update_queue.put(update)
+        return 200, keep_alive
+
+    @staticmethod
+    def _respond(writer: asyncio.StreamWriter, status: int, keep_alive: bool):
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Length: 0\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1")
+        )
+
+
+def webhook_url() -> str:
+    """Полный адрес webhook, который регистрируется в Telegram"""
+    return WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH
+
+
+async def serve_webhook(application, register: bool = True, reuse_port: bool = False,
+                        secret_token: str = WEBHOOK_SECRET_TOKEN):
+    """
+    Запускает Application в режиме webhook и работает до SIGINT/SIGTERM
+
+    Повторяет жизненный цикл run_polling (post_init, start, stop,
+    post_shutdown), но апдейты приходят на WebhookServer.
+
+    Args:
+        register: Зарегистрировать webhook в Telegram (при нескольких
+            процессах это делает только один из них)
+        reuse_port: Разделять порт с другими процессами (SO_REUSEPORT)
+    """
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+
+    server = WebhookServer(application, secret_token=secret_token)
+    try:
+        await server.start(reuse_port=reuse_port)
+        if register:
+            await application.bot.set_webhook(
+                url=webhook_url(),
+                secret_token=secret_token or None,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+            )
+            logger.info(f"🔗 Webhook зарегистрирован: {webhook_url()}")
+        await stop_event.wait()
+    finally:
+        logger.info("⏹️ Остановка webhook...")
+        await server.stop()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)